@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import sys
+import time
+import multiprocessing
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')))
+
+import trollius as asyncio
+from trollius import From, Return
+import concurrent.futures
+
+import fte.conf
+import fte.client
+import fte.server
+import fte.aio
+
+
+MODES = ['threads', 'aio', 'aio+executor']
+STREAMS = [1, 16, 64]
+PAYLOAD = 'X' * 2 ** 16
+EXECUTOR_THREADS = 2
+TIMEOUT = 120
+LOCAL_INTERFACE = '127.0.0.1'
+ECHO_PORT = 8093
+SERVER_PORT = 8094
+CLIENT_PORT = 8095
+
+
+@asyncio.coroutine
+def echo(reader, writer):
+    while True:
+        data = yield From(reader.read(2 ** 16))
+        if not data:
+            break
+        writer.write(data)
+        yield From(writer.drain())
+    writer.close()
+
+
+def echo_server(ready):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(asyncio.start_server(echo, LOCAL_INTERFACE,
+                                                 ECHO_PORT))
+    ready.set()
+    loop.run_forever()
+
+
+def relay(mode, ready):
+    """Run an fteproxy client and server, relaying ``CLIENT_PORT`` to
+    ``ECHO_PORT``, in a single process.
+    """
+
+    if mode == 'threads':
+        server = fte.server.listener(LOCAL_INTERFACE, SERVER_PORT,
+                                     LOCAL_INTERFACE, ECHO_PORT)
+        client = fte.client.listener(LOCAL_INTERFACE, CLIENT_PORT,
+                                     LOCAL_INTERFACE, SERVER_PORT)
+        server.start()
+        client.start()
+        ready.set()
+        while True:
+            time.sleep(1)
+
+    executor = None
+    if mode == 'aio+executor':
+        executor = concurrent.futures.ThreadPoolExecutor(EXECUTOR_THREADS)
+    # don't share the event loop, or its epoll object, of our parent
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = fte.aio.server_listener(LOCAL_INTERFACE, SERVER_PORT,
+                                     LOCAL_INTERFACE, ECHO_PORT,
+                                     executor=executor)
+    client = fte.aio.client_listener(LOCAL_INTERFACE, CLIENT_PORT,
+                                     LOCAL_INTERFACE, SERVER_PORT,
+                                     executor=executor)
+    loop.run_until_complete(server.start())
+    loop.run_until_complete(client.start())
+    ready.set()
+    loop.run_forever()
+
+
+@asyncio.coroutine
+def stream(loop):
+    """Send ``PAYLOAD`` through the relay and read it back, returns the
+    number of seconds it took.
+    """
+
+    start = time.time()
+    [reader, writer] = yield From(asyncio.open_connection(
+        LOCAL_INTERFACE, CLIENT_PORT, loop=loop))
+    writer.write(PAYLOAD)
+    data = yield From(reader.readexactly(len(PAYLOAD)))
+    writer.close()
+    assert data == PAYLOAD
+    raise Return(time.time() - start)
+
+
+def doTest(loop, mode, num_streams):
+    """Returns the total throughput in KiB/s and the median time per stream,
+    when ``num_streams`` streams send ``PAYLOAD`` at once.
+    """
+
+    ready = multiprocessing.Event()
+    relay_process = multiprocessing.Process(target=relay, args=(mode, ready))
+    relay_process.start()
+    ready.wait()
+    time.sleep(0.1)
+
+    try:
+        start = time.time()
+        elapsed = loop.run_until_complete(asyncio.wait_for(
+            asyncio.gather(*[stream(loop) for i in range(num_streams)],
+                           loop=loop), TIMEOUT, loop=loop))
+        total = time.time() - start
+    finally:
+        relay_process.terminate()
+        relay_process.join()
+
+    kbps = (len(PAYLOAD) * num_streams / 1024.0) / total
+    return [kbps, sorted(elapsed)[len(elapsed) // 2]]
+
+
+def main():
+    """For the threaded fteproxy relay, and the ``fte.aio`` relay with and
+    without an executor, report the throughput and median stream time of a
+    client and server relaying to an echo server, over a range of concurrent
+    streams.
+    """
+
+    ready = multiprocessing.Event()
+    echo_process = multiprocessing.Process(target=echo_server, args=(ready,))
+    echo_process.start()
+    ready.wait()
+
+    loop = asyncio.get_event_loop()
+    try:
+        for num_streams in STREAMS:
+            for mode in MODES:
+                print ' + mode=' + mode + ', streams=' + str(num_streams)
+                try:
+                    [kbps, median] = doTest(loop, mode, num_streams)
+                except Exception as e:
+                    print '    - failed: ' + repr(e)
+                    continue
+                print '    - throughput: ' + str(round(kbps, 1)) + \
+                    'KiB/s, median stream: ' + str(round(median * 1000, 1)) + 'ms'
+    finally:
+        echo_process.terminate()
+        echo_process.join()
+
+
+if __name__ == '__main__':
+    main()
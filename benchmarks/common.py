@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Helpers shared by the benchmarks in this directory."""
+
+import select
+import socket
+import resource
+
+
+LOCAL_INTERFACE = '127.0.0.1'
+
+
+def raise_fd_limit():
+    """Raises our soft limit on open files to the hard limit, and returns
+    it."""
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+def echo_server(port, ready):
+    """An epoll echo server on ``port``, such that the relay is the only
+    thing measured. Sets ``ready`` once it's listening, and never returns.
+    """
+
+    raise_fd_limit()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((LOCAL_INTERFACE, port))
+    sock.listen(1024)
+    sock.setblocking(0)
+    poll = select.epoll()
+    poll.register(sock.fileno(), select.EPOLLIN)
+    conns = {}
+    ready.set()
+    while True:
+        for fd, events in poll.poll():
+            if fd == sock.fileno():
+                try:
+                    while True:
+                        conn, addr = sock.accept()
+                        conn.setblocking(0)
+                        conns[conn.fileno()] = conn
+                        poll.register(conn.fileno(), select.EPOLLIN)
+                except socket.error:
+                    pass
+                continue
+            conn = conns[fd]
+            try:
+                data = conn.recv(2 ** 16)
+            except socket.error:
+                data = ''
+            if data:
+                conn.setblocking(1)
+                conn.sendall(data)
+                conn.setblocking(0)
+            else:
+                poll.unregister(fd)
+                conn.close()
+                del conns[fd]
+
+
+def read_proc(pid, name, fields):
+    """Returns the values of ``fields`` in ``/proc/<pid>/<name>``, e.g.
+    ``VmRSS:`` in ``status``, as integers in the order given. ``pid`` may
+    be ``'self'``.
+    """
+
+    values = {}
+    with open('/proc/' + str(pid) + '/' + name) as f:
+        for line in f:
+            words = line.split()
+            if words and words[0] in fields:
+                values[words[0]] = int(words[1])
+    return [values[field] for field in fields]
+
+
+def memory(pid='self'):
+    """Returns the current and peak RSS of ``pid`` in KiB."""
+
+    return read_proc(pid, 'status', ['VmRSS:', 'VmHWM:'])
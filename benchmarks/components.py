@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Measures each layer of fteproxy on its own, for every format in the
+definitions file: how long building the format's DFA and rank table takes,
+ranks and unranks per second in fte.cDFA, encrypt and decrypt throughput of
+fte.encrypter, cells per second through fte.encoder, and push/pop
+throughput of fte.record_layer, over a range of cell sizes. Results are
+written as JSON with --output, and compared with a stored run with
+--baseline, in which case we exit non-zero if any metric regressed by more
+than its tolerance:
+
+    benchmarks/components.py --output baseline.json
+    benchmarks/components.py --baseline baseline.json --tolerance 0.1 \\
+        --tolerance-for 'cdfa.build_seconds/*=0.5'
+
+Metrics named ``*_seconds`` regress when they grow, all others when they
+shrink.
+"""
+
+import os
+import sys
+import time
+import json
+import random
+import fnmatch
+import argparse
+import itertools
+import platform
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')))
+
+import fte.conf
+import fte.defs
+import fte.dfa
+import fte.cDFA
+import fte.encoder
+import fte.encrypter
+import fte.bit_ops
+import fte.record_layer
+
+
+FORMAT_VERSION = 1
+CELL_SIZES = [64, 1024, 2 ** 14]
+# seconds that each measurement runs for, we keep the best of REPEATS
+DURATION = 0.2
+REPEATS = 3
+TOLERANCE = 0.1
+
+
+def rate(f, duration, repeats):
+    """Returns the best number of calls per second to ``f`` of ``repeats``
+    runs of ``duration`` seconds each. Seconds are of CPU time, such that
+    other processes on a busy machine don't count against us."""
+
+    best = 0.0
+    for i in range(repeats):
+        calls = 0
+        start = time.clock()
+        deadline = start + duration
+        while True:
+            f()
+            calls += 1
+            now = time.clock()
+            if now >= deadline:
+                break
+        best = max(best, calls / (now - start))
+    return best
+
+
+def measureDFA(metrics, language, duration, repeats):
+    regex = fte.defs.getRegex(language)
+    fixed_slice = fte.defs.getFixedSlice(language)
+
+    # a private table, rather than one from fte.dfa.table_dir
+    att_fst = fte.dfa._attFstMinimize(fte.dfa._attFstFromRegex(regex))
+    builds = [fte.cDFA.DFA(att_fst, fixed_slice).getStats()
+              for i in range(repeats)]
+    metrics['cdfa.build_seconds/' + language] = \
+        min(stats['build_ns'] for stats in builds) / 1e9
+    metrics['cdfa.build_table_seconds/' + language] = \
+        min(stats['build_table_ns'] for stats in builds) / 1e9
+
+    dfa = fte.dfa.from_regex(regex, fixed_slice)
+    words = dfa.getNumWordsInSlice(fixed_slice)
+    ranks = itertools.cycle([random.randint(0, words - 1)
+                             for i in range(2 ** 6)])
+    covertexts = itertools.cycle([dfa.unrank(ranks.next())
+                                  for i in range(2 ** 6)])
+    metrics['cdfa.unranks_per_sec/' + language] = rate(
+        lambda: dfa.unrank(ranks.next()), duration, repeats)
+    metrics['cdfa.ranks_per_sec/' + language] = rate(
+        lambda: dfa.rank(covertexts.next()), duration, repeats)
+
+
+def measureEncrypter(metrics, cell_size, duration, repeats):
+    encrypter = fte.encrypter.Encrypter()
+    plaintext = fte.bit_ops.random_bytes(cell_size)
+    ciphertext = encrypter.encrypt(plaintext)
+    key = '/' + str(cell_size)
+    metrics['encrypter.encrypt_mb_per_sec' + key] = rate(
+        lambda: encrypter.encrypt(plaintext), duration,
+        repeats) * cell_size / 1e6
+    metrics['encrypter.decrypt_mb_per_sec' + key] = rate(
+        lambda: encrypter.decrypt(ciphertext), duration,
+        repeats) * cell_size / 1e6
+
+
+def measureEncoder(metrics, language, cell_size, duration, repeats):
+    encoder = fte.encoder.RegexEncoder(fte.defs.getRegex(language),
+                                       fte.defs.getFixedSlice(language))
+    plaintext = fte.bit_ops.random_bytes(cell_size)
+    covertext = encoder.encode(plaintext)
+    key = '/' + language + '/' + str(cell_size)
+    metrics['encoder.encode_cells_per_sec' + key] = rate(
+        lambda: encoder.encode(plaintext), duration, repeats)
+    metrics['encoder.decode_cells_per_sec' + key] = rate(
+        lambda: encoder.decode(covertext), duration, repeats)
+
+
+def measureRecordLayer(metrics, language, cell_size, duration, repeats):
+    regex_encoder = fte.encoder.RegexEncoder(
+        fte.defs.getRegex(language), fte.defs.getFixedSlice(language))
+    encrypter = fte.encrypter.Encrypter()
+    framing = fte.conf.getValue('runtime.fte.record_layer.framing')
+    encoder = fte.record_layer.Encoder(encrypter=encrypter,
+                                       encoder=regex_encoder, framing=framing)
+    decoder = fte.record_layer.Decoder(decrypter=encrypter,
+                                       decoder=regex_encoder, framing=framing)
+    plaintext = 'X' * cell_size
+
+    def encode():
+        encoder.push(plaintext)
+        return encoder.pop()
+    covertext = encode()
+
+    def decode():
+        decoder.push(covertext)
+        while decoder.pop():
+            pass
+
+    key = '/' + language + '/' + str(cell_size)
+    metrics['record_layer.encode_mb_per_sec' + key] = rate(
+        encode, duration, repeats) * cell_size / 1e6
+    metrics['record_layer.decode_mb_per_sec' + key] = rate(
+        decode, duration, repeats) * cell_size / 1e6
+
+
+def run(languages, cell_sizes, duration, repeats):
+    """Returns a dict of metric name to value, for each of ``languages`` and
+    ``cell_sizes``."""
+
+    metrics = {}
+    for cell_size in cell_sizes:
+        measureEncrypter(metrics, cell_size, duration, repeats)
+    for language in languages:
+        sys.stderr.write(language + '\n')
+        measureDFA(metrics, language, duration, repeats)
+        for cell_size in cell_sizes:
+            measureEncoder(metrics, language, cell_size, duration, repeats)
+            measureRecordLayer(metrics, language, cell_size, duration,
+                               repeats)
+    return metrics
+
+
+def isRegression(name, baseline, current, tolerance):
+    if name.split('/')[0].endswith('_seconds'):
+        return current > baseline * (1 + tolerance)
+    return current < baseline * (1 - tolerance)
+
+
+def getTolerance(name, default, overrides):
+    """Returns the tolerance of the first of ``overrides``, each a
+    ``[pattern, tolerance]``, whose pattern matches ``name``, or
+    ``default``."""
+
+    for [pattern, tolerance] in overrides:
+        if fnmatch.fnmatch(name, pattern):
+            return tolerance
+    return default
+
+
+def compare(baseline, current, default, overrides):
+    """Prints each metric of ``current`` beside its value in ``baseline``,
+    and returns the names of those that regressed."""
+
+    regressions = []
+    for name in sorted(current.keys()):
+        value = current[name]
+        if name not in baseline:
+            print '    %-72s %12.4g  (new)' % (name, value)
+            continue
+        tolerance = getTolerance(name, default, overrides)
+        change = (value - baseline[name]) / (baseline[name] or 1.0)
+        status = ''
+        if isRegression(name, baseline[name], value, tolerance):
+            regressions.append(name)
+            status = 'REGRESSION, tolerance %.0f%%' % (tolerance * 100)
+        print '    %-72s %12.4g %+7.1f%%  %s' % (name, value, change * 100,
+                                                 status)
+    for name in sorted(set(baseline.keys()) - set(current.keys())):
+        print '    %-72s %12s  (missing)' % (name, '-')
+    return regressions
+
+
+def parseTolerance(value):
+    try:
+        [pattern, tolerance] = value.rsplit('=', 1)
+        return [pattern, float(tolerance)]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'expected PATTERN=FRACTION, got ' + repr(value))
+
+
+def main():
+    """Measure every layer for each format and cell size, write the results
+    to ``--output``, and compare them with ``--baseline``.
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Measure each layer of fteproxy for every format')
+    parser.add_argument('--formats', nargs='+',
+                        help='The formats to measure, every format in the definitions file by default')
+    parser.add_argument('--cell-sizes', nargs='+', type=int,
+                        default=CELL_SIZES,
+                        help='The plaintext bytes per cell to measure')
+    parser.add_argument('--duration', type=float, default=DURATION,
+                        help='The seconds each measurement runs for')
+    parser.add_argument('--repeats', type=int, default=REPEATS,
+                        help='The number of times each measurement runs, the best is kept')
+    parser.add_argument('--output',
+                        help='Write the results as JSON to this file')
+    parser.add_argument('--baseline',
+                        help='Compare the results with the JSON results in this file, and exit 1 if any regressed')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='The fraction by which a metric may be worse than the baseline')
+    parser.add_argument('--tolerance-for', type=parseTolerance,
+                        action='append', default=[],
+                        metavar='PATTERN=FRACTION',
+                        help='The tolerance of the metrics whose names match the glob PATTERN, the first match wins')
+    args = parser.parse_args()
+
+    languages = args.formats or sorted(fte.defs.load_definitions().keys())
+    metrics = run(languages, args.cell_sizes, args.duration, args.repeats)
+    results = {
+        'version': FORMAT_VERSION,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'release': fte.conf.getValue('fte.defs.release'),
+        'cell_sizes': args.cell_sizes,
+        'metrics': metrics,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    if not args.baseline:
+        print ' + ' + str(len(metrics)) + ' metrics'
+        for name in sorted(metrics.keys()):
+            print '    %-72s %12.4g' % (name, metrics[name])
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('version') != FORMAT_VERSION:
+        print 'Unsupported baseline version: ' + str(baseline.get('version'))
+        return 2
+    print ' + compared with ' + args.baseline + ' of ' + baseline['time']
+    regressions = compare(baseline['metrics'], metrics, args.tolerance,
+                          args.tolerance_for)
+    print ' + ' + str(len(regressions)) + ' of ' + str(len(metrics)) + \
+        ' metrics regressed'
+    return int(bool(regressions))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
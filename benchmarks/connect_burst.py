@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import sys
+import time
+import errno
+import select
+import socket
+import multiprocessing
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')))
+
+import fte.conf
+import fte.relay
+
+import common
+
+
+# [name, runtime.fte.relay.connect.threads, runtime.fte.relay.pool.size]
+CONFIGS = [['serial', 1, 0],
+           ['connectors', 16, 0],
+           ['connectors+pool', 16, 64]]
+BURST = 200
+ROUNDS = 3
+# the time for the pool to refill between bursts
+ROUND_INTERVAL = 3
+# loopback has no latency, so we add this much to each outgoing connect
+CONNECT_LATENCY = 0.02
+LOCAL_INTERFACE = '127.0.0.1'
+ECHO_PORT = 8098
+RELAY_PORT = 8099
+
+
+def relay(connect_threads, pool_size, ready):
+    fte.conf.setValue('runtime.fte.relay.backlog', 1024)
+    fte.conf.setValue('runtime.fte.relay.connect.threads', connect_threads)
+    fte.conf.setValue('runtime.fte.relay.pool.size', pool_size)
+
+    connect = fte.relay._connect
+
+    def slowConnect(remote_ip, remote_port):
+        time.sleep(CONNECT_LATENCY)
+        return connect(remote_ip, remote_port)
+    fte.relay._connect = slowConnect
+
+    l = fte.relay.listener(LOCAL_INTERFACE, RELAY_PORT,
+                           LOCAL_INTERFACE, ECHO_PORT)
+    l.start()
+    ready.set()
+    while True:
+        time.sleep(1)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def burst():
+    """Open ``BURST`` connections to the relay at once, each sends one byte.
+    Returns the time until every byte was echoed, and the time to first
+    byte of each connection.
+    """
+
+    poll = select.epoll()
+    conns = {}
+    started = {}
+    ttfb = []
+    start = time.time()
+    try:
+        for i in range(BURST):
+            conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            conn.setblocking(0)
+            started[conn.fileno()] = time.time()
+            assert conn.connect_ex((LOCAL_INTERFACE, RELAY_PORT)) in \
+                [0, errno.EINPROGRESS]
+            conns[conn.fileno()] = conn
+            poll.register(conn.fileno(), select.EPOLLOUT)
+
+        deadline = time.time() + 60
+        while len(ttfb) < BURST and time.time() < deadline:
+            for fd, events in poll.poll(1):
+                if events & select.EPOLLOUT:
+                    conns[fd].send('X')
+                    poll.modify(fd, select.EPOLLIN)
+                elif conns[fd].recv(1):
+                    ttfb.append(time.time() - started[fd])
+                    poll.unregister(fd)
+        assert len(ttfb) == BURST
+        return [time.time() - start, ttfb]
+    finally:
+        for conn in conns.values():
+            conn.close()
+        poll.close()
+
+
+def doTest(connect_threads, pool_size):
+    """Returns the connections per second and the p50 and p99 time to first
+    byte, over ``ROUNDS`` bursts.
+    """
+
+    ready = multiprocessing.Event()
+    relay_process = multiprocessing.Process(
+        target=relay, args=(connect_threads, pool_size, ready))
+    relay_process.start()
+    ready.wait()
+
+    elapsed = 0
+    ttfb = []
+    try:
+        for i in range(ROUNDS):
+            time.sleep(ROUND_INTERVAL)
+            [burst_elapsed, burst_ttfb] = burst()
+            elapsed += burst_elapsed
+            ttfb += burst_ttfb
+    finally:
+        relay_process.terminate()
+        relay_process.join()
+
+    return [BURST * ROUNDS / elapsed,
+            percentile(ttfb, 0.5), percentile(ttfb, 0.99)]
+
+
+def main():
+    """Report the connection rate and time to first byte of
+    ``fte.relay.listener`` for bursts of ``BURST`` connections, with serial
+    outgoing connects, with connector threads, and with connector threads and
+    a connection pool. Every outgoing connect takes an extra
+    ``CONNECT_LATENCY`` seconds, as it would to a remote upstream.
+    """
+
+    ready = multiprocessing.Event()
+    echo_process = multiprocessing.Process(target=common.echo_server,
+                                           args=(ECHO_PORT, ready))
+    echo_process.start()
+    ready.wait()
+
+    try:
+        for [name, connect_threads, pool_size] in CONFIGS:
+            print ' + ' + name + ': connect.threads=' + str(connect_threads) + \
+                ', pool.size=' + str(pool_size)
+            try:
+                [rate, p50, p99] = doTest(connect_threads, pool_size)
+            except Exception as e:
+                print '    - failed: ' + repr(e)
+                continue
+            print '    - connections/s: ' + str(round(rate, 1)) + \
+                ', time to first byte p50: ' + str(round(p50 * 1000, 1)) + \
+                'ms, p99: ' + str(round(p99 * 1000, 1)) + 'ms'
+    finally:
+        echo_process.terminate()
+        echo_process.join()
+
+
+if __name__ == '__main__':
+    main()
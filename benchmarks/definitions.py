@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+import os
+import sys
+import time
+import socket
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')))
+
+import fte.conf
+import fte.defs
+import fte.network_io
+import fte.client
+import fte.server
+
+
+DURATION = 5
+LOCAL_INTERFACE = '127.0.0.1'
+
+
+def main():
+    """Report the number of fteproxy connections per second a client and
+    server set up and negotiate, over a socket pair, and the number of
+    times each connection reads a definitions file.
+    """
+
+    opened = [0]
+    _open = open
+
+    def countingOpen(path, *args):
+        opened[0] += 1
+        return _open(path, *args)
+    fte.defs.open = countingOpen
+
+    # build the encoder of every language now, as bin/fteproxy does
+    for language in fte.defs.load_definitions().keys():
+        fte.defs.getDefinition(language).getEncoder()
+    opened[0] = 0
+
+    client = fte.client.listener(LOCAL_INTERFACE, 0, LOCAL_INTERFACE, 0)
+    server = fte.server.listener(LOCAL_INTERFACE, 0, LOCAL_INTERFACE, 0)
+
+    completed = 0
+    start = time.time()
+    while time.time() - start < DURATION:
+        [client_sock, server_sock] = socket.socketpair()
+        client_sock = client.onNewOutgoingConnection(client_sock)
+        server_sock = server.onNewIncomingConnection(server_sock)
+        for sock in [client_sock, server_sock]:
+            fte.network_io.close_socket(sock)
+        completed += 1
+    elapsed = time.time() - start
+
+    print ' + connections: ' + str(completed)
+    print '    - connections/s: ' + str(round(completed / elapsed, 1))
+    print '    - definitions files read per connection: ' + \
+        str(float(opened[0]) / completed)
+
+
+if __name__ == '__main__':
+    main()
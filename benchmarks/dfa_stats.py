@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import sys
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')))
+
+import fte.defs
+import fte.encoder
+
+
+CELLS = 2 ** 8
+
+
+def main():
+    """Encode and decode ``CELLS`` full cells with the encoder of every
+    language, and report the counters ``fte.cDFA`` kept for its DFA.
+    """
+
+    for language in sorted(fte.defs.load_definitions().keys()):
+        encoder = fte.encoder.RegexEncoder(fte.defs.getRegex(language),
+                                           fte.defs.getFixedSlice(language))
+        encoder.resetStats()
+        plaintext = 'X' * encoder.getMaximumBytesToRank()
+        for i in range(CELLS):
+            encoder.decode(encoder.encode(plaintext))
+        stats = encoder.getStats()
+
+        steps = stats['dense_steps'] + stats['goldberg_sipser_steps']
+        print ' + ' + language + ', fixed_slice=' + \
+            str(stats['fixed_slice']) + ', states=' + str(stats['states']) + \
+            ', symbols=' + str(stats['symbols'])
+        print '    - build: %.1fms, table: %.1fms, %.1fMiB' % (
+            stats['build_ns'] / 1e6, stats['build_table_ns'] / 1e6,
+            stats['table_bytes'] / 2.0 ** 20)
+        print '    - unrank: %.1fus/call, rank: %.1fus/call' % (
+            stats['unrank_ns'] / 1e3 / stats['unrank_calls'],
+            stats['rank_ns'] / 1e3 / stats['rank_calls'])
+        print '    - dense steps: %.1f%%' % (
+            100.0 * stats['dense_steps'] / steps)
+
+
+if __name__ == '__main__':
+    main()
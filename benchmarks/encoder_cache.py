@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+import os
+import sys
+import time
+import multiprocessing
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')))
+
+import fte.conf
+import fte.encoder
+
+import common
+
+
+# runtime.fte.encoder.cache_bytes, None never evicts
+BUDGETS = [None, 2 ** 22, 2 ** 20]
+FORMATS = 200
+FIXED_SLICE = 256
+
+
+def build(budget, results):
+    """Build ``FORMATS`` distinct formats, one at a time, as a server that
+    constructs encoders on demand would.
+    """
+
+    fte.conf.setValue('runtime.fte.encoder.cache_bytes', budget)
+    # private tables, such that our RSS is all of them
+    fte.conf.setValue('fte.dfa.table_dir', None)
+
+    rss_before = common.memory()[0]
+    start = time.time()
+    for i in range(FORMATS):
+        encoder = fte.encoder.RegexEncoder(
+            '^(GET|POST|PUT) /[a-z0-9]+' + str(i) + '$', FIXED_SLICE)
+        encoder.encode('X' * 16)
+    elapsed = time.time() - start
+    results.put([common.memory()[0] - rss_before, FORMATS / elapsed,
+                 fte.encoder.getCacheStats()])
+
+
+def main():
+    """Report the growth in RSS, and the rate, of building ``FORMATS``
+    distinct formats with each budget of the encoder cache.
+    """
+
+    for budget in BUDGETS:
+        print ' + cache_bytes=' + str(budget)
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target=build, args=(budget, results))
+        process.start()
+        [rss, rate, stats] = results.get()
+        process.join()
+        print '    - RSS growth: ' + str(rss / 1024) + 'MiB'
+        print '    - formats/s: ' + str(round(rate, 1))
+        print '    - cache: ' + str(stats['entries']) + ' entries, ' + \
+            str(stats['bytes'] / 1024) + 'KiB, ' + \
+            str(stats['evictions']) + ' evictions'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import math
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')))
+
+import fte.defs
+import fte.encoder
+import fte.encrypter
+import fte.record_layer
+
+
+CELL_SIZES = [256, 1024, 2 ** 14]
+WRITE_SIZE = 2 ** 16
+TRIALS = 2 ** 4
+
+
+def goodput(record_layer_outgoing, write_size):
+    """Returns the ratio of payload bytes to covertext bytes, for writes of
+    ``write_size`` bytes that are popped in a single run of cells.
+    """
+
+    bytes_on_wire = 0
+    for i in range(TRIALS):
+        record_layer_outgoing.push('X' * write_size)
+        bytes_on_wire += len(record_layer_outgoing.pop())
+
+    return (1.0 * write_size * TRIALS) / bytes_on_wire
+
+
+def main():
+    """For each format in the definitions file, report the fractional
+    capacity of its slice that ``OPTION_FRACTIONAL_PACKING`` can use, and the
+    goodput of ``FRAMING_V2`` with and without the option, for a range of
+    maximum cell sizes.
+    """
+
+    encrypter = fte.encrypter.Encrypter()
+
+    definitions = fte.defs.load_definitions()
+    for language in sorted(definitions.keys()):
+        regex = fte.defs.getRegex(language)
+        fixed_slice = fte.defs.getFixedSlice(language)
+        regex_encoder = fte.encoder.RegexEncoder(regex, fixed_slice)
+        radix = regex_encoder.getRadix()
+
+        spare_bits = 0.0
+        if radix > 2:
+            spare_bits = math.log(radix - 1, 2)
+        print ' + format_name="' + language + '", fixed_slice=' + str(fixed_slice)
+        print '    - radix=' + str(radix) + ', spare bits per cell: ' + \
+            str(round(spare_bits, 2))
+        for cell_size in CELL_SIZES:
+            fte.record_layer.MAX_CELL_SIZE = cell_size
+            results = []
+            for options in [0, fte.record_layer.OPTION_FRACTIONAL_PACKING]:
+                record_layer_outgoing = fte.record_layer.Encoder(
+                    encrypter=encrypter, encoder=regex_encoder,
+                    framing=fte.record_layer.FRAMING_V2, options=options)
+                results.append(goodput(record_layer_outgoing, WRITE_SIZE))
+            print '    - goodput, ' + str(cell_size) + ' byte cells: ' + \
+                'v2=' + str(round(results[0], 5)) + \
+                ', v2+fractional=' + str(round(results[1], 5)) + \
+                ', gain=' + \
+                str(round(100 * (results[1] / results[0] - 1), 3)) + '%'
+
+
+if __name__ == '__main__':
+    main()
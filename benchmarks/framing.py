@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import sys
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')))
+
+import fte.defs
+import fte.encoder
+import fte.encrypter
+import fte.record_layer
+
+
+PAYLOAD_SIZES = [1, 16, 64, 256, 1024, 2 ** 14]
+TRIALS = 2 ** 6
+
+
+def goodput(record_layer_outgoing, payload_size):
+    """Returns the ratio of payload bytes to covertext bytes, for cells that
+    carry exactly ``payload_size`` bytes of payload.
+    """
+
+    bytes_on_wire = 0
+    for i in range(TRIALS):
+        record_layer_outgoing.push('X' * payload_size)
+        bytes_on_wire += len(record_layer_outgoing.pop())
+
+    return (1.0 * payload_size * TRIALS) / bytes_on_wire
+
+
+def main():
+    """For each format in the definitions file, report the goodput of
+    ``FRAMING_V1`` and ``FRAMING_V2`` cells over a range of payload sizes.
+    Also report the number of payload bytes that fit into the unranked region
+    of a cell, which is where the two framings differ.
+    """
+
+    encrypter = fte.encrypter.Encrypter()
+    expansion = fte.encrypter.Encrypter._CTXT_EXPANSION
+
+    definitions = fte.defs.load_definitions()
+    for language in sorted(definitions.keys()):
+        regex = fte.defs.getRegex(language)
+        fixed_slice = fte.defs.getFixedSlice(language)
+        regex_encoder = fte.encoder.RegexEncoder(regex, fixed_slice)
+        capacity = regex_encoder.getCapacity() / 8
+
+        print ' + format_name="' + language + '", fixed_slice=' + str(fixed_slice)
+        print '    - unranked payload bytes per cell: v1=' + \
+            str(capacity - 16 - expansion) + ', v2=' + \
+            str(capacity - expansion)
+        for payload_size in PAYLOAD_SIZES:
+            results = []
+            for framing in fte.record_layer.SUPPORTED_FRAMINGS:
+                record_layer_outgoing = fte.record_layer.Encoder(
+                    encrypter=encrypter, encoder=regex_encoder,
+                    framing=framing)
+                results.append(goodput(record_layer_outgoing, payload_size))
+            print '    - goodput, ' + str(payload_size) + ' byte payload: ' + \
+                ', '.join(['v' + str(framing) + '=' + str(round(result, 4))
+                           for framing, result in
+                           zip(fte.record_layer.SUPPORTED_FRAMINGS, results)])
+
+
+if __name__ == '__main__':
+    main()
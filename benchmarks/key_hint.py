@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+import os
+import sys
+import time
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')))
+
+import fte
+import fte.conf
+import fte.defs
+import fte.bit_ops
+import fte.encoder
+import fte.encrypter
+
+
+NUM_KEYS = [1, 100, 10000]
+DURATION = 2
+# negotiations to complete before we start timing
+WARMUP = 1000
+
+
+def doTest(num_keys):
+    """Returns the time it takes a server with ``num_keys`` keys to compute
+    the key hints it accepts, the negotiations per second it completes
+    with a client that sends a key hint, and the time it takes to find
+    that client's key by trying each key in turn, instead.
+    """
+
+    keys = [fte.bit_ops.random_bytes(32) for i in range(num_keys)]
+    fte.conf.setValue('runtime.fte.encrypter.keys', keys)
+    fte.conf.setValue('runtime.fte.encrypter.key_hint', True)
+
+    language = fte.conf.getValue('runtime.state.upstream_language')
+    regex = fte.defs.getRegex(language)
+    fixed_slice = fte.defs.getFixedSlice(language)
+    client_encrypter = fte.encrypter.Encrypter(K1=keys[-1][:16],
+                                               K2=keys[-1][16:])
+    cell = fte.NegotiationManager().makeClientNegotiationCell(
+        client_encrypter, regex, fixed_slice, regex, fixed_slice)
+
+    start = time.time()
+    fte.NegotiationManager._getKeyRing().lookup('')
+    hints_elapsed = time.time() - start
+
+    for i in range(WARMUP):
+        fte.NegotiationManager().doServerSideNegotiation(
+            fte.encrypter.Encrypter(), cell)
+
+    completed = 0
+    start = time.time()
+    while time.time() - start < DURATION:
+        fte.NegotiationManager().doServerSideNegotiation(
+            fte.encrypter.Encrypter(), cell)
+        completed += 1
+    rate = completed / (time.time() - start)
+
+    # the first slice is decoded once, then each key is tried on its
+    # ciphertext, as a server without key hints would have to
+    encrypters = [fte.encrypter.Encrypter(K1=key[:16], K2=key[16:])
+                  for key in keys]
+    start = time.time()
+    incoming_msg = fte.encoder.RegexEncoder(regex, fixed_slice).decode(cell)
+    for encrypter in encrypters:
+        try:
+            encrypter.decrypt(incoming_msg)
+            break
+        except fte.encrypter.UnrecoverableDecryptionError:
+            continue
+    trial_elapsed = time.time() - start
+
+    return [hints_elapsed, rate, trial_elapsed]
+
+
+def main():
+    """Report the cost of negotiation for a server that accepts many keys,
+    as the number of keys grows.
+    """
+
+    # build the encoder of every language now, as bin/fteproxy does
+    fte.NegotiationManager._getLanguages()
+
+    for num_keys in NUM_KEYS:
+        print ' + keys=' + str(num_keys)
+        [hints_elapsed, rate, trial_elapsed] = doTest(num_keys)
+        print '    - key hints of 3 epochs computed in ' + \
+            str(round(hints_elapsed * 1000, 1)) + 'ms'
+        print '    - negotiations/s with a key hint: ' + str(round(rate, 1))
+        print '    - ms to find a key without a key hint: ' + \
+            str(round(trial_elapsed * 1000, 1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+import os
+import sys
+import time
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')))
+
+import fte.conf
+import fte.defs
+import fte.encoder
+import fte.encrypter
+import fte.metrics
+import fte.record_layer
+
+
+# the sizes of the messages we push through the record layer, in bytes
+MESSAGE_SIZES = [64, 2 ** 12, 2 ** 16]
+DURATION = 10
+# fte.metrics disabled and enabled, alternately, this many times each
+ROUNDS = 5
+
+
+def throughput(message_size):
+    """Returns the plaintext bytes per second of CPU time we encode and
+    decode, in messages of ``message_size`` bytes, through the record layer
+    of ``runtime.state.upstream_language``.
+    """
+
+    language = fte.conf.getValue('runtime.state.upstream_language')
+    regex_encoder = fte.encoder.RegexEncoder(
+        fte.defs.getRegex(language), fte.defs.getFixedSlice(language))
+    encrypter = fte.encrypter.Encrypter()
+    encoder = fte.record_layer.Encoder(encrypter=encrypter,
+                                       encoder=regex_encoder)
+    decoder = fte.record_layer.Decoder(decrypter=encrypter,
+                                       decoder=regex_encoder)
+
+    message = 'X' * message_size
+    total = 0
+    start = time.clock()
+    deadline = time.time() + DURATION / float(ROUNDS * 2)
+    while time.time() < deadline:
+        encoder.push(message)
+        decoder.push(encoder.pop())
+        while True:
+            data = decoder.pop()
+            if not data:
+                break
+            total += len(data)
+    return total / (time.clock() - start)
+
+
+def main():
+    """Report the record-layer throughput with ``fte.metrics`` disabled and
+    enabled, and the overhead of recording, for each of ``MESSAGE_SIZES``.
+    Each is measured ``ROUNDS`` times, alternately, and the best kept.
+    """
+
+    for message_size in MESSAGE_SIZES:
+        print ' + message size=' + str(message_size)
+        rates = {False: 0, True: 0}
+        for i in range(ROUNDS):
+            for enabled in [False, True]:
+                if enabled:
+                    fte.metrics.start()
+                else:
+                    fte.metrics.stop()
+                rates[enabled] = max(rates[enabled], throughput(message_size))
+        fte.metrics.stop()
+        print '    - disabled: ' + str(round(rates[False] / 2 ** 20, 2)) + 'MiB/s'
+        print '    - enabled: ' + str(round(rates[True] / 2 ** 20, 2)) + 'MiB/s'
+        print '    - overhead: ' + \
+            str(round(100 * (1 - rates[True] / rates[False]), 1)) + '%'
+
+
+if __name__ == '__main__':
+    main()
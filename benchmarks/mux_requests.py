@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import sys
+import time
+import socket
+import threading
+import SocketServer
+import multiprocessing
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')))
+
+import fte.conf
+import fte.defs
+import fte.encoder
+import fte.relay
+import fte.client
+import fte.server
+
+
+# runtime.fte.mux.connections, 0 is a connection per request
+MUX_CONNECTIONS = [0, 1, 4]
+CLIENTS = 16
+DURATION = 10
+# loopback has no latency, so we add this much to each connect from the
+# fteproxy client to the fteproxy server
+CONNECT_LATENCY = 0.02
+REQUEST = 'GET / HTTP/1.1\r\nHost: example.com\r\n\r\n'
+RESPONSE = 'HTTP/1.1 200 OK\r\nContent-Length: 1024\r\n\r\n' + 'X' * 1024
+LOCAL_INTERFACE = '127.0.0.1'
+HTTP_PORT = 8102
+SERVER_PORT = 8103
+CLIENT_PORT = 8104
+
+
+class HTTPHandler(SocketServer.BaseRequestHandler):
+
+    def handle(self):
+        received = ''
+        while not received.endswith('\r\n\r\n'):
+            data = self.request.recv(2 ** 12)
+            if not data:
+                return
+            received += data
+        self.request.sendall(RESPONSE)
+
+
+class HTTPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def http_server(ready):
+    server = HTTPServer((LOCAL_INTERFACE, HTTP_PORT), HTTPHandler)
+    ready.set()
+    server.serve_forever()
+
+
+def relay(listener_class, local_port, remote_port, mux_connections, ready):
+    fte.conf.setValue('runtime.fte.relay.backlog', 1024)
+    fte.conf.setValue('runtime.fte.mux.connections', mux_connections)
+    if listener_class is fte.client.listener:
+        connect = fte.relay._connect
+
+        def slowConnect(remote_ip, remote_port):
+            time.sleep(CONNECT_LATENCY)
+            return connect(remote_ip, remote_port)
+        fte.relay._connect = slowConnect
+
+    # build the encoders of every language now, as bin/fteproxy does
+    for language in fte.defs.load_definitions().keys():
+        fte.encoder.RegexEncoder(fte.defs.getRegex(language),
+                                 fte.defs.getFixedSlice(language))
+    l = listener_class(LOCAL_INTERFACE, local_port,
+                       LOCAL_INTERFACE, remote_port)
+    l.start()
+    ready.set()
+    while True:
+        time.sleep(1)
+
+
+def start(target, *args):
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=target, args=args + (ready,))
+    process.start()
+    ready.wait()
+    return process
+
+
+def client(deadline, results):
+    """Send ``REQUEST`` over a new connection, and read the whole response,
+    until ``deadline``.
+    """
+
+    completed = 0
+    while time.time() < deadline:
+        sock = socket.create_connection((LOCAL_INTERFACE, CLIENT_PORT))
+        try:
+            sock.sendall(REQUEST)
+            received = ''
+            while True:
+                data = sock.recv(2 ** 12)
+                if not data:
+                    break
+                received += data
+        finally:
+            sock.close()
+        assert received == RESPONSE
+        completed += 1
+    results.append(completed)
+
+
+def doTest(mux_connections):
+    """Returns the requests per second of ``CLIENTS`` concurrent clients,
+    through an fteproxy client that multiplexes over ``mux_connections``
+    connections.
+    """
+
+    processes = [start(relay, fte.server.listener, SERVER_PORT, HTTP_PORT,
+                       mux_connections),
+                 start(relay, fte.client.listener, CLIENT_PORT, SERVER_PORT,
+                       mux_connections)]
+    time.sleep(0.5)
+
+    try:
+        results = []
+        deadline = time.time() + DURATION
+        threads = [threading.Thread(target=client, args=(deadline, results))
+                   for i in range(CLIENTS)]
+        start_time = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - start_time
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()
+
+    assert len(results) == CLIENTS
+    return sum(results) / elapsed
+
+
+def main():
+    """Report the requests per second of ``CLIENTS`` concurrent clients,
+    each sending one small HTTP request per connection, through an fteproxy
+    client and server, with a connection per request and multiplexed over
+    ``runtime.fte.mux.connections`` connections.
+    """
+
+    http_process = start(http_server)
+    try:
+        for mux_connections in MUX_CONNECTIONS:
+            print ' + mux.connections=' + str(mux_connections)
+            try:
+                rate = doTest(mux_connections)
+            except Exception as e:
+                print '    - failed: ' + repr(e)
+                continue
+            print '    - requests/s: ' + str(round(rate, 1))
+    finally:
+        http_process.terminate()
+        http_process.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')))
+
+import fte
+import fte.conf
+import fte.defs
+import fte.encoder
+import fte.encrypter
+
+
+NUM_LANGUAGES = [1, 4, 16, 64]
+# the size of each read by the server, the whole cell arrives in one read
+# if None
+READ_SIZES = [None, 16]
+DURATION = 2
+REGEX = '^GET\\ \\/lang%d\\/([a-zA-Z0-9\\.\\/]*) HTTP/1\\.1\\r\\n\\r\\n$'
+FIXED_SLICE = 128
+
+
+def makeDefinitions(defs_dir, num_languages):
+    """Writes a definitions file with ``num_languages`` HTTP-like languages
+    to ``defs_dir``, and returns its release.
+    """
+
+    release = str(20140000 + num_languages)
+    definitions = {}
+    for i in range(num_languages):
+        for direction in ['request', 'response']:
+            definitions['lang' + str(i) + '-' + direction] = {
+                'regex': REGEX % i, 'fixed_slice': FIXED_SLICE}
+    with open(os.path.join(defs_dir, release + '.json'), 'w') as fh:
+        json.dump(definitions, fh)
+
+    return release
+
+
+def doTest(release, num_languages, read_size):
+    """Returns the number of negotiations per second a server completes,
+    when clients speak the last of ``num_languages`` languages and their
+    negotiation cell is read ``read_size`` bytes at a time.
+    """
+
+    fte.conf.setValue('fte.defs.release', release)
+    language = 'lang' + str(num_languages - 1) + '-request'
+    fte.conf.setValue('runtime.state.upstream_language', language)
+
+    # build the encoder of every language now, as bin/fteproxy does
+    for name in fte.defs.load_definitions().keys():
+        fte.encoder.RegexEncoder(fte.defs.getRegex(name),
+                                 fte.defs.getFixedSlice(name))
+
+    regex = fte.defs.getRegex(language)
+    cell = fte.NegotiationManager().makeClientNegotiationCell(
+        fte.encrypter.Encrypter(), regex, FIXED_SLICE, regex, FIXED_SLICE)
+    if read_size is None:
+        read_size = len(cell)
+
+    completed = 0
+    start = time.time()
+    while time.time() - start < DURATION:
+        # as FTEHelper._processRecv does, for each read
+        encrypter = fte.encrypter.Encrypter()
+        manager = fte.NegotiationManager()
+        received = ''
+        for i in range(0, len(cell), read_size):
+            received += cell[i:i + read_size]
+            try:
+                manager.doServerSideNegotiation(encrypter, received)
+                break
+            except Exception:
+                continue
+        else:
+            raise Exception('Negotiation failed.')
+        completed += 1
+
+    return completed / (time.time() - start)
+
+
+def main():
+    """Report the negotiations per second of an fteproxy server as the
+    number of languages in its definitions grows, with the client's
+    negotiation cell arriving in one read, and in many small reads.
+    """
+
+    defs_dir = tempfile.mkdtemp()
+    fte.conf.setValue('general.defs_dir', defs_dir)
+    try:
+        for num_languages in NUM_LANGUAGES:
+            release = makeDefinitions(defs_dir, num_languages)
+            print ' + languages=' + str(num_languages)
+            for read_size in READ_SIZES:
+                rate = doTest(release, num_languages, read_size)
+                print '    - read size ' + str(read_size or 'whole cell') + \
+                    ', connections/s: ' + str(round(rate, 1))
+    finally:
+        shutil.rmtree(defs_dir)
+
+
+if __name__ == '__main__':
+    main()
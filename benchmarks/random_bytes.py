@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import sys
+import time
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')))
+
+import fte.bit_ops
+import fte.defs
+import fte.encoder
+import fte.encrypter
+import fte.record_layer
+
+
+CELLS = 2 ** 12
+CALLS = 2 ** 16
+PAYLOAD = 'X' * 16
+LANGUAGE = 'manual-http-request'
+
+
+class _CountingUrandom(object):
+
+    """Wraps ``os.urandom`` and counts the number of times it is invoked."""
+
+    def __init__(self, urandom):
+        self._urandom = urandom
+        self.calls = 0
+
+    def __call__(self, N):
+        self.calls += 1
+        return self._urandom(N)
+
+
+def doTest(random_bytes):
+    """Encode ``CELLS`` cells of ``PAYLOAD`` with ``fte.bit_ops.random_bytes``
+    replaced by ``random_bytes``. Returns the number of calls to ``os.urandom``
+    and the elapsed time, per cell.
+    """
+
+    regex = fte.defs.getRegex(LANGUAGE)
+    fixed_slice = fte.defs.getFixedSlice(LANGUAGE)
+    encoder = fte.record_layer.Encoder(
+        encrypter=fte.encrypter.Encrypter(),
+        encoder=fte.encoder.RegexEncoder(regex, fixed_slice))
+
+    urandom = os.urandom
+    counter = _CountingUrandom(urandom)
+    _random_bytes = fte.bit_ops.random_bytes
+    os.urandom = counter
+    fte.bit_ops.random_bytes = random_bytes
+    try:
+        startTimer = time.time()
+        for i in range(CELLS):
+            encoder.push(PAYLOAD)
+            encoder.pop()
+        elapsed = time.time() - startTimer
+    finally:
+        os.urandom = urandom
+        fte.bit_ops.random_bytes = _random_bytes
+
+    return (1.0 * counter.calls / CELLS), (elapsed / CELLS)
+
+
+def doCallTest(random_bytes, N=8):
+    """Returns the time spent per call of ``random_bytes(N)``."""
+
+    startTimer = time.time()
+    for i in range(CALLS):
+        random_bytes(N)
+    elapsed = time.time() - startTimer
+
+    return elapsed / CALLS
+
+
+def main():
+    """Compare the number of ``os.urandom`` syscalls and the time spent per cell,
+    with and without the buffered CSPRNG behind ``fte.bit_ops.random_bytes``.
+    """
+
+    print 'Encoding', CELLS, 'cells of', len(PAYLOAD), 'bytes with', LANGUAGE
+
+    for name, random_bytes in [('os.urandom', lambda N: os.urandom(N)),
+                               ('buffered', fte.bit_ops.random_bytes)]:
+        syscalls, elapsed = doTest(random_bytes)
+        per_call = doCallTest(random_bytes)
+        print ' + random_bytes="' + name + '"'
+        print '    - time per 8-byte call: ' + str(round(per_call * 10 ** 6, 2)) + 'us'
+        print '    - os.urandom calls per cell: ' + str(round(syscalls, 4))
+        print '    - time per cell: ' + str(round(elapsed * 10 ** 6, 2)) + 'us'
+
+
+if __name__ == '__main__':
+    main()
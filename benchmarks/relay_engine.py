@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import time
+import errno
+import select
+import socket
+import multiprocessing
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')))
+
+import fte.conf
+import fte.relay
+
+import common
+
+
+ENGINES = ['threads', 'eventloop']
+CONNECTIONS = [256, 1000, 10000]
+IDLE_SECONDS = 2
+ROUNDS = 5
+MESSAGE = 'X' * 64
+LOCAL_INTERFACE = '127.0.0.1'
+ECHO_PORT = 8091
+RELAY_PORT = 8092
+# select() in fte.network_io can't watch file descriptors above FD_SETSIZE
+FD_SETSIZE = 1024
+
+
+def relay(engine, ready):
+    common.raise_fd_limit()
+    fte.conf.setValue('runtime.fte.relay.engine', engine)
+    fte.conf.setValue('runtime.fte.relay.backlog', 1024)
+    l = fte.relay.listener(LOCAL_INTERFACE, RELAY_PORT,
+                           LOCAL_INTERFACE, ECHO_PORT)
+    l.start()
+    ready.set()
+    while True:
+        time.sleep(1)
+
+
+def proc_stats(pid):
+    """Returns the CPU seconds, RSS in KiB and number of threads of ``pid``."""
+
+    with open('/proc/' + str(pid) + '/stat') as f:
+        fields = f.read().split(')')[-1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / \
+        float(os.sysconf(os.sysconf_names['SC_CLK_TCK']))
+    [rss, threads] = common.read_proc(pid, 'status', ['VmRSS:', 'Threads:'])
+    return cpu, rss, threads
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def doTest(engine, num_connections):
+    """Relay ``num_connections`` connections with ``engine``. Returns the
+    idle CPU usage, RSS and threads of the relay, then the p50 and p99 round
+    trip latency when every connection sends ``MESSAGE`` at once. The
+    latencies are ``None`` if the relay didn't keep up.
+    """
+
+    ready = multiprocessing.Event()
+    echo_process = multiprocessing.Process(target=common.echo_server,
+                                           args=(ECHO_PORT, ready))
+    echo_process.start()
+    ready.wait()
+    ready.clear()
+    relay_process = multiprocessing.Process(target=relay, args=(engine, ready))
+    relay_process.start()
+    ready.wait()
+    time.sleep(0.5)
+
+    conns = []
+    try:
+        for i in range(num_connections):
+            conn = socket.create_connection((LOCAL_INTERFACE, RELAY_PORT))
+            conns.append(conn)
+        time.sleep(1)
+
+        cpu_start = proc_stats(relay_process.pid)[0]
+        time.sleep(IDLE_SECONDS)
+        cpu_end, rss, threads = proc_stats(relay_process.pid)
+        idle_cpu = (cpu_end - cpu_start) / IDLE_SECONDS
+
+        poll = select.epoll()
+        by_fd = {}
+        for conn in conns:
+            conn.setblocking(0)
+            poll.register(conn.fileno(), select.EPOLLIN)
+            by_fd[conn.fileno()] = conn
+        latencies = []
+        for i in range(ROUNDS):
+            sent_at = {}
+            received = {}
+            for conn in conns:
+                sent_at[conn.fileno()] = time.time()
+                conn.send(MESSAGE)
+            complete = 0
+            deadline = time.time() + 30
+            while complete < len(conns):
+                if time.time() > deadline:
+                    return [idle_cpu, rss, threads, None, None]
+                for fd, events in poll.poll(1):
+                    data = by_fd[fd].recv(2 ** 16)
+                    received[fd] = received.get(fd, '') + data
+                    if len(received[fd]) == len(MESSAGE):
+                        latencies.append(time.time() - sent_at[fd])
+                        complete += 1
+        return [idle_cpu, rss, threads,
+                percentile(latencies, 0.5), percentile(latencies, 0.99)]
+    finally:
+        for conn in conns:
+            conn.close()
+        relay_process.terminate()
+        echo_process.terminate()
+        relay_process.join()
+        echo_process.join()
+
+
+def main():
+    """For each relay engine and number of concurrent connections, report the
+    idle CPU usage, memory and threads of the relay while every connection is
+    idle, then the round trip latency while every connection is active.
+    """
+
+    limit = common.raise_fd_limit()
+    print 'File descriptor limit:', limit
+
+    connections = CONNECTIONS
+    if len(sys.argv) > 1:
+        connections = [int(n) for n in sys.argv[1:]]
+
+    for num_connections in connections:
+        for engine in ENGINES:
+            print ' + engine=' + engine + ', connections=' + str(num_connections)
+            # the relay holds two sockets per connection
+            if 2 * num_connections >= limit:
+                print '    - skipped: needs more than ' + str(limit) + \
+                    ' file descriptors'
+                continue
+            if engine == 'threads' and 2 * num_connections >= FD_SETSIZE:
+                print '    - skipped: needs file descriptors above FD_SETSIZE'
+                continue
+            try:
+                [idle_cpu, rss, threads, p50, p99] = doTest(engine,
+                                                            num_connections)
+            except Exception as e:
+                print '    - failed: ' + str(e)
+                continue
+            print '    - idle: cpu=' + str(round(100 * idle_cpu, 1)) + '%, rss=' + \
+                str(rss / 1024) + 'MiB, threads=' + str(threads)
+            if p50 is None:
+                print '    - active: timed out, not every connection was echoed within 30s'
+            else:
+                print '    - active: p50=' + str(round(p50 * 1000, 2)) + 'ms, p99=' + \
+                    str(round(p99 * 1000, 2)) + 'ms'
+
+
+if __name__ == '__main__':
+    main()
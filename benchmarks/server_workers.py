@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import sys
+import time
+import signal
+import socket
+import subprocess
+import SocketServer
+import multiprocessing
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')))
+
+import fte
+import fte.conf
+import fte.defs
+import fte.encoder
+
+
+WORKERS = [1, 2, 4]
+CLIENTS = 8
+STREAMS_PER_CLIENT = 4
+PAYLOAD = 'X' * 2 ** 16
+LOCAL_INTERFACE = '127.0.0.1'
+ECHO_PORT = 8096
+SERVER_PORT = 8097
+FTEPROXY = os.path.abspath(os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), '..', 'bin', 'fteproxy'))
+
+
+class EchoHandler(SocketServer.BaseRequestHandler):
+
+    def handle(self):
+        while True:
+            data = self.request.recv(2 ** 16)
+            if not data:
+                break
+            self.request.sendall(data)
+
+
+class EchoServer(SocketServer.ForkingMixIn, SocketServer.TCPServer):
+    allow_reuse_address = True
+
+
+def echo_server(ready):
+    server = EchoServer((LOCAL_INTERFACE, ECHO_PORT), EchoHandler)
+    ready.set()
+    server.serve_forever()
+
+
+def start_server(num_workers):
+    """Start ``bin/fteproxy --mode server`` with ``num_workers`` workers, and
+    wait until it accepts connections.
+    """
+
+    process = subprocess.Popen([sys.executable, FTEPROXY, '--quiet',
+                                '--mode', 'server',
+                                '--workers', str(num_workers),
+                                '--server_ip', LOCAL_INTERFACE,
+                                '--server_port', str(SERVER_PORT),
+                                '--proxy_ip', LOCAL_INTERFACE,
+                                '--proxy_port', str(ECHO_PORT)])
+    while True:
+        try:
+            socket.create_connection((LOCAL_INTERFACE, SERVER_PORT)).close()
+            break
+        except socket.error:
+            time.sleep(0.1)
+    # let every worker start listening
+    time.sleep(1)
+    return process
+
+
+def client(results):
+    """Send ``PAYLOAD`` through fteproxy ``STREAMS_PER_CLIENT`` times, and read
+    it back each time.
+    """
+
+    outgoing_language = fte.conf.getValue('runtime.state.upstream_language')
+    incoming_language = fte.conf.getValue('runtime.state.downstream_language')
+    for i in range(STREAMS_PER_CLIENT):
+        sock = socket.create_connection((LOCAL_INTERFACE, SERVER_PORT))
+        sock = fte.wrap_socket(sock,
+                               fte.defs.getRegex(outgoing_language),
+                               fte.defs.getFixedSlice(outgoing_language),
+                               fte.defs.getRegex(incoming_language),
+                               fte.defs.getFixedSlice(incoming_language))
+        sock.sendall(PAYLOAD)
+        received = 0
+        while received < len(PAYLOAD):
+            data = sock.recv(2 ** 16)
+            if not data:
+                break
+            received += len(data)
+        sock.close()
+        results.put(received)
+
+
+def doTest(num_workers):
+    """Returns the total throughput in KiB/s of ``CLIENTS`` concurrent client
+    processes, against a server with ``num_workers`` workers.
+    """
+
+    server = start_server(num_workers)
+    try:
+        results = multiprocessing.Queue()
+        clients = [multiprocessing.Process(target=client, args=(results,))
+                   for i in range(CLIENTS)]
+        start = time.time()
+        for c in clients:
+            c.start()
+        received = sum(results.get() for i in range(CLIENTS * STREAMS_PER_CLIENT))
+        elapsed = time.time() - start
+        for c in clients:
+            c.join()
+    finally:
+        server.send_signal(signal.SIGINT)
+        server.wait()
+
+    assert received == len(PAYLOAD) * CLIENTS * STREAMS_PER_CLIENT
+    return (received / 1024.0) / elapsed
+
+
+def main():
+    """Report the throughput of ``bin/fteproxy --mode server --workers N`` for
+    a range of N, relaying ``CLIENTS`` concurrent client processes to an echo
+    server. Workers only help up to the number of CPUs, the clients and echo
+    server run on the same machine.
+    """
+
+    # build the encoders before the clients fork
+    outgoing_language = fte.conf.getValue('runtime.state.upstream_language')
+    incoming_language = fte.conf.getValue('runtime.state.downstream_language')
+    for language in [outgoing_language, incoming_language]:
+        fte.encoder.RegexEncoder(fte.defs.getRegex(language),
+                                 fte.defs.getFixedSlice(language))
+
+    print 'CPUs:', multiprocessing.cpu_count()
+
+    ready = multiprocessing.Event()
+    echo_process = multiprocessing.Process(target=echo_server, args=(ready,))
+    echo_process.start()
+    ready.wait()
+
+    try:
+        for num_workers in WORKERS:
+            print ' + workers=' + str(num_workers)
+            try:
+                kbps = doTest(num_workers)
+            except Exception as e:
+                print '    - failed: ' + repr(e)
+                continue
+            print '    - throughput: ' + str(round(kbps, 1)) + 'KiB/s'
+    finally:
+        echo_process.terminate()
+        echo_process.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')))
+
+import fte.conf
+import fte.defs
+import fte.dfa
+import fte.encoder
+
+import common
+
+
+PROCESSES = 8
+# the default fixed_slice of each language, and a long slice, for which the
+# tables of the larger languages are tens of MiB
+SLICES = [None, 2 ** 11]
+
+
+def load(table_dir, fixed_slice):
+    """Build the encoder of every language, as an fteproxy server does, then
+    wait until stdin is closed. If ``fixed_slice`` is given, also build the
+    DFA of every language with that slice.
+    """
+
+    fte.conf.setValue('fte.dfa.table_dir', table_dir or None)
+    for language in fte.defs.load_definitions().keys():
+        fte.encoder.RegexEncoder(fte.defs.getRegex(language),
+                                 fte.defs.getFixedSlice(language))
+        if fixed_slice:
+            try:
+                fte.dfa.from_regex(fte.defs.getRegex(language), fixed_slice)
+            except fte.dfa.LanguageIsEmptySetException:
+                pass
+    sys.stdout.write('ready\n')
+    sys.stdout.flush()
+    sys.stdin.read()
+
+
+def memory(pid):
+    """Returns the RSS and PSS of ``pid`` in KiB. The PSS of a process
+    divides each shared page between the processes that map it.
+    """
+
+    return common.read_proc(pid, 'smaps_rollup', ['Rss:', 'Pss:'])
+
+
+def doTest(table_dir, fixed_slice):
+    """Start ``PROCESSES`` independent processes that load every language,
+    and return their total RSS and PSS in KiB.
+    """
+
+    processes = []
+    try:
+        for i in range(PROCESSES):
+            process = subprocess.Popen([sys.executable,
+                                        os.path.realpath(__file__),
+                                        'load', table_dir,
+                                        str(fixed_slice or '')],
+                                       stdin=subprocess.PIPE,
+                                       stdout=subprocess.PIPE)
+            assert process.stdout.readline() == 'ready\n'
+            processes.append(process)
+        totals = [0, 0]
+        for process in processes:
+            [rss, pss] = memory(process.pid)
+            totals[0] += rss
+            totals[1] += pss
+        return totals
+    finally:
+        for process in processes:
+            process.stdin.close()
+            process.wait()
+
+
+def main():
+    """Report the total memory of ``PROCESSES`` processes that load every
+    language, with a private rank table in each process, and with the tables
+    shared through files in a table directory.
+    """
+
+    for fixed_slice in SLICES:
+        table_dir = tempfile.mkdtemp()
+        try:
+            for [name, path] in [['private', ''], ['shared', table_dir]]:
+                print ' + slices=' + str(fixed_slice or 'default') + \
+                    ', tables=' + name + ', processes=' + str(PROCESSES)
+                [rss, pss] = doTest(path, fixed_slice)
+                print '    - total RSS: ' + str(rss / 1024) + \
+                    'MiB, total PSS: ' + str(pss / 1024) + 'MiB'
+            table_bytes = sum(os.path.getsize(os.path.join(table_dir, f))
+                              for f in os.listdir(table_dir))
+            print '    - table files: ' + str(len(os.listdir(table_dir))) + \
+                ', ' + str(table_bytes / 2 ** 20) + 'MiB'
+        finally:
+            shutil.rmtree(table_dir)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['load']:
+        load(sys.argv[2], int(sys.argv[3] or 0))
+    else:
+        main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import sys
+import time
+import socket
+import threading
+import multiprocessing
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')))
+
+import fte.conf
+import fte.relay
+
+import common
+
+
+# [engine, runtime.fte.relay.high_watermark]
+CONFIGS = [['threads', None],
+           ['eventloop', None],
+           ['eventloop', 2 ** 18]]
+CONSUMERS = 8
+# each consumer reads this many bytes per second, for DURATION seconds
+RATE = 2 ** 18
+DURATION = 5
+PAYLOAD = 'X' * 2 ** 16
+LOCAL_INTERFACE = '127.0.0.1'
+PRODUCER_PORT = 8100
+RELAY_PORT = 8101
+
+
+def producer(ready):
+    """Sends ``PAYLOAD`` to each connection, as fast as it's read."""
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((LOCAL_INTERFACE, PRODUCER_PORT))
+    sock.listen(128)
+    ready.set()
+
+    def send(conn):
+        try:
+            while True:
+                conn.sendall(PAYLOAD)
+        except socket.error:
+            conn.close()
+
+    while True:
+        conn, addr = sock.accept()
+        t = threading.Thread(target=send, args=(conn,))
+        t.daemon = True
+        t.start()
+
+
+def relay(engine, high_watermark, ready):
+    fte.conf.setValue('runtime.fte.relay.engine', engine)
+    fte.conf.setValue('runtime.fte.relay.high_watermark', high_watermark)
+    l = fte.relay.listener(LOCAL_INTERFACE, RELAY_PORT,
+                           LOCAL_INTERFACE, PRODUCER_PORT)
+    l.start()
+    ready.set()
+    while True:
+        time.sleep(1)
+
+
+def consumer(conn):
+    start = time.time()
+    received = 0
+    while time.time() - start < DURATION:
+        received += len(conn.recv(RATE / 10))
+        # sleep until we are allowed to read again
+        delay = start + float(received) / RATE - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def doTest(engine, high_watermark):
+    """Returns the RSS of the relay before the consumers connect, and its
+    peak RSS while ``CONSUMERS`` slow consumers read from a fast producer.
+    """
+
+    ready = multiprocessing.Event()
+    relay_process = multiprocessing.Process(
+        target=relay, args=(engine, high_watermark, ready))
+    relay_process.start()
+    ready.wait()
+    time.sleep(0.5)
+
+    conns = []
+    try:
+        [idle_rss, peak] = common.memory(relay_process.pid)
+        threads = []
+        for i in range(CONSUMERS):
+            conn = socket.create_connection((LOCAL_INTERFACE, RELAY_PORT))
+            conns.append(conn)
+            t = threading.Thread(target=consumer, args=(conn,))
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        [rss, peak] = common.memory(relay_process.pid)
+        return [idle_rss, peak]
+    finally:
+        for conn in conns:
+            conn.close()
+        relay_process.terminate()
+        relay_process.join()
+
+
+def main():
+    """Report the peak RSS of ``fte.relay.listener`` while ``CONSUMERS``
+    consumers read at ``RATE`` bytes per second from a producer that sends
+    as fast as it can, for each relay engine, with and without flow control.
+    """
+
+    ready = multiprocessing.Event()
+    producer_process = multiprocessing.Process(target=producer,
+                                               args=(ready,))
+    producer_process.start()
+    ready.wait()
+
+    try:
+        for [engine, high_watermark] in CONFIGS:
+            print ' + engine=' + engine + ', high_watermark=' + \
+                str(high_watermark)
+            [idle_rss, peak] = doTest(engine, high_watermark)
+            print '    - RSS before: ' + str(idle_rss / 1024) + \
+                'MiB, peak RSS: ' + str(peak / 1024) + 'MiB'
+    finally:
+        producer_process.terminate()
+        producer_process.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+import os
+import sys
+import time
+import socket
+import subprocess
+
+import common
+
+FTEPROXY = os.path.abspath(
+    os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'bin',
+                 'fteproxy'))
+TRIALS = 5
+LOCAL_INTERFACE = '127.0.0.1'
+CLIENT_PORT = 8105
+
+
+def doTest():
+    """Returns the seconds from starting ``bin/fteproxy --mode client``
+    until it accepts a connection, and its RSS then.
+    """
+
+    # its warm-up processes complain when we stop it before they're done
+    devnull = open(os.devnull, 'w')
+    start = time.time()
+    process = subprocess.Popen([sys.executable, FTEPROXY, '--mode', 'client',
+                                '--quiet', '--client_port', str(CLIENT_PORT)],
+                               stderr=devnull)
+    try:
+        while True:
+            try:
+                sock = socket.create_connection((LOCAL_INTERFACE,
+                                                 CLIENT_PORT))
+                break
+            except socket.error:
+                time.sleep(0.001)
+        elapsed = time.time() - start
+        sock.close()
+        return [elapsed, common.memory(process.pid)[0]]
+    finally:
+        process.terminate()
+        process.wait()
+        devnull.close()
+
+
+def main():
+    """Report the median time until ``bin/fteproxy --mode client`` listens,
+    and its RSS then, over ``TRIALS`` starts.
+    """
+
+    results = sorted(doTest() for i in range(TRIALS))
+    [elapsed, rss] = results[TRIALS / 2]
+    print ' + bin/fteproxy --mode client'
+    print '    - time to listen: ' + str(round(elapsed * 1000, 1)) + 'ms'
+    print '    - RSS: ' + str(round(rss / 1024.0, 1)) + 'MiB'
+
+
+if __name__ == '__main__':
+    main()
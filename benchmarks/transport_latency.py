@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import sys
+import time
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')))
+
+import fte.conf
+import fte.transport
+
+import obfsproxy.network.buffer
+import twisted.internet
+
+
+BULK_CIRCUITS = 4
+# each bulk circuit keeps this many bytes in flight
+BULK_WINDOW = 2 ** 17
+BULK_CHUNK = 2 ** 14
+INTERACTIVE_MESSAGE = 'X' * 512
+INTERACTIVE_INTERVAL = 0.02
+DURATION = 5
+THREADS = [0, 1, 2, 4]
+
+
+class connection(object):
+
+    """An end of a circuit, whose writes are delivered to ``receiver`` from
+    the reactor, as if they crossed a socket."""
+
+    def __init__(self, receiver=None):
+        self.transport = self
+        self.receiver = receiver
+
+    def write(self, data):
+        if self.receiver is not None:
+            twisted.internet.reactor.callLater(0, self.receiver, data)
+
+    def pauseProducing(self):
+        pass
+
+    def resumeProducing(self):
+        pass
+
+
+class ends(object):
+
+    """The connections of a transport's obfsproxy circuit."""
+
+    def __init__(self, upstream, downstream):
+        self.closed = False
+        self.upstream = upstream
+        self.downstream = downstream
+
+
+class circuit(object):
+
+    """A client and server transport, and the bytes the server has relayed
+    to its upstream connection, the Tor relay."""
+
+    def __init__(self, on_data):
+        fte.conf.setValue('runtime.mode', 'client')
+        self.client = fte.transport.FTETransportClient(None)
+        fte.conf.setValue('runtime.mode', 'server')
+        self.server = fte.transport.FTETransportServer(None)
+
+        self.client_circuit = ends(connection(), connection(
+            lambda data: self.server.receivedDownstream(
+                obfsproxy.network.buffer.Buffer(data), self.server_circuit)))
+        self.server_circuit = ends(connection(on_data), connection())
+        self.received = 0
+
+    def send(self, data):
+        self.client.receivedUpstream(obfsproxy.network.buffer.Buffer(data),
+                                     self.client_circuit)
+
+
+def doTest(threads):
+    """Relay ``BULK_CIRCUITS`` bulk circuits, and an interactive circuit that
+    sends a message every ``INTERACTIVE_INTERVAL`` seconds, through
+    transports on a single reactor for ``DURATION`` seconds. Returns the
+    latencies of the interactive messages, and the bulk goodput.
+    """
+
+    fte.conf.setValue('runtime.fte.transport.threads', threads)
+    reactor = twisted.internet.reactor
+
+    bulk = []
+    for i in range(BULK_CIRCUITS):
+        def on_bulk(data, i=i):
+            bulk[i].received += len(data)
+        bulk.append(circuit(on_bulk))
+    sent = [0] * BULK_CIRCUITS
+
+    latencies = []
+    sent_at = []
+    interactive_received = [0]
+
+    def on_interactive(data):
+        interactive_received[0] += len(data)
+        while sent_at and \
+                interactive_received[0] >= len(INTERACTIVE_MESSAGE):
+            interactive_received[0] -= len(INTERACTIVE_MESSAGE)
+            latencies.append(time.time() - sent_at.pop(0))
+    interactive = circuit(on_interactive)
+
+    def feed():
+        for i in range(BULK_CIRCUITS):
+            while sent[i] - bulk[i].received < BULK_WINDOW:
+                bulk[i].send('B' * BULK_CHUNK)
+                sent[i] += BULK_CHUNK
+        reactor.callLater(0.001, feed)
+
+    def ping():
+        sent_at.append(time.time())
+        interactive.send(INTERACTIVE_MESSAGE)
+        reactor.callLater(INTERACTIVE_INTERVAL, ping)
+
+    for c in bulk + [interactive]:
+        c.send('')
+    reactor.callLater(0, feed)
+    reactor.callLater(0, ping)
+
+    start = time.time()
+    while time.time() - start < DURATION:
+        reactor.iterate(0.001)
+    elapsed = time.time() - start
+    goodput = sum(c.received for c in bulk) / elapsed
+
+    # forget everything we scheduled
+    for call in reactor.getDelayedCalls():
+        call.cancel()
+    if fte.transport._pool is not None:
+        fte.transport._pool.stop()
+        fte.transport._pool = None
+
+    return [sorted(latencies), goodput]
+
+
+def main():
+    """Report the latency of an interactive circuit that shares a reactor
+    with ``BULK_CIRCUITS`` bulk circuits, encoding and decoding on the
+    reactor thread, and on thread pools of ``THREADS`` threads.
+    """
+
+    for threads in THREADS:
+        [latencies, goodput] = doTest(threads)
+        print ' + threads=' + str(threads) + ', bulk circuits=' + \
+            str(BULK_CIRCUITS)
+        if latencies:
+            print '    - interactive latency: p50=%.1fms, p99=%.1fms, %d messages' % (
+                latencies[len(latencies) / 2] * 1000,
+                latencies[len(latencies) * 99 / 100] * 1000, len(latencies))
+        else:
+            print '    - interactive latency: no messages arrived'
+        print '    - bulk goodput: %.2fMiB/s' % (goodput / 2 ** 20)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import time
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')))
+
+import fte.defs
+import fte.encoder
+import fte.encrypter
+import fte.record_layer
+
+
+# keystrokes, short commands and prompts, and a larger interactive response
+PAYLOAD_SIZES = [1, 8, 32, 64, 256]
+CELLS = 2 ** 9
+
+
+def doTest(regex_encoder, options, payload_size):
+    """Encode then decode ``CELLS`` cells of ``payload_size`` bytes, one cell
+    at a time, as interactive traffic would. Returns the bytes on the wire,
+    encode time and decode time, per cell.
+    """
+
+    encrypter = fte.encrypter.Encrypter()
+    encoder = fte.record_layer.Encoder(
+        encrypter=encrypter, encoder=regex_encoder,
+        framing=fte.record_layer.FRAMING_V2, options=options)
+    decoder = fte.record_layer.Decoder(
+        decrypter=encrypter, decoder=regex_encoder,
+        framing=fte.record_layer.FRAMING_V2, options=options)
+
+    payload = 'X' * payload_size
+    covertexts = []
+    startTimer = time.time()
+    for i in range(CELLS):
+        encoder.push(payload)
+        covertexts.append(encoder.pop())
+    encode_elapsed = time.time() - startTimer
+
+    startTimer = time.time()
+    for covertext in covertexts:
+        decoder.push(covertext)
+        assert decoder.pop() == payload
+    decode_elapsed = time.time() - startTimer
+
+    bytes_on_wire = sum([len(covertext) for covertext in covertexts])
+
+    return (1.0 * bytes_on_wire / CELLS,
+            encode_elapsed / CELLS, decode_elapsed / CELLS)
+
+
+def main():
+    """For each format in the definitions file, report the slice ladder, then
+    the bytes on the wire and per-cell latency for small payloads, with a
+    fixed slice and with ``OPTION_VARIABLE_SLICE``.
+    """
+
+    definitions = fte.defs.load_definitions()
+    for language in sorted(definitions.keys()):
+        regex = fte.defs.getRegex(language)
+        fixed_slice = fte.defs.getFixedSlice(language)
+        regex_encoder = fte.encoder.RegexEncoder(regex, fixed_slice)
+
+        print ' + format_name="' + language + '", fixed_slice=' + str(fixed_slice)
+        print '    - ladder: ' + ', '.join(
+            [str(s) + ' (' + str(regex_encoder.getMaximumBytesToRank(s)) + ' bytes)'
+             for s in regex_encoder.getSlices()])
+        for payload_size in PAYLOAD_SIZES:
+            results = []
+            for options in [0, fte.record_layer.OPTION_VARIABLE_SLICE]:
+                results.append(doTest(regex_encoder, options, payload_size))
+            print '    - ' + str(payload_size) + ' byte payload: ' + \
+                ', '.join([label + ': ' + str(round(wire, 1)) + ' bytes/cell, ' +
+                           'encode=' + str(round(encode * 1e6, 1)) + 'us, ' +
+                           'decode=' + str(round(decode * 1e6, 1)) + 'us'
+                           for label, (wire, encode, decode)
+                           in zip(['fixed', 'variable'], results)])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import multiprocessing
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')))
+
+import fte.conf
+import fte.defs
+import fte.encoder
+import fte.warmup
+
+
+# runtime.fte.warmup.processes, None is one per CPU
+PROCESSES = [1, None]
+
+
+def sequential(results):
+    """Build every language in turn, as bin/fteproxy did before it listened."""
+
+    start = time.time()
+    for language in fte.defs.load_definitions().keys():
+        definition = fte.defs.getDefinition(language)
+        fte.encoder.RegexEncoder(definition.regex, definition.fixed_slice)
+    elapsed = time.time() - start
+    results.put([elapsed, elapsed])
+
+
+def background(processes, results):
+    """Start a warm-up of every language, and return when it was started
+    and when it was done.
+    """
+
+    fte.conf.setValue('runtime.fte.warmup.processes', processes)
+    start = time.time()
+    warmup = fte.warmup.warmup(fte.defs.load_definitions().keys())
+    warmup.start()
+    listen_time = time.time() - start
+    warmup.wait()
+    results.put([listen_time, time.time() - start])
+
+
+def doTest(target, *args):
+    """Returns ``[time-to-listen, time-to-all-ready]`` of ``target``, run in
+    a new process with no rank tables built.
+    """
+
+    table_dir = tempfile.mkdtemp()
+    try:
+        fte.conf.setValue('fte.dfa.table_dir', os.path.join(table_dir, 'tables'))
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target=target,
+                                          args=args + (results,))
+        process.start()
+        retval = results.get()
+        process.join()
+        return retval
+    finally:
+        shutil.rmtree(table_dir)
+
+
+def main():
+    """Report how long it takes from startup until fteproxy can listen, and
+    until every language of the default release is built, when we build
+    them in turn before listening and when ``fte.warmup`` builds them in a
+    pool of processes in the background.
+    """
+
+    print ' + languages=' + str(len(fte.defs.load_definitions()))
+    print ' + sequential'
+    [listen_time, ready_time] = doTest(sequential)
+    print '    - time to listen: ' + str(round(listen_time, 3)) + 's'
+    print '    - time to all ready: ' + str(round(ready_time, 3)) + 's'
+    for processes in PROCESSES:
+        print ' + warmup, processes=' + str(processes)
+        [listen_time, ready_time] = doTest(background, processes)
+        print '    - time to listen: ' + str(round(listen_time, 3)) + 's'
+        print '    - time to all ready: ' + str(round(ready_time, 3)) + 's'
+
+
+if __name__ == '__main__':
+    main()
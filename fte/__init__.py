@@ -16,6 +16,8 @@
 # You should have received a copy of the GNU General Public License
 # along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
 
+import time
+import errno
 import socket
 import string
 
@@ -24,7 +26,9 @@ import fte.conf
 import fte.defs
 import fte.encoder
 import fte.encrypter
+import fte.metrics
 import fte.record_layer
+import fte.trace
 
 
 class InvalidRoleException(Exception):
@@ -51,10 +55,25 @@ class NegotiateCell(object):
     _PADDING_LEN = 32
     _PADDING_CHAR = '\x00'
     _DATE_FORMAT = 'YYYYMMDD'
+    _OPTIONS_MARKER = 0x80
 
     def __init__(self):
         self._def_file = ""
         self._language = ""
+        self._framing = fte.record_layer.FRAMING_V1
+        self._options = 0
+
+    def setFraming(self, framing):
+        self._framing = framing
+
+    def getFraming(self):
+        return self._framing
+
+    def setOptions(self, options):
+        self._options = options
+
+    def getOptions(self):
+        return self._options
 
     def setDefFile(self, def_file):
         self._def_file = def_file
@@ -70,6 +89,13 @@ class NegotiateCell(object):
 
     def toString(self):
         retval = ''
+        # FRAMING_V1 cells without options omit these bytes, such that they
+        # are understood by peers that predate framing negotiation
+        if self._framing != fte.record_layer.FRAMING_V1 or self._options:
+            retval += chr(self._framing)
+        # the marker bit keeps the options byte distinct from the def file
+        if self._options:
+            retval += chr(NegotiateCell._OPTIONS_MARKER | self._options)
         retval += self._def_file
         retval += self._language
         retval = string.rjust(
@@ -84,52 +110,151 @@ class NegotiateCell(object):
             :NegotiateCell._PADDING_LEN] == NegotiateCell._PADDING_CHAR * NegotiateCell._PADDING_LEN
         negotiate_cell_str = negotiate_cell_str.strip(
             NegotiateCell._PADDING_CHAR)
+        framing = fte.record_layer.FRAMING_V1
+        if negotiate_cell_str[:1] not in string.digits:
+            framing = ord(negotiate_cell_str[0])
+            negotiate_cell_str = negotiate_cell_str[1:]
+        options = 0
+        if negotiate_cell_str[:1] not in string.digits:
+            options = ord(negotiate_cell_str[0]) & ~NegotiateCell._OPTIONS_MARKER
+            negotiate_cell_str = negotiate_cell_str[1:]
         # 8==len(YYYYMMDD)
         def_file = negotiate_cell_str[:len(NegotiateCell._DATE_FORMAT)]
         language = negotiate_cell_str[len(NegotiateCell._DATE_FORMAT):]
         negotiate_cell = NegotiateCell()
         negotiate_cell.setDefFile(def_file)
         negotiate_cell.setLanguage(language)
+        negotiate_cell.setFraming(framing)
+        negotiate_cell.setOptions(options)
         return negotiate_cell
 
 
 class NegotiationManager(object):
 
-    def __init__(self):
+    # the definitions we last indexed, and [language, fixed_slice, definition]
+    # for each of their request languages, shortest fixed_slice first
+    _languages = [None, []]
+    # runtime.fte.encrypter.keys, and its fte.encrypter.KeyRing
+    _keyring = [None, None]
+
+    def __init__(self, mux=False):
         self._negotiationComplete = False
+        self._mux = mux
+        self._options = 0
+        # the languages our client may still be speaking, and the encrypter
+        # and decoded first slice of each that we've ranked, kept across
+        # partial reads
+        self._candidates = None
+        self._heads = {}
+        self._outcome = None
 
     def getNegotiationComplete(self):
         return self._negotiationComplete
 
-    def _acceptNegotiation(self, encrypter, data):
-
-        languages = fte.defs.load_definitions()
-        for incoming_language in languages.keys():
-            try:
-                if incoming_language.endswith('response'):
+    def getOptions(self):
+        """Returns the options of the last negotiation cell we accepted."""
+
+        return self._options
+
+    def recordOutcome(self, outcome):
+        """Records the outcome of our server-side negotiation with
+        ``fte.metrics``: ``accepted``, ``failed`` or ``timeout``. Only the
+        first outcome counts, we may be called again with more data after
+        a failure.
+        """
+
+        if self._outcome is None and fte.metrics.enabled:
+            self._outcome = outcome
+            fte.metrics.increment('fte_negotiations_total',
+                                  (('outcome', outcome),))
+
+    @staticmethod
+    def _getLanguages():
+        definitions = fte.defs.load_definitions()
+        if NegotiationManager._languages[0] is not definitions:
+            languages = []
+            for language in definitions.keys():
+                if language.endswith('response'):
                     continue
+                definition = fte.defs.getDefinition(language)
+                languages.append([language, definition.fixed_slice,
+                                  definition])
+            languages.sort(key=lambda x: x[1])
+            NegotiationManager._languages = [definitions, languages]
+
+        return NegotiationManager._languages[1]
+
+    @staticmethod
+    def _getKeyRing():
+        keys = fte.conf.getValue('runtime.fte.encrypter.keys')
+        if not keys:
+            return None
+
+        if NegotiationManager._keyring[0] is not keys:
+            NegotiationManager._keyring = [keys, fte.encrypter.KeyRing(keys)]
 
-                incoming_regex = fte.defs.getRegex(incoming_language)
-                incoming_fixed_slice = fte.defs.getFixedSlice(incoming_language)
+        return NegotiationManager._keyring[1]
 
-                incoming_decoder = fte.encoder.RegexEncoder(incoming_regex,
-                                                            incoming_fixed_slice)
-                decoder = fte.record_layer.Decoder(decrypter=encrypter,
-                                                   decoder=incoming_decoder)
+    def _acceptNegotiation(self, encrypter, data):
+        """Given everything the client has sent so far, returns the
+        negotiation cell, the data that follows it and the encrypter of the
+        client's key. That's the encrypter in ``runtime.fte.encrypter.keys``
+        named by the key hint in the first slice, if any, otherwise
+        ``encrypter``. A language is dropped as soon as ``data`` can't be its
+        covertext, which is checked against its DFA before it's ranked, and
+        its first slice is only ranked once. Raises
+        ``ChannelNotReadyException`` if more data may complete the cell, and
+        ``NegotiationFailedException`` once no language can. Languages that
+        ``fte.warmup`` is still building are tried last, such that we only
+        wait for them if no other will do.
+        """
+
+        if self._candidates is None:
+            self._candidates = list(NegotiationManager._getLanguages())
+        keyring = NegotiationManager._getKeyRing()
+
+        candidates = sorted(self._candidates, key=lambda x: not x[2].isReady())
+        for candidate in candidates:
+            [language, fixed_slice, definition] = candidate
+            try:
+                encoder = definition.getEncoder()
+                if not encoder.isPrefix(data):
+                    raise NegotiationFailedException()
+                if len(data) < fixed_slice:
+                    continue
 
-                decoder.push(data)
-                negotiate_cell = decoder.pop(oneCell=True)
+                if language not in self._heads:
+                    [hint, head] = encoder.decodeWithHint(data[:fixed_slice])
+                    client_encrypter = None
+                    if keyring is not None:
+                        client_encrypter = keyring.lookup(hint)
+                    self._heads[language] = [client_encrypter or encrypter,
+                                             head]
+                [client_encrypter, head] = self._heads[language]
+                incoming_msg = head + data[fixed_slice:]
+
+                to_take = client_encrypter.getCiphertextLen(incoming_msg)
+                if len(incoming_msg) < to_take:
+                    continue
+                negotiate_cell = client_encrypter.decrypt(
+                    incoming_msg[:to_take])
                 NegotiateCell().fromString(negotiate_cell)
 
-                return [negotiate_cell, decoder._buffer]
-            except:
+                return [negotiate_cell, incoming_msg[to_take:],
+                        client_encrypter]
+            except fte.encrypter.RecoverableDecryptionError:
                 continue
+            except:
+                self._candidates.remove(candidate)
 
-        raise NegotiationFailedException()
+        if not self._candidates:
+            raise NegotiationFailedException()
+        raise ChannelNotReadyException()
 
     def _init_encoders(self, encrypter,
                        outgoing_regex, outgoing_fixed_slice,
-                       incoming_regex, incoming_fixed_slice):
+                       incoming_regex, incoming_fixed_slice,
+                       framing=fte.record_layer.FRAMING_V1, options=0):
 
         encoder = None
         decoder = None
@@ -138,50 +263,77 @@ class NegotiationManager(object):
             outgoing_encoder = fte.encoder.RegexEncoder(outgoing_regex,
                                                         outgoing_fixed_slice)
             encoder = fte.record_layer.Encoder(encrypter=encrypter,
-                                               encoder=outgoing_encoder)
+                                               encoder=outgoing_encoder,
+                                               framing=framing,
+                                               options=options)
 
         if incoming_regex != None and incoming_fixed_slice != -1:
             incoming_decoder = fte.encoder.RegexEncoder(incoming_regex,
                                                         incoming_fixed_slice)
             decoder = fte.record_layer.Decoder(decrypter=encrypter,
-                                               decoder=incoming_decoder)
+                                               decoder=incoming_decoder,
+                                               framing=framing,
+                                               options=options)
 
         return [encoder, decoder]
 
-    def _makeNegotiationCell(self, encoder):
+    def _makeNegotiationCell(self, encrypter, encoder, framing, options):
         negotiate_cell = NegotiateCell()
         def_file = fte.conf.getValue('fte.defs.release')
         negotiate_cell.setDefFile(def_file)
         language = fte.conf.getValue('runtime.state.upstream_language')
         language = language[:-len('-request')]
         negotiate_cell.setLanguage(language)
-        encoder.push(negotiate_cell.toString())
-        data = encoder.pop()
+        negotiate_cell.setFraming(framing)
+        negotiate_cell.setOptions(options)
+        # a single FRAMING_V1 cell, as fte.record_layer.Encoder would output
+        hint = None
+        if fte.conf.getValue('runtime.fte.encrypter.key_hint'):
+            hint = encrypter.getKeyHint()
+        data = encoder.encode(encrypter.encrypt(negotiate_cell.toString()),
+                              hint)
         return data
 
     def makeClientNegotiationCell(self, encrypter,
                                   outgoing_regex, outgoing_fixed_slice,
-                                  incoming_regex, incoming_fixed_slice):
-        [encoder, decoder] = self._init_encoders(
-            encrypter, outgoing_regex, outgoing_fixed_slice, incoming_regex, incoming_fixed_slice)
-        return self._makeNegotiationCell(encoder)
+                                  incoming_regex, incoming_fixed_slice,
+                                  framing=fte.record_layer.FRAMING_V1,
+                                  options=0):
+        # the negotiation cell itself is always FRAMING_V1, the server
+        # doesn't know our framing until it has decoded this cell
+        encoder = fte.encoder.RegexEncoder(outgoing_regex, outgoing_fixed_slice)
+        return self._makeNegotiationCell(encrypter, encoder, framing, options)
 
     def doServerSideNegotiation(self, encrypter, data):
-        [negotiate_cell, remaining_buffer] = self._acceptNegotiation(
-            encrypter, data)
+        try:
+            retval = self._doServerSideNegotiation(encrypter, data)
+        except NegotiationFailedException:
+            self.recordOutcome('failed')
+            raise
+        self.recordOutcome('accepted')
+        return retval
 
-        negotiate = NegotiateCell().fromString(negotiate_cell)
+    def _doServerSideNegotiation(self, encrypter, data):
+        [negotiate_cell, remaining_buffer, encrypter] = \
+            self._acceptNegotiation(encrypter, data)
 
-        outgoing_language = negotiate.getLanguage() + '-response'
-        incoming_language = negotiate.getLanguage() + '-request'
+        negotiate = NegotiateCell().fromString(negotiate_cell)
+        framing = negotiate.getFraming()
+        options = negotiate.getOptions()
+        try:
+            fte.record_layer._validateFraming(framing, options)
+        except fte.record_layer.InvalidFramingException:
+            raise NegotiationFailedException()
+        if options & fte.record_layer.OPTION_MUX and not self._mux:
+            raise NegotiationFailedException()
+        self._options = options
 
-        outgoing_regex = fte.defs.getRegex(outgoing_language)
-        outgoing_fixed_slice = fte.defs.getFixedSlice(outgoing_language)
-        incoming_regex = fte.defs.getRegex(incoming_language)
-        incoming_fixed_slice = fte.defs.getFixedSlice(incoming_language)
+        outgoing = fte.defs.getDefinition(negotiate.getLanguage() + '-response')
+        incoming = fte.defs.getDefinition(negotiate.getLanguage() + '-request')
 
         [encoder, decoder] = self._init_encoders(
-            encrypter, outgoing_regex, outgoing_fixed_slice, incoming_regex, incoming_fixed_slice)
+            encrypter, outgoing.regex, outgoing.fixed_slice, incoming.regex, incoming.fixed_slice,
+            framing, options)
 
         decoder.push(remaining_buffer)
 
@@ -190,49 +342,151 @@ class NegotiationManager(object):
 
 class FTEHelper(object):
 
+    # only sockets from fte.wrap_socket multiplex streams
+    _mux = False
+    _options = 0
+    # until negotiation is complete
+    _encoder = None
+
     def _processRecv(self, data):
+        """A server raises ``ChannelNotReadyException`` until the client's
+        negotiation cell is complete, and ``NegotiationFailedException`` once
+        it can't be, or the client has sent more than
+        ``runtime.fte.negotiate.max_buffer`` bytes without completing it.
+        """
+
         retval = data
         if self._isServer and not self._negotiationComplete:
+            self._preNegotiationBuffer_incoming += data
             try:
-                self._preNegotiationBuffer_incoming += data
                 [encoder, decoder] = self._negotiation_manager.doServerSideNegotiation(
                     self._encrypter, self._preNegotiationBuffer_incoming)
-                self._encoder = encoder
-                self._decoder = decoder
-                self._preNegotiationBuffer_incoming = ''
-                self._negotiationComplete = True
-                retval = ''
-            except:
-                raise ChannelNotReadyException()
+            except ChannelNotReadyException:
+                if len(self._preNegotiationBuffer_incoming) > \
+                        fte.conf.getValue('runtime.fte.negotiate.max_buffer'):
+                    self._negotiation_manager.recordOutcome('failed')
+                    raise NegotiationFailedException()
+                raise
+            except NegotiationFailedException:
+                raise
+            except Exception:
+                self._negotiation_manager.recordOutcome('failed')
+                raise NegotiationFailedException()
+            self._encoder = encoder
+            self._decoder = decoder
+            self._options = self._negotiation_manager.getOptions()
+            self._preNegotiationBuffer_incoming = ''
+            self._negotiationComplete = True
+            retval = ''
 
         return retval
 
     def _processSend(self):
         retval = ''
         if self._isClient and not self._negotiationComplete:
+            framing = fte.conf.getValue('runtime.fte.record_layer.framing')
+            options = 0
+            if fte.conf.getValue('runtime.fte.record_layer.fractional_packing'):
+                options |= fte.record_layer.OPTION_FRACTIONAL_PACKING
+            if fte.conf.getValue('runtime.fte.record_layer.variable_slice'):
+                options |= fte.record_layer.OPTION_VARIABLE_SLICE
+            if self._mux:
+                options |= fte.record_layer.OPTION_MUX
+            self._options = options
             [encoder, decoder] = self._negotiation_manager._init_encoders(
                 self._encrypter,
                 self._outgoing_regex,
                 self._outgoing_fixed_slice,
                 self._incoming_regex,
-                self._incoming_fixed_slice)
+                self._incoming_fixed_slice,
+                framing, options)
             self._encoder = encoder
             self._decoder = decoder
             negotiation_cell = self._negotiation_manager.makeClientNegotiationCell(
                 self._encrypter,
                 self._outgoing_regex, self._outgoing_fixed_slice,
-                self._incoming_regex, self._incoming_fixed_slice)
+                self._incoming_regex, self._incoming_fixed_slice,
+                framing, options)
             retval = negotiation_cell
             self._negotiationComplete = True
         return retval
 
+    def isNegotiated(self):
+        """Returns ``True`` once negotiation is complete, a client once it
+        has made its negotiation cell."""
+
+        return self._negotiationComplete
+
+    def isMultiplexed(self):
+        """Returns ``True`` if the plaintext of this connection is a sequence
+        of ``fte.mux`` frames. A server knows once negotiation is complete.
+        """
+
+        return bool(self._options & fte.record_layer.OPTION_MUX)
+
+    def encode(self, data):
+        """Returns the covertext to write to the underlying socket for
+        ``data``, prefixed with our negotiation cell if it hasn't been sent.
+        A server buffers ``data`` until negotiation is complete, a later
+        call flushes it. Used to drive fteproxy from an event loop, with
+        a non-blocking underlying socket.
+        """
+
+        retval = self._processSend()
+        if not self._negotiationComplete:
+            self._preNegotiationBuffer_outgoing += data
+            return retval
+
+        data = self._preNegotiationBuffer_outgoing + data
+        self._preNegotiationBuffer_outgoing = ''
+        if data:
+            self._encoder.push(data)
+            while True:
+                to_send = self._encoder.pop()
+                if not to_send:
+                    break
+                retval += to_send
+        return retval
+
+    def writeTraces(self, start):
+        """Completes the ``fte.trace`` traces of the cells we last encoded,
+        with their ``write`` stage: we began writing them to the underlying
+        socket at ``start``, and just finished.
+        """
+
+        if self._encoder is None:
+            return
+        traces = self._encoder.popTraces()
+        if traces:
+            end = fte.trace.now()
+            for trace in traces:
+                trace.add('write', start, end)
+            fte.trace.write(traces)
+
+    def decode(self, data):
+        """Given covertext read from the underlying socket, returns all of
+        the plaintext that can be decoded so far. Raises
+        ``ChannelNotReadyException`` until negotiation is complete.
+        """
+
+        data = self._processRecv(data)
+        self._decoder.push(data)
+
+        retval = ''
+        while True:
+            frag = self._decoder.pop()
+            if not frag:
+                break
+            retval += frag
+        return retval
+
 
 class _FTESocketWrapper(FTEHelper, object):
 
     def __init__(self, _socket,
                  outgoing_regex=None, outgoing_fixed_slice=-1,
                  incoming_regex=None, incoming_fixed_slice=-1,
-                 K1=None, K2=None):
+                 K1=None, K2=None, mux=False):
 
         self._socket = _socket
         self._outgoing_regex = outgoing_regex
@@ -241,11 +495,12 @@ class _FTESocketWrapper(FTEHelper, object):
         self._incoming_fixed_slice = incoming_fixed_slice
         self._K1 = K1
         self._K2 = K2
+        self._mux = mux
 
         self._encrypter = fte.encrypter.Encrypter(K1=self._K1,
                                                   K2=self._K2)
 
-        self._negotiation_manager = NegotiationManager()
+        self._negotiation_manager = NegotiationManager(mux)
         self._negotiationComplete = False
         self._isServer = (outgoing_regex is None and incoming_regex is None)
         self._isClient = (
@@ -257,6 +512,13 @@ class _FTESocketWrapper(FTEHelper, object):
     def fileno(self):
         return self._socket.fileno()
 
+    def pending(self):
+        """Returns the number of decoded bytes that can be read without
+        reading from the underlying socket, as ``ssl.SSLSocket.pending`` does.
+        """
+
+        return len(self._incoming_buffer)
+
     def recv(self, bufsize):
         ### <HACK>
         # Required to deal with case when client attempts to recv
@@ -269,11 +531,21 @@ class _FTESocketWrapper(FTEHelper, object):
         ### </HACK>
             
         try:
-            while True:
+            # a cell may decode to more than bufsize bytes, return the rest
+            # before waiting on the socket
+            while not self._incoming_buffer:
                 data = self._socket.recv(bufsize)
                 noData = (data == '')
                 data = self._processRecv(data)
 
+                # a server buffers what it sends until it has negotiated
+                to_send = self.encode('')
+                if to_send:
+                    start = fte.trace.enabled and fte.trace.now()
+                    self._socket.sendall(to_send)
+                    if start:
+                        self.writeTraces(start)
+
                 if noData and not self._incoming_buffer and not self._decoder._buffer:
                     return ''
 
@@ -285,8 +557,9 @@ class _FTESocketWrapper(FTEHelper, object):
                         break
                     self._incoming_buffer += frag
 
-                if self._incoming_buffer:
-                    break
+                # a truncated cell never decodes
+                if noData and not self._incoming_buffer:
+                    return ''
 
             retval = self._incoming_buffer[:bufsize]
             self._incoming_buffer = self._incoming_buffer[bufsize:]
@@ -295,17 +568,85 @@ class _FTESocketWrapper(FTEHelper, object):
 
         return retval
 
-    def send(self, data):
-        to_send = self._processSend()
-        if to_send:
-            self._socket.sendall(to_send)
+    def negotiate(self, timeout=None):
+        """Blocks until negotiation is complete: a client sends its
+        negotiation cell, a server reads the client's. A server raises
+        ``NegotiateTimeoutException`` if the client hasn't negotiated within
+        ``timeout`` seconds, and ``NegotiationFailedException`` if it can't.
+        Data that follows the cell is kept for ``recv``.
+        """
+
+        if self._isClient:
+            self.send('')
+            return
 
-        self._encoder.push(data)
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        previous_timeout = self._socket.gettimeout()
+        try:
+            while not self._negotiationComplete:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._negotiation_manager.recordOutcome('timeout')
+                        raise NegotiateTimeoutException()
+                self._socket.settimeout(remaining)
+                try:
+                    data = self._socket.recv(2 ** 12)
+                except socket.timeout:
+                    self._negotiation_manager.recordOutcome('timeout')
+                    raise NegotiateTimeoutException()
+                if not data:
+                    raise socket.error('Connection closed during negotiation.')
+                try:
+                    self._processRecv(data)
+                except ChannelNotReadyException:
+                    continue
+        finally:
+            self._socket.settimeout(previous_timeout)
+
+        self._popDecoded()
+
+    def continueNegotiation(self):
+        """Reads what a server's client has sent so far, without blocking,
+        and returns ``True`` once negotiation is complete. The underlying
+        socket must be non-blocking. Raises ``NegotiationFailedException``
+        if the client can't negotiate, and ``socket.error`` if it has closed
+        the connection. Data that follows the cell is kept for ``recv``.
+        """
+
+        try:
+            data = self._socket.recv(2 ** 12)
+        except socket.error as e:
+            if e.args[0] in [errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR]:
+                return False
+            raise
+        if not data:
+            raise socket.error('Connection closed during negotiation.')
+        try:
+            self._processRecv(data)
+        except ChannelNotReadyException:
+            return False
+
+        self._popDecoded()
+        return True
+
+    def _popDecoded(self):
         while True:
-            to_send = self._encoder.pop()
-            if not to_send:
+            frag = self._decoder.pop()
+            if not frag:
                 break
+            self._incoming_buffer += frag
+
+    def send(self, data):
+        to_send = self.encode(data)
+        if to_send:
+            start = fte.trace.enabled and fte.trace.now()
             self._socket.sendall(to_send)
+            if start:
+                self.writeTraces(start)
         return len(data)
 
     def sendall(self, data):
@@ -318,6 +659,9 @@ class _FTESocketWrapper(FTEHelper, object):
     def settimeout(self, val):
         return self._socket.settimeout(val)
 
+    def setsockopt(self, level, optname, value):
+        return self._socket.setsockopt(level, optname, value)
+
     def shutdown(self, flags):
         return self._socket.shutdown(flags)
 
@@ -332,7 +676,7 @@ class _FTESocketWrapper(FTEHelper, object):
         conn = _FTESocketWrapper(conn,
                                  self._outgoing_regex, self._outgoing_fixed_slice,
                                  self._incoming_regex, self._incoming_fixed_slice,
-                                 self._K1, self._K2)
+                                 self._K1, self._K2, self._mux)
 
         return conn, addr
 
@@ -346,7 +690,7 @@ class _FTESocketWrapper(FTEHelper, object):
 def wrap_socket(sock,
                 outgoing_regex=None, outgoing_fixed_slice=-1,
                 incoming_regex=None, incoming_fixed_slice=-1,
-                K1=None, K2=None):
+                K1=None, K2=None, mux=False):
     """``fte.wrap_socket`` turns an existing socket into an fteproxy socket.
 
     The input parameter ``sock`` is the socket to wrap.
@@ -358,6 +702,8 @@ def wrap_socket(sock,
     The optional parameters ``K1`` and ``K2`` specify 128-bit keys to be used
     in FTE's underlying AE scheme. If specified, these values must be 16-byte
     hex strings.
+    If ``mux`` is true, a client asks for, and a server accepts, a
+    connection that carries the many streams of an ``fte.mux.session``.
     """
 
     assert K1 == None or len(K1) == 16
@@ -367,140 +713,5 @@ def wrap_socket(sock,
         sock,
         outgoing_regex, outgoing_fixed_slice,
         incoming_regex, incoming_fixed_slice,
-        K1, K2)
+        K1, K2, mux)
     return socket_wrapped
-
-
-import obfsproxy.network.network as network
-import obfsproxy.network.socks as socks
-import obfsproxy.network.extended_orport as extended_orport
-import obfsproxy.transports.base
-
-import twisted.internet
-
-
-class FTETransport(FTEHelper, obfsproxy.transports.base.BaseTransport):
-
-    def __init__(self, pt_config):
-        self._isClient = (fte.conf.getValue('runtime.mode') == 'client')
-        self._isServer = not self._isClient
-        if self._isClient:
-            outgoing_language = fte.conf.getValue(
-                'runtime.state.upstream_language')
-            incoming_language = fte.conf.getValue(
-                'runtime.state.downstream_language')
-            self._outgoing_regex = fte.defs.getRegex(outgoing_language)
-            self._outgoing_fixed_slice = fte.defs.getFixedSlice(outgoing_language)
-            self._incoming_regex = fte.defs.getRegex(incoming_language)
-            self._incoming_fixed_slice = fte.defs.getFixedSlice(incoming_language)
-        else:
-            self._outgoing_regex = None
-            self._outgoing_fixed_slice = -1
-            self._incoming_regex = None
-            self._incoming_fixed_slice = -1
-
-        self._K1 = fte.conf.getValue('runtime.fte.encrypter.key')[0:16]
-        self._K2 = fte.conf.getValue('runtime.fte.encrypter.key')[16:32]
-        self._encrypter = fte.encrypter.Encrypter(K1=self._K1,
-                                                  K2=self._K2)
-
-        self._negotiation_manager = NegotiationManager()
-        self._negotiationComplete = False
-        self._incoming_buffer = ''
-        self._preNegotiationBuffer_outgoing = ''
-        self._preNegotiationBuffer_incoming = ''
-
-    def receivedDownstream(self, data, circuit):
-        """decode fteproxy stream"""
-
-        try:
-            data = data.read()
-            data = self._processRecv(data)
-
-            self._decoder.push(data)
-
-            while True:
-                frag = self._decoder.pop()
-                if not frag:
-                    break
-                circuit.upstream.write(frag)
-
-        except ChannelNotReadyException:
-            pass
-
-    def receivedUpstream(self, data, circuit):
-        """encode fteproxy stream"""
-        to_send = self._processSend()
-        if to_send:
-            circuit.downstream.write(to_send)
-
-        data = data.read()
-        self._encoder.push(data)
-        while True:
-            to_send = self._encoder.pop()
-            if not to_send:
-                break
-            circuit.downstream.write(to_send)
-
-
-class FTETransportClient(FTETransport):
-    pass
-
-
-class FTETransportServer(FTETransport):
-    pass
-
-
-def launch_transport_listener(transport, bindaddr, role, remote_addrport, pt_config, ext_or_cookie_file=None):
-    """
-    Launch a listener for 'transport' in role 'role' (socks/client/server/ext_server).
-
-    If 'bindaddr' is set, then listen on bindaddr. Otherwise, listen
-    on an ephemeral port on localhost.
-    'remote_addrport' is the TCP/IP address of the other end of the
-    circuit. It's not used if we are in 'socks' role.
-
-    'pt_config' contains configuration options (such as the state location)
-    which are of interest to the pluggable transport.
-
-    'ext_or_cookie_file' is the filesystem path where the Extended
-    ORPort Authentication cookie is stored. It's only used in
-    'ext_server' mode.
-
-    Return a tuple (addr, port) representing where we managed to bind.
-
-    Throws obfsproxy.transports.transports.TransportNotFound if the
-    transport could not be found.
-
-    Throws twisted.internet.error.CannotListenError if the listener
-    could not be set up.
-    """
-
-    listen_host = bindaddr[0] if bindaddr else 'localhost'
-    listen_port = int(bindaddr[1]) if bindaddr else 0
-
-    if role == 'socks':
-        transport_class = FTETransportClient
-        factory = socks.SOCKSv4Factory(transport_class, pt_config)
-    elif role == 'ext_server':
-        assert(remote_addrport and ext_or_cookie_file)
-        transport_class = FTETransportServer
-        factory = extended_orport.ExtORPortServerFactory(
-            remote_addrport, ext_or_cookie_file, transport, transport_class, pt_config)
-    elif role == 'client':
-        assert(remote_addrport)
-        transport_class = FTETransportClient
-        factory = network.StaticDestinationServerFactory(
-            remote_addrport, role, transport_class, pt_config)
-    elif role == 'server':
-        assert(remote_addrport)
-        transport_class = FTETransportServer
-        factory = network.StaticDestinationServerFactory(
-            remote_addrport, role, transport_class, pt_config)
-    else:
-        raise InvalidRoleException()
-
-    addrport = twisted.internet.reactor.listenTCP(
-        listen_port, factory, interface=listen_host)
-
-    return (addrport.getHost().host, addrport.getHost().port)
@@ -0,0 +1,470 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""fteproxy streams for asyncio. This module requires trollius, the asyncio
+port for Python 2, and raises ``ImportError`` if it isn't installed.
+
+``fte.aio.open_connection`` and ``fte.aio.start_server`` mirror their
+asyncio counterparts, but return fteproxy streams. ``fte.aio.listener``,
+``fte.aio.client_listener`` and ``fte.aio.server_listener`` are the asyncio
+counterparts of ``fte.relay.listener``, ``fte.client.listener`` and
+``fte.server.listener``.
+
+By default ranking and unranking runs on the event loop. If an ``executor``
+is given, it runs there instead, in order, one call per stream at a time.
+We stop reading from a stream while more than
+``runtime.fte.relay.high_watermark`` bytes of it wait to be decoded, until
+no more than ``runtime.fte.relay.low_watermark`` do. A server stream that
+hasn't negotiated within ``runtime.fte.negotiate.timeout`` seconds, or
+whose client fails to, is closed.
+"""
+
+import trollius as asyncio
+from trollius import From, Return
+
+import fte
+import fte.conf
+import fte.defs
+import fte.encrypter
+import fte.logger
+
+
+# the maximum number of bytes relayed per read
+_RELAY_BUFSIZE = 2 ** 16
+
+
+class FTECodec(fte.FTEHelper):
+
+    """The fteproxy state of one stream, without a socket. Takes the same
+    parameters as ``fte.wrap_socket``: a client specifies its languages, a
+    server has them negotiated in-band by the client.
+    """
+
+    def __init__(self,
+                 outgoing_regex=None, outgoing_fixed_slice=-1,
+                 incoming_regex=None, incoming_fixed_slice=-1,
+                 K1=None, K2=None):
+
+        assert K1 == None or len(K1) == 16
+        assert K2 == None or len(K2) == 16
+
+        self._outgoing_regex = outgoing_regex
+        self._outgoing_fixed_slice = outgoing_fixed_slice
+        self._incoming_regex = incoming_regex
+        self._incoming_fixed_slice = incoming_fixed_slice
+
+        self._encrypter = fte.encrypter.Encrypter(K1=K1, K2=K2)
+
+        self._negotiation_manager = fte.NegotiationManager()
+        self._negotiationComplete = False
+        self._isServer = (outgoing_regex is None and incoming_regex is None)
+        self._isClient = (
+            outgoing_regex is not None and incoming_regex is not None)
+        self._preNegotiationBuffer_outgoing = ''
+        self._preNegotiationBuffer_incoming = ''
+
+
+class FTEStreamWriter(asyncio.StreamWriter):
+
+    """An ``asyncio.StreamWriter`` that encodes what is written with the
+    ``fte.aio.FTECodec`` of its ``fte.aio.FTEProtocol``.
+    """
+
+    def write(self, data):
+        self._protocol.send(data)
+
+    def writelines(self, data):
+        self.write(''.join(data))
+
+    def write_eof(self):
+        self._protocol.whenFlushed(self._transport.write_eof)
+
+    def close(self):
+        self._protocol.whenFlushed(self._transport.close)
+
+    @asyncio.coroutine
+    def drain(self):
+        yield From(self._protocol.flushed())
+        yield From(asyncio.StreamWriter.drain(self))
+
+
+class _readerTransport(object):
+
+    """The transport, as seen by the ``asyncio.StreamReader`` of an
+    ``fte.aio.FTEProtocol``. Both the reader and the protocol pause
+    reading, the transport reads again once neither does.
+    """
+
+    def __init__(self, protocol, transport):
+        self._protocol = protocol
+        self._transport = transport
+
+    def pause_reading(self):
+        self._protocol._pauseReading('reader')
+
+    def resume_reading(self):
+        self._protocol._resumeReading('reader')
+
+    def __getattr__(self, name):
+        return getattr(self._transport, name)
+
+
+class FTEProtocol(asyncio.streams.FlowControlMixin, asyncio.Protocol):
+
+    """Translates between the covertext on a transport, and the plaintext of
+    an ``asyncio.StreamReader`` and ``fte.aio.FTEStreamWriter``. If ``codec``
+    is ``None`` data is passed through unmodified. ``client_connected_cb`` is
+    called with the reader and writer once connected, and may be a
+    coroutine.
+    """
+
+    def __init__(self, codec, reader, client_connected_cb=None, loop=None,
+                 executor=None):
+        asyncio.streams.FlowControlMixin.__init__(self, loop=loop)
+        self._codec = codec
+        self._reader = reader
+        self._client_connected_cb = client_connected_cb
+        self._executor = executor
+        self._transport = None
+        self._writer = None
+        # the last pending call to the codec, calls are chained such that
+        # they run in order
+        self._tail = None
+        # the bytes received that the executor hasn't decoded yet
+        self._undecoded = 0
+        self._high_watermark = fte.conf.getValue(
+            'runtime.fte.relay.high_watermark')
+        self._low_watermark = fte.conf.getValue(
+            'runtime.fte.relay.low_watermark')
+        # why we aren't reading: 'reader', 'decoder', or both
+        self._pauses = set()
+        self._negotiation_timer = None
+
+    def getWriter(self):
+        return self._writer
+
+    def connection_made(self, transport):
+        self._transport = transport
+        self._reader.set_transport(_readerTransport(self, transport))
+        if self._codec is not None and self._codec._isServer:
+            self._negotiation_timer = self._loop.call_later(
+                fte.conf.getValue('runtime.fte.negotiate.timeout'),
+                self._onNegotiationTimeout)
+        self._writer = FTEStreamWriter(transport, self, self._reader,
+                                       self._loop)
+
+        # clients send their negotiation cell before any data
+        self.send('')
+
+        if self._client_connected_cb is not None:
+            res = self._client_connected_cb(self._reader, self._writer)
+            if asyncio.iscoroutine(res):
+                asyncio.ensure_future(res, loop=self._loop)
+
+    def connection_lost(self, exc):
+        if self._negotiation_timer is not None:
+            self._negotiation_timer.cancel()
+            self._negotiation_timer = None
+        def onFlushed():
+            if exc is None:
+                self._reader.feed_eof()
+            else:
+                self._reader.set_exception(exc)
+        self.whenFlushed(onFlushed)
+        asyncio.streams.FlowControlMixin.connection_lost(self, exc)
+
+    def data_received(self, data):
+        if self._codec is None:
+            self._reader.feed_data(data)
+            return
+
+        if self._executor is not None:
+            self._undecoded += len(data)
+            if self._high_watermark is not None and \
+                    self._undecoded > self._high_watermark:
+                self._pauseReading('decoder')
+        self._call(self._decode, data, self._onDecoded)
+
+    def eof_received(self):
+        self.whenFlushed(self._reader.feed_eof)
+        # keep the transport open, such that queued data is written
+        return True
+
+    def send(self, data):
+        """Encode and write ``data`` to the transport."""
+
+        if self._codec is None:
+            if data:
+                self._transport.write(data)
+        else:
+            self._call(self._codec.encode, data, self._onEncoded)
+
+    def whenFlushed(self, callback):
+        """Calls ``callback`` once every pending call to the codec has
+        completed.
+        """
+
+        if self._tail is None or self._tail.done():
+            callback()
+        else:
+            self._tail.add_done_callback(lambda future: callback())
+
+    @asyncio.coroutine
+    def flushed(self):
+        """Returns once every pending call to the codec has completed."""
+
+        if self._tail is not None and not self._tail.done():
+            yield From(asyncio.wait([self._tail], loop=self._loop))
+
+    def _call(self, func, data, callback):
+        if self._executor is None:
+            self._onResult(func, data, callback)
+        else:
+            self._tail = asyncio.ensure_future(
+                self._callInExecutor(self._tail, func, data, callback),
+                loop=self._loop)
+
+    @asyncio.coroutine
+    def _callInExecutor(self, previous, func, data, callback):
+        if previous is not None and not previous.done():
+            yield From(asyncio.wait([previous], loop=self._loop))
+        try:
+            result = yield From(self._loop.run_in_executor(self._executor,
+                                                           func, data))
+        except Exception as e:
+            self._onError(e)
+            return
+        callback(result)
+
+    def _onResult(self, func, data, callback):
+        try:
+            result = func(data)
+        except Exception as e:
+            self._onError(e)
+            return
+        callback(result)
+
+    def _decode(self, data):
+        try:
+            plaintext = self._codec.decode(data)
+        except fte.ChannelNotReadyException:
+            plaintext = ''
+        # once a server has negotiated, flush what it has buffered
+        return [len(data), plaintext, self._codec.encode('')]
+
+    def _onDecoded(self, result):
+        [decoded, plaintext, covertext] = result
+        if self._executor is not None:
+            self._undecoded -= decoded
+            if self._low_watermark is None or \
+                    self._undecoded <= self._low_watermark:
+                self._resumeReading('decoder')
+        if covertext:
+            self._transport.write(covertext)
+        if plaintext:
+            self._reader.feed_data(plaintext)
+
+    def _onEncoded(self, covertext):
+        if covertext:
+            self._transport.write(covertext)
+
+    def _onNegotiationTimeout(self):
+        self._negotiation_timer = None
+        if not self._codec.isNegotiated():
+            self._codec._negotiation_manager.recordOutcome('timeout')
+            self._onError(fte.NegotiateTimeoutException())
+
+    def _pauseReading(self, reason):
+        if not self._pauses:
+            try:
+                self._transport.pause_reading()
+            except RuntimeError:
+                # the transport is closing
+                pass
+        self._pauses.add(reason)
+
+    def _resumeReading(self, reason):
+        if reason not in self._pauses:
+            return
+        self._pauses.remove(reason)
+        if not self._pauses:
+            try:
+                self._transport.resume_reading()
+            except RuntimeError:
+                pass
+
+    def _onError(self, e):
+        fte.logger.error("fte.aio stream closed: " + repr(e))
+        self._reader.set_exception(e)
+        self._transport.abort()
+
+
+@asyncio.coroutine
+def open_connection(host, port,
+                    outgoing_regex, outgoing_fixed_slice,
+                    incoming_regex, incoming_fixed_slice,
+                    K1=None, K2=None, loop=None, executor=None, **kwds):
+    """Connect to ``host:port`` and return a ``(reader, writer)`` pair for an
+    fteproxy client stream, as ``asyncio.open_connection`` does. The
+    remaining parameters are as for ``fte.wrap_socket``.
+    """
+
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    codec = FTECodec(outgoing_regex, outgoing_fixed_slice,
+                     incoming_regex, incoming_fixed_slice,
+                     K1, K2)
+    [reader, writer] = yield From(_open_connection(codec, host, port, loop,
+                                                   executor, **kwds))
+    raise Return(reader, writer)
+
+
+@asyncio.coroutine
+def start_server(client_connected_cb, host=None, port=None,
+                 K1=None, K2=None, loop=None, executor=None, **kwds):
+    """Start an fteproxy server on ``host:port``, as
+    ``asyncio.start_server`` does. ``client_connected_cb`` is called with
+    a ``(reader, writer)`` pair for each fteproxy stream.
+    """
+
+    if loop is None:
+        loop = asyncio.get_event_loop()
+
+    def factory():
+        reader = asyncio.StreamReader(loop=loop)
+        return FTEProtocol(FTECodec(K1=K1, K2=K2), reader,
+                           client_connected_cb, loop, executor)
+
+    server = yield From(loop.create_server(factory, host, port, **kwds))
+    raise Return(server)
+
+
+@asyncio.coroutine
+def _open_connection(codec, host, port, loop, executor, **kwds):
+    reader = asyncio.StreamReader(loop=loop)
+    protocol = FTEProtocol(codec, reader, loop=loop, executor=executor)
+    yield From(loop.create_connection(lambda: protocol, host, port, **kwds))
+    raise Return(reader, protocol.getWriter())
+
+
+@asyncio.coroutine
+def _pipe(reader, writer):
+    try:
+        while True:
+            data = yield From(reader.read(_RELAY_BUFSIZE))
+            if not data:
+                break
+            writer.write(data)
+            yield From(writer.drain())
+    except Exception as e:
+        fte.logger.debug("fte.aio relay closed: " + repr(e))
+    finally:
+        writer.close()
+
+
+class listener(object):
+
+    """The asyncio counterpart of ``fte.relay.listener``: once ``start`` is
+    complete it listens on ``local_ip:local_port``, and relays all incoming
+    connections to ``remote_ip:remote_port``.
+    ``onNewIncomingConnection`` and ``onNewOutgoingConnection`` return the
+    ``fte.aio.FTECodec`` for new incoming and outgoing connections, or
+    ``None`` to relay them unmodified, which is the default.
+    """
+
+    def __init__(self, local_ip, local_port,
+                 remote_ip, remote_port, loop=None, executor=None):
+        self._local_ip = local_ip
+        self._local_port = local_port
+        self._remote_ip = remote_ip
+        self._remote_port = remote_port
+        self._loop = loop if loop is not None else asyncio.get_event_loop()
+        self._executor = executor
+        self._server = None
+
+    @asyncio.coroutine
+    def start(self):
+        """Bind to ``local_ip:local_port``."""
+
+        self._server = yield From(self._loop.create_server(
+            self._newIncomingProtocol, self._local_ip, self._local_port,
+            backlog=fte.conf.getValue('runtime.fte.relay.backlog')))
+
+    def stop(self):
+        """Stop listening on ``local_ip:local_port``. Relayed connections are
+        unaffected.
+        """
+
+        if self._server is not None:
+            self._server.close()
+
+    def onNewIncomingConnection(self):
+        return None
+
+    def onNewOutgoingConnection(self):
+        return None
+
+    def _newIncomingProtocol(self):
+        reader = asyncio.StreamReader(loop=self._loop)
+        return FTEProtocol(self.onNewIncomingConnection(), reader,
+                           self._relay, self._loop, self._executor)
+
+    @asyncio.coroutine
+    def _relay(self, reader, writer):
+        try:
+            [new_reader, new_writer] = yield From(_open_connection(
+                self.onNewOutgoingConnection(),
+                self._remote_ip, self._remote_port,
+                self._loop, self._executor))
+        except Exception as e:
+            fte.logger.error("fte.aio failed to connect to " +
+                             str((self._remote_ip, self._remote_port)) +
+                             ": " + repr(e))
+            writer.close()
+            return
+
+        yield From(asyncio.wait([_pipe(reader, new_writer),
+                                 _pipe(new_reader, writer)],
+                                loop=self._loop))
+
+
+class client_listener(listener):
+
+    def onNewOutgoingConnection(self):
+        """Outgoing connections are fteproxy client streams, with the
+        languages specified in the ``runtime.state.upstream_language`` and
+        ``runtime.state.downstream_language`` configuration parameters.
+        """
+
+        outgoing = fte.defs.getDefinition(
+            fte.conf.getValue('runtime.state.upstream_language'))
+        incoming = fte.defs.getDefinition(
+            fte.conf.getValue('runtime.state.downstream_language'))
+
+        return FTECodec(outgoing.regex, outgoing.fixed_slice,
+                        incoming.regex, incoming.fixed_slice)
+
+
+class server_listener(listener):
+
+    def onNewIncomingConnection(self):
+        """Incoming connections are fteproxy server streams, their languages
+        are negotiated in-band by the client.
+        """
+
+        return FTECodec()
@@ -18,13 +18,80 @@
 
 import binascii
 import os
+import threading
+
+from Crypto.Cipher import AES
+from Crypto.Util import Counter
+
+import fte.conf
+
+
+class _RandomPool(threading.local):
+
+    """A per-thread, buffered CSPRNG. The generator is AES-128 in CTR mode keyed
+    with ``os.urandom``. Keystream is produced ``runtime.fte.random.buffer_size``
+    bytes at a time, and the first 32 bytes of every refill replace the key and
+    counter, such that earlier output can't be recovered from the current state.
+    The generator is reseeded from ``os.urandom`` after
+    ``runtime.fte.random.reseed_interval`` bytes of output, and whenever we detect
+    that we are running in a new process (e.g., after ``os.fork``).
+    """
+
+    _SEED_LENGTH = 32
+
+    def __init__(self):
+        self._buffer_size = fte.conf.getValue('runtime.fte.random.buffer_size')
+        self._reseed_interval = fte.conf.getValue(
+            'runtime.fte.random.reseed_interval')
+        self._pid = None
+        self._output_since_reseed = 0
+
+    def _reseed(self):
+        self._pid = os.getpid()
+        self._output_since_reseed = 0
+        self._buffer = ''
+        self._rekey(os.urandom(_RandomPool._SEED_LENGTH))
+
+    def _rekey(self, seed):
+        counter = Counter.new(AES.block_size * 8,
+                              initial_value=bytes_to_long(seed[16:32]))
+        self._cipher = AES.new(key=seed[:16],
+                               mode=AES.MODE_CTR,
+                               counter=counter)
+
+    def _keystream(self, N):
+        keystream = self._cipher.encrypt('\x00' * (N + _RandomPool._SEED_LENGTH))
+        self._rekey(keystream[:_RandomPool._SEED_LENGTH])
+        return keystream[_RandomPool._SEED_LENGTH:]
+
+    def read(self, N):
+        forked = (self._pid != os.getpid())
+        exhausted = (self._output_since_reseed >= self._reseed_interval)
+        if forked or exhausted:
+            self._reseed()
+
+        self._output_since_reseed += N
+
+        if N > self._buffer_size:
+            return self._keystream(N)
+
+        if len(self._buffer) < N:
+            self._buffer += self._keystream(self._buffer_size)
+
+        retval = self._buffer[:N]
+        self._buffer = self._buffer[N:]
+
+        return retval
+
+
+_pool = _RandomPool()
 
 
 def random_bytes(N):
     """Given an input integer ``N``, ``random_bytes`` returns a string of exactly ``N`` uniformly-random bytes.
-    Calls ``os.urandom`` to get the random bytes.
+    Bytes are drawn from a per-thread buffered CSPRNG that is seeded with ``os.urandom``.
     """
-    return os.urandom(N)
+    return _pool.read(N)
 
 
 def long_to_bytes(N, blocksize=1):
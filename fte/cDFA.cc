@@ -62,11 +62,21 @@ static PyObject * DFA__rank(PyObject *self, PyObject *args) {
     if (pDFAObject->obj == NULL)
         return NULL;
 
+    // Our DFA is immutable once built, so other threads may run while we
+    // rank.
     mpz_class result;
+    std::string error;
+    bool failed = false;
+    Py_BEGIN_ALLOW_THREADS
     try {
         result = pDFAObject->obj->rank(str_word);
     } catch (std::exception& e) {
-        PyErr_SetString(PyExc_RuntimeError, e.what());
+        error = e.what();
+        failed = true;
+    }
+    Py_END_ALLOW_THREADS
+    if (failed) {
+        PyErr_SetString(PyExc_RuntimeError, error.c_str());
         return 0;
     }
 
@@ -80,11 +90,12 @@ static PyObject * DFA__rank(PyObject *self, PyObject *args) {
 
 
 // Wrapper for DFA::unrank.
-// On input of an integer, returns a string.
+// On input of an integer, and optionally a length, returns a string.
 static PyObject * DFA__unrank(PyObject *self, PyObject *args) {
     PyObject* c;
+    int n = -1;
 
-    if (!PyArg_ParseTuple(args, "O", &c))
+    if (!PyArg_ParseTuple(args, "O|i", &c, &n))
         return NULL;
 
     //PyNumber to mpz_class
@@ -98,11 +109,23 @@ static PyObject * DFA__unrank(PyObject *self, PyObject *args) {
     if (pDFAObject->obj == NULL)
         return NULL;
 
+    // As in DFA__rank, other threads may run while we unrank.
     std::string result;
+    std::string error;
+    bool failed = false;
+    Py_BEGIN_ALLOW_THREADS
     try {
-        result = pDFAObject->obj->unrank(to_unrank);
+        if (n < 0)
+            result = pDFAObject->obj->unrank(to_unrank);
+        else
+            result = pDFAObject->obj->unrank(to_unrank, n);
     } catch (std::exception& e) {
-        PyErr_SetString(PyExc_RuntimeError, e.what());
+        error = e.what();
+        failed = true;
+    }
+    Py_END_ALLOW_THREADS
+    if (failed) {
+        PyErr_SetString(PyExc_RuntimeError, error.c_str());
         return 0;
     }
 
@@ -146,6 +169,81 @@ static PyObject * DFA__getNumWordsInLanguage(PyObject *self, PyObject *args) {
 }
 
 
+// Wrapper for DFA::isPrefix.
+// Takes a string as input and returns True if it is a prefix of a word of
+// length fixed_slice in our language.
+static PyObject * DFA__isPrefix(PyObject *self, PyObject *args) {
+    char* word;
+    uint32_t len;
+
+    if (!PyArg_ParseTuple(args, "s#", &word, &len))
+        return NULL;
+
+    const std::string str_word = std::string(word, len);
+
+    DFAObject *pDFAObject = (DFAObject*)self;
+    if (pDFAObject->obj == NULL)
+        return NULL;
+
+    return PyBool_FromLong(pDFAObject->obj->isPrefix(str_word));
+}
+
+
+// Returns True if our table is mapped from a table file, shared with other
+// processes.
+static PyObject * DFA__isTableShared(PyObject *self, PyObject *args) {
+    DFAObject *pDFAObject = (DFAObject*)self;
+    if (pDFAObject->obj == NULL)
+        return NULL;
+
+    return PyBool_FromLong(pDFAObject->obj->isTableShared());
+}
+
+
+// Returns the number of bytes our table occupies in memory.
+static PyObject * DFA__getTableSize(PyObject *self, PyObject *args) {
+    DFAObject *pDFAObject = (DFAObject*)self;
+    if (pDFAObject->obj == NULL)
+        return NULL;
+
+    return PyLong_FromSize_t(pDFAObject->obj->getTableSize());
+}
+
+
+// Returns a dict of DFA::getStats, our table size and the shape of our DFA.
+static PyObject * DFA__getStats(PyObject *self, PyObject *args) {
+    DFAObject *pDFAObject = (DFAObject*)self;
+    if (pDFAObject->obj == NULL)
+        return NULL;
+
+    DFAStats stats = pDFAObject->obj->getStats();
+    return Py_BuildValue("{s:K,s:K,s:K,s:K,s:K,s:K,s:K,s:K,s:n,s:I,s:I}",
+                         "rank_calls", stats.rank_calls,
+                         "rank_ns", stats.rank_ns,
+                         "unrank_calls", stats.unrank_calls,
+                         "unrank_ns", stats.unrank_ns,
+                         "dense_steps", stats.dense_steps,
+                         "goldberg_sipser_steps", stats.goldberg_sipser_steps,
+                         "build_ns", stats.build_ns,
+                         "build_table_ns", stats.build_table_ns,
+                         "table_bytes", pDFAObject->obj->getTableSize(),
+                         "states", pDFAObject->obj->getNumStates(),
+                         "symbols", pDFAObject->obj->getNumSymbols());
+}
+
+
+// Wrapper for DFA::resetStats.
+static PyObject * DFA__resetStats(PyObject *self, PyObject *args) {
+    DFAObject *pDFAObject = (DFAObject*)self;
+    if (pDFAObject->obj == NULL)
+        return NULL;
+
+    pDFAObject->obj->resetStats();
+
+    Py_RETURN_NONE;
+}
+
+
 // On input of a PCRE, outputs a non-minimized AT&T FST-formated DFA.
 static PyObject *
 __attFstFromRegex(PyObject *self, PyObject *args) {
@@ -164,6 +262,14 @@ __attFstFromRegex(PyObject *self, PyObject *args) {
 }
 
 
+// Returns the seconds on a monotonic clock where there is one, to time
+// with, as Python 2 has no time.monotonic.
+static PyObject *
+__monotonic(PyObject *self, PyObject *args) {
+    return PyFloat_FromDouble(now_ns() / 1e9);
+}
+
+
 // Boilerplat python object alloc.
 static PyObject *
 DFA_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
@@ -175,8 +281,9 @@ DFA_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
 
 
 // Our initialization function for fte.cDFA.DFA
-// On input of a [str, int], where str is a regex,
-// returns an fte.cDFA.DFA object that can perform ranking/unranking
+// On input of a [str, int], where str is a regex, and optionally the str path
+// of a table file, returns an fte.cDFA.DFA object that can perform
+// ranking/unranking.
 // See rank_unrank.h for the significance of the input parameters.
 static int
 DFA_init(DFAObject *self, PyObject *args, PyObject *kwds)
@@ -187,30 +294,45 @@ DFA_init(DFAObject *self, PyObject *args, PyObject *kwds)
     //if (!PyArg_ParseTuple(args, "s#i", &regex, &len, &max_len))
     //    return -1;
 
+    if (PyTuple_Size(args) < 2) {
+        PyErr_SetString(PyExc_RuntimeError, "Expected at least two arguments");
+        return -1;
+    }
+
     PyObject *arg0 = PyTuple_GetItem(args, 0);
     if (!PyString_Check(arg0)) {
         PyErr_SetString(PyExc_RuntimeError, "First argument must be a string");
-        return 0;
+        return -1;
     }
     const char* regex = PyString_AsString(arg0);
 
     PyObject *arg1 = PyTuple_GetItem(args, 1);
     if (!PyInt_Check(arg1)) {
         PyErr_SetString(PyExc_RuntimeError, "Second argument must be an int");
-        return 0;
+        return -1;
     }
     uint32_t max_len = PyInt_AsLong(arg1);
 
+    std::string table_path;
+    if (PyTuple_Size(args) > 2) {
+        PyObject *arg2 = PyTuple_GetItem(args, 2);
+        if (!PyString_Check(arg2)) {
+            PyErr_SetString(PyExc_RuntimeError, "Third argument must be a string");
+            return -1;
+        }
+        table_path = std::string(PyString_AsString(arg2));
+    }
+
     // Try to initialize our DFA object.
     // An exception is thrown if the input AT&T FST is not formatted as we expect.
     // See DFA::_validate for a list of assumptions.
     try {
         const std::string str_regex = std::string(regex);
-        DFA *dfa = new DFA(str_regex, max_len);
+        DFA *dfa = new DFA(str_regex, max_len, table_path);
         self->obj = dfa;
     } catch (std::exception& e) {
         PyErr_SetString(PyExc_RuntimeError, e.what());
-        return 0;
+        return -1;
     }
 
     return 0;
@@ -222,6 +344,11 @@ static PyMethodDef DFA_methods[] = {
     {"rank",  DFA__rank, METH_VARARGS, NULL},
     {"unrank",  DFA__unrank, METH_VARARGS, NULL},
     {"getNumWordsInLanguage",  DFA__getNumWordsInLanguage, METH_VARARGS, NULL},
+    {"isPrefix",  DFA__isPrefix, METH_VARARGS, NULL},
+    {"isTableShared",  DFA__isTableShared, METH_NOARGS, NULL},
+    {"getTableSize",  DFA__getTableSize, METH_NOARGS, NULL},
+    {"getStats",  DFA__getStats, METH_NOARGS, NULL},
+    {"resetStats",  DFA__resetStats, METH_NOARGS, NULL},
     {NULL, NULL, 0, NULL}
 };
 
@@ -275,6 +402,7 @@ static PyTypeObject DFAType = {
 // Methods in our fte.cDFA package
 static PyMethodDef ftecDFAMethods[] = {
     {"attFstFromRegex",  __attFstFromRegex, METH_VARARGS, NULL},
+    {"monotonic",  __monotonic, METH_NOARGS, NULL},
     {NULL, NULL, 0, NULL}
 };
 
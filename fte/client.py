@@ -16,30 +16,64 @@
 # You should have received a copy of the GNU General Public License
 # along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
 
+import fte.mux
 import fte.relay
 
 
 class listener(fte.relay.listener):
 
+    """If ``runtime.fte.mux.connections`` is non-zero, all connections are
+    carried as ``fte.mux`` streams over that many fteproxy connections,
+    rather than an fteproxy connection each.
+    """
+
+    def __init__(self, local_ip, local_port,
+                 remote_ip, remote_port):
+        fte.relay.listener.__init__(self, local_ip, local_port,
+                                    remote_ip, remote_port)
+
+        self._mux = None
+        connections = fte.conf.getValue('runtime.fte.mux.connections')
+        if connections > 0:
+            self._mux = fte.mux.client(self._connectUpstream, connections)
+
+    def _connect(self, conn):
+        if self._mux is None:
+            return fte.relay.listener._connect(self, conn)
+
+        try:
+            self._mux.openStream(conn)
+        except Exception as e:
+            if fte.metrics.enabled:
+                fte.metrics.increment('fte_relay_connect_failures_total')
+            fte.logger.error("fte.client failed to open a stream to " +
+                             str((self._remote_ip, self._remote_port)) +
+                             ": " + repr(e))
+            fte.network_io.close_socket(conn)
+
+    def stop(self):
+        fte.relay.listener.stop(self)
+        if self._mux is not None:
+            self._mux.stop()
+
     def onNewOutgoingConnection(self, socket):
         """On an outgoing data stream we wrap it with ``fte.wrap_socket``, with
         the languages specified in the ``runtime.state.upstream_language`` and
         ``runtime.state.downstream_language`` configuration parameters.
         """
 
-        outgoing_language = fte.conf.getValue(
-            'runtime.state.upstream_language')
-        incoming_language = fte.conf.getValue(
-            'runtime.state.downstream_language')
-
-        outgoing_regex = fte.defs.getRegex(outgoing_language)
-        outgoing_fixed_slice = fte.defs.getFixedSlice(outgoing_language)
-
-        incoming_regex = fte.defs.getRegex(incoming_language)
-        incoming_fixed_slice = fte.defs.getFixedSlice(incoming_language)
+        outgoing = fte.defs.getDefinition(
+            fte.conf.getValue('runtime.state.upstream_language'))
+        incoming = fte.defs.getDefinition(
+            fte.conf.getValue('runtime.state.downstream_language'))
 
         socket = fte.wrap_socket(socket,
-                                 outgoing_regex, outgoing_fixed_slice,
-                                 incoming_regex, incoming_fixed_slice)
+                                 outgoing.regex, outgoing.fixed_slice,
+                                 incoming.regex, incoming.fixed_slice,
+                                 mux=(self._mux is not None))
+
+        # send our negotiation cell now, rather than with our first data,
+        # such that the server can speak first
+        socket.send('')
 
         return socket
@@ -77,6 +77,67 @@ conf['runtime.mode'] = None
 conf['runtime.fte.relay.backlog'] = 100
 
 
+"""The relay engine: threads, which starts two fte.relay.worker threads per
+connection, or eventloop, which multiplexes all connections with epoll."""
+conf['runtime.fte.relay.engine'] = 'threads'
+
+
+"""The number of fte.relay.eventloop threads, if the relay engine is eventloop."""
+conf['runtime.fte.relay.eventloop.threads'] = 1
+
+
+"""Once more than high_watermark bytes are queued for a relayed connection,
+fte.relay.eventloop and fte.transport.FTETransport stop reading from its
+peer. The event loop resumes once no more than low_watermark bytes are
+queued, Twisted once its write buffer is empty. None disables flow
+control."""
+conf['runtime.fte.relay.high_watermark'] = 2 ** 18
+conf['runtime.fte.relay.low_watermark'] = 2 ** 16
+
+
+"""The number of threads per fte.relay.listener that establish outgoing
+connections, which bounds the number of concurrent outgoing connects."""
+conf['runtime.fte.relay.connect.threads'] = 16
+
+
+"""The maximum number of seconds to wait for an outgoing connection."""
+conf['runtime.fte.relay.connect.timeout'] = 10
+
+
+"""The number of idle, pre-connected sockets that each fte.relay.listener
+keeps to its remote address, runtime.proxy.* for a server and
+runtime.server.* for a client. Zero disables the pool."""
+conf['runtime.fte.relay.pool.size'] = 0
+
+
+"""The number of threads on which fte.transport.FTETransport encodes and
+decodes the cells of all circuits in managed mode, such that a bulk circuit
+doesn't stall the Twisted reactor for every other. Zero encodes and decodes
+on the reactor thread."""
+conf['runtime.fte.transport.threads'] = 0
+
+
+"""The number of fteproxy connections over which a client carries all of its
+streams with fte.mux, rather than a connection per stream. Zero disables
+multiplexing, servers accept clients either way."""
+conf['runtime.fte.mux.connections'] = 0
+
+
+"""The number of bytes either side of an fte.mux stream may send that its
+peer hasn't yet written to its socket."""
+conf['runtime.fte.mux.window'] = 2 ** 18
+
+
+"""The number of streams a client may have open on an fte.mux session, a
+server closes the streams it opens beyond that."""
+conf['runtime.fte.mux.max_streams'] = 256
+
+
+"""Set SO_REUSEPORT on listening sockets, such that several processes can
+accept connections on the same port."""
+conf['runtime.fte.relay.reuse_port'] = False
+
+
 """Our client-side ip:port to listen for incoming connections"""
 conf['runtime.client.ip'] = '127.0.0.1'
 conf['runtime.client.port'] = 8079
@@ -87,6 +148,11 @@ conf['runtime.server.ip'] = '127.0.0.1'
 conf['runtime.server.port'] = 8080
 
 
+"""The number of fteproxy server processes, forked by fte.supervisor. Each
+accepts connections on its own SO_REUSEPORT listener."""
+conf['runtime.server.workers'] = 1
+
+
 """Our proxy server, where the fteproxy server forwards outgoing connections."""
 conf['runtime.proxy.ip'] = '127.0.0.1'
 conf['runtime.proxy.port'] = 8081
@@ -100,10 +166,36 @@ conf['runtime.fte.relay.socket_timeout'] = 0.001
 conf['runtime.fte.negotiate.timeout'] = 5
 
 
+"""The maximum number of bytes an fteproxy server buffers from a client
+that hasn't completed its negotiation cell, before it gives up on it."""
+conf['runtime.fte.negotiate.max_buffer'] = 2 ** 16
+
+
+"""The maximum number of incoming connections that each fte.server.listener
+negotiates at once. Further connections are closed until one completes."""
+conf['runtime.fte.negotiate.max_pending'] = 1024
+
+
 """The maximum number of bytes to segment for an outgoing message."""
 conf['runtime.fte.record_layer.max_cell_size'] = 2 ** 14
 
 
+"""The cell framing requested by clients during negotiation: 1 or 2.
+Framing 2 drops the redundant length header from each cell, but requires
+an fteproxy server that supports framing negotiation."""
+conf['runtime.fte.record_layer.framing'] = 1
+
+
+"""If true, clients request that consecutive cells carry extra bytes in the
+fractional capacity of each slice. Requires framing 2."""
+conf['runtime.fte.record_layer.fractional_packing'] = False
+
+
+"""If true, clients request that small cells use the shortest slice in each
+format's ladder, rather than always fixed_slice. Requires framing 2."""
+conf['runtime.fte.record_layer.variable_slice'] = False
+
+
 """The default client-to-server language."""
 conf['runtime.state.upstream_language'] = 'manual-http-request'
 
@@ -112,13 +204,90 @@ conf['runtime.state.upstream_language'] = 'manual-http-request'
 conf['runtime.state.downstream_language'] = 'manual-http-response'
 
 
+"""The number of bytes fte.bit_ops.random_bytes generates each time its buffer is refilled."""
+conf['runtime.fte.random.buffer_size'] = 2 ** 12
+
+
+"""The number of bytes fte.bit_ops.random_bytes outputs before it is reseeded from os.urandom."""
+conf['runtime.fte.random.reseed_interval'] = 2 ** 20
+
+
 """The default AE scheme key."""
 conf['runtime.fte.encrypter.key'] = 'FF' * 16 + '00' * 16
 
 
+"""The 32-byte keys a server accepts, in addition to its default key. Each
+client is matched to its key by the key hint in its first cell, clients
+that don't send one must use the default key. None accepts only the
+default key."""
+conf['runtime.fte.encrypter.keys'] = None
+
+
+"""If True, a client puts a key hint in its first cell, such that a server
+that holds many keys can find its key. The hint is the same for every
+connection with the same key, for runtime.fte.encrypter.key_hint_period
+seconds, so it links those connections to whoever knows the format."""
+conf['runtime.fte.encrypter.key_hint'] = False
+
+
+"""The number of seconds each key hint is valid for."""
+conf['runtime.fte.encrypter.key_hint_period'] = 300
+
+
 """The default fixed_slice parameter to use for buildTable."""
 conf['fte.default_fixed_slice'] = 2 ** 7
 
 
+"""The directory of rank table files. fte.dfa writes the table of each DFA
+there once, then every fteproxy process that uses the DFA maps it read-only,
+rather than building its own copy. Table files are never removed, whoever
+sets this owns the directory. None builds a private table in every
+process."""
+conf['fte.dfa.table_dir'] = None
+
+
+"""The number of bytes of rank tables that fte.encoder caches the encoders
+of. Once there are more, it evicts the least-recently-used encoders, whose
+tables are freed once no connection uses them. None never evicts."""
+conf['runtime.fte.encoder.cache_bytes'] = 2 ** 26
+
+
+"""fte.metrics serves its metrics over HTTP on this ip:port, or on the Unix
+socket unix_socket if it is set. The port None serves nothing, but
+fte.metrics still records if started."""
+conf['runtime.fte.metrics.ip'] = '127.0.0.1'
+conf['runtime.fte.metrics.port'] = None
+conf['runtime.fte.metrics.unix_socket'] = None
+
+
+"""fte.trace writes a trace of this fraction of all cells to file, as
+JSON lines (jsonl) or in its binary format (binary), once started."""
+conf['runtime.fte.trace.file'] = None
+conf['runtime.fte.trace.rate'] = 0.01
+conf['runtime.fte.trace.format'] = 'jsonl'
+
+
+"""The number of seconds between the samples fte.profiler takes of every
+thread's stack, while it runs."""
+conf['runtime.fte.profiler.interval'] = 0.005
+
+
+"""The number of processes fte.warmup builds formats in, None is one per
+CPU."""
+conf['runtime.fte.warmup.processes'] = None
+
+
+"""The number of seconds fte.warmup waits for its formats to be built, after
+which those that aren't are built by whoever needs them. None waits
+forever."""
+conf['runtime.fte.warmup.timeout'] = 120
+
+
 """The default definitions file to use."""
 conf['fte.defs.release'] = '20131224'
+
+
+"""The number of seconds between checks for changes to the definitions
+file, which is read again if its mtime has changed. None never checks,
+definitions are then only read again on SIGHUP."""
+conf['fte.defs.check_interval'] = 5
@@ -18,42 +18,116 @@
 
 import os
 import json
+import time
+import threading
 
 import fte.conf
+import fte.dfa
+import fte.encoder
 
 
 class InvalidRegexName(Exception):
     pass
 
 
-def load_definitions():
-    # TODO: Cache file, such that we don't have to reload each time
+class Definition(object):
+
+    """The regex and fixed_slice of a language in a definitions file, and
+    its ``fte.encoder.RegexEncoder``, which is built on first use.
+    """
+
+    def __init__(self, language, regex, fixed_slice):
+        self.language = language
+        self.regex = regex
+        self.fixed_slice = fixed_slice
+
+    def isReady(self):
+        """Returns ``False`` while ``fte.warmup`` is building our encoder."""
+
+        return (str(self.regex), int(self.fixed_slice)) not in fte.dfa._pending
+
+    def getEncoder(self):
+        # we don't hold it, such that fte.encoder can evict it
+        return fte.encoder.RegexEncoder(self.regex, self.fixed_slice)
+
 
-    def_dir = os.path.join(fte.conf.getValue('general.defs_dir'))
+# the path of each definitions file we've read, to
+# [mtime, time of our last stat, definitions, {language: Definition}]
+_registry = {}
+_lock = threading.Lock()
+
+
+def _getRelease():
+    """Returns the registry entry of ``fte.defs.release``. The file is read
+    once, then again only if its mtime has changed, which we check at most
+    every ``fte.defs.check_interval`` seconds, or after ``reload``.
+    """
+
+    def_dir = fte.conf.getValue('general.defs_dir')
     def_file = fte.conf.getValue('fte.defs.release') + '.json'
     def_abspath = os.path.join(def_dir, def_file)
 
-    with open(def_abspath) as fh:
-        definitions = json.load(fh)
+    entry = _registry.get(def_abspath)
+    check_interval = fte.conf.getValue('fte.defs.check_interval')
+    now = time.time()
+    if entry is not None and (check_interval is None or
+                              now - entry[1] < check_interval):
+        return entry
 
-    return definitions
+    with _lock:
+        entry = _registry.get(def_abspath)
+        mtime = os.stat(def_abspath).st_mtime
+        if entry is not None and entry[0] == mtime:
+            entry[1] = now
+            return entry
 
+        with open(def_abspath) as fh:
+            definitions = json.load(fh)
+        default_fixed_slice = fte.conf.getValue('fte.default_fixed_slice')
+        records = {}
+        for language in definitions.keys():
+            records[language] = Definition(
+                language, definitions[language]['regex'],
+                definitions[language].get('fixed_slice', default_fixed_slice))
+
+        entry = [mtime, now, definitions, records]
+        _registry[def_abspath] = entry
+
+    return entry
+
+
+def reload():
+    """Forget every definitions file we've read, such that each is read
+    again on next use. Called on SIGHUP.
+    """
+
+    with _lock:
+        _registry.clear()
+
+
+def load_definitions():
+    """Returns the definitions of ``fte.defs.release``. The same object is
+    returned until the file changes, callers must not modify it.
+    """
+
+    return _getRelease()[2]
+
+
+def getDefinition(format_name):
+    """Returns the ``Definition`` of ``format_name``."""
 
-def getRegex(format_name):
-    definitions = load_definitions()
     try:
-        regex = definitions[format_name]['regex']
+        return _getRelease()[3][format_name]
     except KeyError:
         raise InvalidRegexName(format_name)
 
-    return regex
+
+def getRegex(format_name):
+    return getDefinition(format_name).regex
 
 
 def getFixedSlice(format_name):
-    definitions = load_definitions()
     try:
-        fixed_slice = definitions[format_name]['fixed_slice']
-    except KeyError:
-        fixed_slice = fte.conf.getValue('fte.default_fixed_slice')
-
-    return fixed_slice
+        return getDefinition(format_name).fixed_slice
+    except InvalidRegexName:
+        return fte.conf.getValue('fte.default_fixed_slice')
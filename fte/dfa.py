@@ -17,9 +17,16 @@
 # along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import os
 import copy
 import math
+import stat
+import weakref
+import hashlib
+import threading
 
+import fte.conf
+import fte.logger
 import fte.automata
 import fte.cDFA
 
@@ -58,19 +65,32 @@ class DFA(object):
 
     def rank(self, X):
         """Given a string ``X`` return ``c``, where ``c`` is the lexicographical
-        rank of ``X`` in the language of all strings of length ``fixed_slice``
-        generated by ``regex``.
+        rank of ``X`` in the language of all strings of length ``len(X)``
+        generated by ``regex``. The length of ``X`` must be no greater than
+        ``fixed_slice``.
         """
 
         retval = self._cDFA.rank(X)
 
         return retval
 
-    def unrank(self, c):
-        """The inverse of ``rank``.
+    def isPrefix(self, X):
+        """Returns ``True`` if ``X`` is a prefix of at least one string of
+        length ``fixed_slice`` in the language generated by ``regex``. This
+        walks the DFA once, it's much cheaper than ``rank``.
         """
 
-        retval = self._cDFA.unrank(c)
+        return self._cDFA.isPrefix(X)
+
+    def unrank(self, c, n=None):
+        """The inverse of ``rank``. Returns a string of length ``n``, which
+        defaults to ``fixed_slice``.
+        """
+
+        if n is None:
+            retval = self._cDFA.unrank(c)
+        else:
+            retval = self._cDFA.unrank(c, n)
 
         return retval
 
@@ -87,6 +107,29 @@ class DFA(object):
         """Returns the number of words in the language of length ``n``"""
         return self._cDFA.getNumWordsInLanguage(n, n)
 
+    def isTableShared(self):
+        """Returns ``True`` if our rank table is mapped from a table file in
+        ``fte.dfa.table_dir``, rather than built by this process."""
+        return self._cDFA.isTableShared()
+
+    def getTableSize(self):
+        """Returns the number of bytes our rank table occupies in memory."""
+        return self._cDFA.getTableSize()
+
+    def getStats(self):
+        """Returns a dict of the counters ``fte.cDFA`` keeps for our DFA: the
+        calls to, and nanoseconds spent in, rank and unrank, how many of their
+        steps took the dense path or the Goldberg-Sipser path, how long the
+        DFA and its table took to build, and the size of our table, states
+        and alphabet. Counters accumulate until ``resetStats``."""
+        retval = self._cDFA.getStats()
+        retval['fixed_slice'] = self.fixed_slice
+        return retval
+
+    def resetStats(self):
+        """Zeroes our call, time and step counters. Build times are kept."""
+        self._cDFA.resetStats()
+
 
 def _attFstFromRegex(regex):
     """Inputs a perl-compatible regular expression and outputs a minimized AT&T-formatted finite state transducer"""
@@ -233,26 +276,103 @@ def _FTEAutomataToAttFst(dfa):
 
     return att_fst
 
-_instance = {}
+def _getTablePath(att_fst, fixed_slice):
+    """Returns the path of the table file for ``att_fst`` and ``fixed_slice``
+    in ``fte.dfa.table_dir``, or the empty string if there is no usable
+    table directory.
+    """
 
-def from_regex(regex, fixed_slice):
+    table_dir = fte.conf.getValue('fte.dfa.table_dir')
+    if not table_dir:
+        return ''
+
+    try:
+        if not os.path.isdir(table_dir):
+            os.makedirs(table_dir, 0o700)
+        # anyone that can write to table_dir controls our ranking
+        st = os.stat(table_dir)
+        if st.st_uid != os.getuid() or st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            fte.logger.error("Not sharing rank tables, " + table_dir +
+                             " is writable by other users")
+            return ''
+    except OSError:
+        return ''
+
+    key = hashlib.sha1(str(fixed_slice) + '\n' + att_fst).hexdigest()
+    return os.path.join(table_dir, key + '.table')
+
+
+# each DFA that is in use, by an encoder in the fte.encoder cache or by
+# anyone else, and no others, such that evicting an encoder frees its table
+_instance = weakref.WeakValueDictionary()
+# a threading.Event for each (regex, fixed_slice) that is being built, by
+# a thread of ours or by fte.warmup, set once it's in _instance
+_pending = {}
+# guards _pending, here and in fte.encoder
+_lock = threading.Lock()
+
+
+def single_flight(instance, pending, key, build):
+    """Returns ``instance[key]``, calling ``build()`` to make it if it isn't
+    there. Only one caller builds a key at a time, the others wait on its
+    event in ``pending`` and then use what it built. If it failed, the next
+    of them builds it.
+    """
+
+    while True:
+        with _lock:
+            value = instance.get(key)
+            if value is not None:
+                return value
+            event = pending.get(key)
+            if event is None:
+                event = pending[key] = threading.Event()
+                break
+        event.wait()
+
+    try:
+        value = build()
+        instance[key] = value
+        return value
+    finally:
+        with _lock:
+            del pending[key]
+        event.set()
+
+
+def minimize(regex):
+    """Returns the minimized AT&T-formatted FST of ``regex``, which
+    ``from_regex`` accepts in place of building it.
+    """
+
+    return _attFstMinimize(_attFstFromRegex(str(regex)))
+
+
+def from_regex(regex, fixed_slice, att_fst=None):
     """Given an input ``regex`` and integer ``fixed_slice`` constructs an
     ``fte.dfa.DFA()`` object that can be used to ``(un)rank`` into the language
     generated by ``regex`` with strings of length ``fixed_slice``.
+    If another thread, or ``fte.warmup``, is building this DFA, we wait for
+    it instead. The optional ``att_fst`` is the output of ``minimize(regex)``,
+    passed by ``fte.warmup`` which holds the pending build itself.
     """
-    global _instance
 
     regex = str(regex)
     fixed_slice = int(fixed_slice)
 
-    if not _instance.get((regex, fixed_slice)):
-        att_fst = _attFstFromRegex(regex)
-        att_fst = _attFstMinimize(att_fst)
-    
+    def build():
+        fst = att_fst or minimize(regex)
+
         # the following can throw an exception, but don't catch it
         # as we want the exception to let the user know their
         # paramters may be bad
-        dfa = fte.cDFA.DFA(att_fst, fixed_slice)
-        _instance[(regex, fixed_slice)] = DFA(dfa, fixed_slice)
-        
-    return _instance[(regex, fixed_slice)]
+        dfa = fte.cDFA.DFA(fst, fixed_slice, _getTablePath(fst, fixed_slice))
+        return DFA(dfa, fixed_slice)
+
+    if att_fst is None:
+        return single_flight(_instance, _pending, (regex, fixed_slice), build)
+
+    value = _instance.get((regex, fixed_slice))
+    if value is None:
+        value = _instance[(regex, fixed_slice)] = build()
+    return value
@@ -16,14 +16,19 @@
 # You should have received a copy of the GNU General Public License
 # along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
 
+import time
 import string
 import math
+import threading
+import collections
 
 import fte.conf
 import fte.bit_ops
 import fte.dfa
 import fte.defs
 import fte.encrypter
+import fte.logger
+import fte.metrics
 
 
 class InvalidInputException(Exception):
@@ -41,26 +46,117 @@ class DecodeFailureError(Exception):
     pass
 
 
-_instance = {}
+class EncoderCache(object):
+
+    """A cache of ``RegexEncoderObject``s that holds at most
+    ``runtime.fte.encoder.cache_bytes`` bytes of rank tables. Once it's
+    full, it evicts the least-recently-used encoders. An encoder that is
+    still in use keeps its DFA, and ``fte.dfa`` hands that DFA to the
+    encoder built in its place, so its table is freed only once nobody
+    uses it, and is never built twice.
+    """
+
+    def __init__(self):
+        # (regex, fixed_slice) -> [encoder, table size], least-recently-used
+        # first
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self._entries[key] = entry
+            self._hits += 1
+            return entry[0]
+
+    def __setitem__(self, key, encoder):
+        """Adds ``encoder``, which was built because it wasn't in the cache,
+        then evicts encoders until we are within our budget. We keep
+        ``encoder`` even if its table alone is over our budget.
+        """
+
+        size = encoder.getTableSize()
+        budget = fte.conf.getValue('runtime.fte.encoder.cache_bytes')
+        if budget is not None and size > budget:
+            fte.logger.warning("fte.encoder the table of " + repr(key) +
+                               " is " + str(size) + " bytes, more than the "
+                               "cache holds")
+        with self._lock:
+            self._misses += 1
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+            self._entries[key] = [encoder, size]
+            self._bytes += size
+            self._evict()
+
+    def _evict(self):
+        budget = fte.conf.getValue('runtime.fte.encoder.cache_bytes')
+        if budget is None:
+            return
+
+        # the most recently added encoder stays, it was built to be used
+        while self._bytes > budget and len(self._entries) > 1:
+            [key, [encoder, size]] = self._entries.popitem(last=False)
+            self._bytes -= size
+            self._evictions += 1
+
+    def getStats(self):
+        """Returns the number of ``entries`` in the cache, the ``bytes`` of
+        their tables, and the number of ``hits``, ``misses`` and
+        ``evictions`` so far. A miss is a build of an encoder.
+        """
+
+        with self._lock:
+            return {'entries': len(self._entries),
+                    'bytes': self._bytes,
+                    'hits': self._hits,
+                    'misses': self._misses,
+                    'evictions': self._evictions}
+
+
+_instance = EncoderCache()
+# a threading.Event for each (regex, fixed_slice) that is being built
+_pending = {}
+
+
+def getCacheStats():
+    """Returns ``EncoderCache.getStats`` of the cache of every encoder."""
+
+    return _instance.getStats()
 
 
 class RegexEncoder(object):
 
     """A proxy object used for caching invocations of ``RegexEncoderObject``.
     If a ``RegexEncoder`` is invoked twice in one process, we want to invoke
-    ``RegexEncoderObject.__init__`` only once.
+    ``RegexEncoderObject.__init__`` only once, even if the two are in
+    different threads at the same time, unless the ``EncoderCache`` evicted
+    it in between.
     """
 
     def __new__(self, regex, fixed_slice):
-        global _instance
-        if not _instance.get((regex, fixed_slice)):
-            _instance[(regex, fixed_slice)] = RegexEncoderObject(regex, fixed_slice)
-        return _instance[(regex, fixed_slice)]
+        return fte.dfa.single_flight(
+            _instance, _pending, (regex, fixed_slice),
+            lambda: RegexEncoderObject(regex, fixed_slice))
 
 
 class RegexEncoderObject(object):
     _COVERTEXT_HEADER_LEN_PLAINTEXT = 8
     _COVERTEXT_HEADER_LEN_CIPHERTTEXT = 16
+    # the unrank payload sizes, in bytes, of the short slices that
+    # ``encodeUnframed`` may use in place of ``fixed_slice``
+    _SLICE_LADDER = [48, 64, 96]
 
     def __init__(self, regex, fixed_slice):
         """Constructs a new object that can be used for encoding/decoding.
@@ -74,6 +170,35 @@ class RegexEncoderObject(object):
         self._fixed_slice = fixed_slice
         self._dfa = fte.dfa.from_regex(self._regex, self._fixed_slice)
         self._encrypter = fte.encrypter.Encrypter()
+        self._format_name = None
+        self._metrics_labels = {}
+        self._buildSliceLadder()
+
+    def _buildSliceLadder(self):
+        """For each payload size in ``_SLICE_LADDER`` that is smaller than
+        ``getMaximumBytesToRank()``, find the shortest slice that can unrank
+        it. The tables built for ``fixed_slice`` already cover these slices.
+        """
+
+        self._words_in_slice = {self._fixed_slice: self._dfa._words_in_slice}
+        self._slices = [self._fixed_slice]
+
+        words_in_slice = {}
+        for n in range(1, self._fixed_slice):
+            words_in_slice[n] = self._dfa.getNumWordsInSlice(n)
+
+        for payload_len in RegexEncoderObject._SLICE_LADDER:
+            if payload_len >= self.getMaximumBytesToRank():
+                break
+            for n in range(1, self._fixed_slice):
+                words = words_in_slice[n]
+                if words > 0 and (words.bit_length() - 2) // 8 >= payload_len:
+                    if n not in self._slices:
+                        self._words_in_slice[n] = words
+                        self._slices.append(n)
+                    break
+
+        self._slices.sort()
 
     def getCapacity(self):
         """Returns the size, in bits, of the language of our input ``regex``.
@@ -84,17 +209,105 @@ class RegexEncoderObject(object):
 
         return self._dfa._capacity
 
-    def encode(self, X):
+    def getTableSize(self):
+        """Returns the number of bytes our rank table occupies in memory."""
+
+        return self._dfa.getTableSize()
+
+    def getStats(self):
+        """Returns the ``fte.dfa.DFA.getStats`` counters of our DFA."""
+
+        return self._dfa.getStats()
+
+    def resetStats(self):
+        self._dfa.resetStats()
+
+    def getFormatName(self):
+        """Returns the name of our format in ``fte.metrics`` and
+        ``fte.trace``, see ``fte.metrics.getFormatName``.
+        """
+
+        if self._format_name is None:
+            self._format_name = fte.metrics.getFormatName(self._regex,
+                                                          self._fixed_slice)
+        return self._format_name
+
+    def getMetricsLabels(self, direction):
+        """Returns the ``fte.metrics`` labels of our cells in ``direction``,
+        ``encode`` or ``decode``.
+        """
+
+        labels = self._metrics_labels.get(direction)
+        if labels is None:
+            labels = (('format', self.getFormatName()),
+                      ('direction', direction))
+            self._metrics_labels[direction] = labels
+        return labels
+
+    def getMaximumBytesToRank(self, fixed_slice=None):
+        """Returns ``n``, the number of bytes of ``X`` that are unranked into
+        the first ``fixed_slice`` bytes of the covertext. The optional
+        ``fixed_slice`` must be one of ``getSlices()``.
+        """
+
+        if fixed_slice is None or fixed_slice == self._fixed_slice:
+            return int(math.floor(self.getCapacity() / 8.0))
+
+        # floor(log2(words)) - 1 bits, as in fte.dfa.DFA
+        return (self._words_in_slice[fixed_slice].bit_length() - 2) // 8
+
+    def getRadix(self, fixed_slice=None):
+        """Returns the number of distinct digits ``encodeUnframed`` can carry
+        alongside a full ``n``-byte unrank payload. Calculated from the exact
+        number of words in the slice, rather than the floor of its log, so it
+        captures the fractional capacity left over by ``getCapacity``.
+        """
+
+        if fixed_slice is None:
+            fixed_slice = self._fixed_slice
+
+        return self._words_in_slice[fixed_slice] >> (
+            8 * self.getMaximumBytesToRank(fixed_slice))
+
+    def getSlices(self):
+        """Returns, in ascending order, the slice lengths that
+        ``encodeUnframed`` can use. The last is always ``fixed_slice``.
+        """
+
+        return list(self._slices)
+
+    def getShortestSlice(self, n):
+        """Returns the shortest slice in ``getSlices()`` that can unrank
+        ``n`` bytes, or ``fixed_slice`` if there is no such slice.
+        """
+
+        for fixed_slice in self._slices:
+            if self.getMaximumBytesToRank(fixed_slice) >= n:
+                return fixed_slice
+
+        return self._fixed_slice
+
+    def isPrefix(self, covertext):
+        """Returns ``False`` if ``covertext`` can't be the start of
+        anything ``encode`` outputs, without ranking it. Only the first
+        ``fixed_slice`` bytes are checked.
+        """
+
+        return self._dfa.isPrefix(covertext[:self._fixed_slice])
+
+    def encode(self, X, hint=None):
         """Given a string ``X``, returns ``unrank(X[:n]) || X[n:]`` where ``n``
         is the the maximum number of bytes that can be unranked w.r.t. the
         capacity of the input ``regex`` and ``unrank`` is w.r.t. to the input
-        ``regex``.
+        ``regex``. The optional 8-byte ``hint`` takes the place of the random
+        bytes in the length header, ``decodeWithHint`` returns it.
         """
 
         if not isinstance(X, str):
             raise InvalidInputException('Input must be of type string.')
+        start = fte.metrics.enabled and time.time()
 
-        maximumBytesToRank = int(math.floor(self.getCapacity() / 8.0))
+        maximumBytesToRank = self.getMaximumBytesToRank()
         unrank_payload_len = (
             maximumBytesToRank - RegexEncoderObject._COVERTEXT_HEADER_LEN_CIPHERTTEXT)
         unrank_payload_len = min(len(X), unrank_payload_len)
@@ -102,7 +315,10 @@ class RegexEncoderObject(object):
         msg_len_header = fte.bit_ops.long_to_bytes(unrank_payload_len)
         msg_len_header = string.rjust(
             msg_len_header, RegexEncoderObject._COVERTEXT_HEADER_LEN_PLAINTEXT, '\x00')
-        msg_len_header = fte.bit_ops.random_bytes(8) + msg_len_header
+        if hint is None:
+            hint = fte.bit_ops.random_bytes(8)
+        assert len(hint) == 8
+        msg_len_header = hint + msg_len_header
         msg_len_header = self._encrypter.encryptOneBlock(msg_len_header)
 
         unrank_payload = msg_len_header + \
@@ -121,12 +337,24 @@ class RegexEncoderObject(object):
 
         covertext = formatted_covertext_header + unformatted_covertext_body
 
+        if start:
+            fte.metrics.observe('fte_cell_seconds',
+                                self.getMetricsLabels('encode'),
+                                time.time() - start)
+
         return covertext
 
     def decode(self, covertext):
         """Given an input string ``unrank(X[:n]) || X[n:]`` returns ``X``.
         """
 
+        return self.decodeWithHint(covertext)[1]
+
+    def decodeWithHint(self, covertext):
+        """As ``decode``, but returns ``[hint, X]``, where ``hint`` is the
+        value given to ``encode``, or random bytes if none was.
+        """
+
         if not isinstance(covertext, str):
             raise InvalidInputException('Input must be of type string.')
 
@@ -134,8 +362,9 @@ class RegexEncoderObject(object):
         if insufficient:
             raise DecodeFailureError(
                 "Covertext is shorter than self._fixed_slice, can't decode.")
+        start = fte.metrics.enabled and time.time()
 
-        maximumBytesToRank = int(math.floor(self.getCapacity() / 8.0))
+        maximumBytesToRank = self.getMaximumBytesToRank()
 
         rank_payload = self._dfa.rank(covertext[:self._fixed_slice])
         X = fte.bit_ops.long_to_bytes(rank_payload)
@@ -143,6 +372,7 @@ class RegexEncoderObject(object):
         X = string.rjust(X, maximumBytesToRank, '\x00')
         msg_len_header = self._encrypter.decryptOneBlock(
             X[:RegexEncoderObject._COVERTEXT_HEADER_LEN_CIPHERTTEXT])
+        hint = msg_len_header[:8]
         msg_len_header = msg_len_header[8:16]
         msg_len = fte.bit_ops.bytes_to_long(
             msg_len_header[:RegexEncoderObject._COVERTEXT_HEADER_LEN_PLAINTEXT])
@@ -150,4 +380,96 @@ class RegexEncoderObject(object):
         retval = X[16:16 + msg_len]
         retval += covertext[self._fixed_slice:]
 
-        return retval
+        if start:
+            fte.metrics.observe('fte_cell_seconds',
+                                self.getMetricsLabels('decode'),
+                                time.time() - start)
+
+        return [hint, retval]
+
+    def encodeUnframed(self, X, digit=0, fixed_slice=None):
+        """Given a string ``X``, returns ``unrank(X[:n]) || X[n:]`` where ``n``
+        is the maximum number of bytes that can be unranked. Unlike ``encode``
+        no length header is embedded in the unranked region, if ``X`` is
+        shorter than ``n`` bytes it is padded with random bytes. It's the
+        responsibility of the caller to recover ``len(X)`` from ``X[:n]``.
+        The optional ``digit``, which must be less than ``getRadix()``, is
+        unranked along with ``X[:n]`` and returned by ``decodeUnframed``.
+        The optional ``fixed_slice``, one of ``getSlices()``, overrides the
+        length of the unranked region.
+        """
+
+        if fixed_slice is None:
+            fixed_slice = self._fixed_slice
+
+        if not isinstance(X, str):
+            raise InvalidInputException('Input must be of type string.')
+        if fixed_slice not in self._words_in_slice:
+            raise InvalidInputException('Slice must be one of getSlices().')
+        if digit < 0 or digit >= self.getRadix(fixed_slice):
+            raise InvalidInputException('Digit must be less than getRadix().')
+        start = fte.metrics.enabled and time.time()
+
+        maximumBytesToRank = self.getMaximumBytesToRank(fixed_slice)
+
+        unrank_payload = X[:maximumBytesToRank]
+        random_padding_bytes = maximumBytesToRank - len(unrank_payload)
+        if random_padding_bytes > 0:
+            unrank_payload += fte.bit_ops.random_bytes(random_padding_bytes)
+
+        unrank_payload = fte.bit_ops.bytes_to_long(unrank_payload)
+        unrank_payload += digit << (8 * maximumBytesToRank)
+
+        formatted_covertext_header = self._dfa.unrank(
+            unrank_payload, fixed_slice)
+        unformatted_covertext_body = X[maximumBytesToRank:]
+
+        covertext = formatted_covertext_header + unformatted_covertext_body
+
+        if start:
+            fte.metrics.observe('fte_cell_seconds',
+                                self.getMetricsLabels('encode'),
+                                time.time() - start)
+
+        return covertext
+
+    def decodeUnframed(self, covertext, fixed_slice=None):
+        """Given an input string ``unrank(X[:n]) || X[n:]`` returns the list
+        ``[X[:n], X[n:], digit]``. If ``X`` was shorter than ``n`` bytes, then
+        the first element includes the random padding added by
+        ``encodeUnframed``. The optional ``fixed_slice`` must match the value
+        passed to ``encodeUnframed``.
+        """
+
+        if fixed_slice is None:
+            fixed_slice = self._fixed_slice
+
+        if not isinstance(covertext, str):
+            raise InvalidInputException('Input must be of type string.')
+        if fixed_slice not in self._words_in_slice:
+            raise InvalidInputException('Slice must be one of getSlices().')
+
+        insufficient = (len(covertext) < fixed_slice)
+        if insufficient:
+            raise DecodeFailureError(
+                "Covertext is shorter than fixed_slice, can't decode.")
+        start = fte.metrics.enabled and time.time()
+
+        maximumBytesToRank = self.getMaximumBytesToRank(fixed_slice)
+
+        try:
+            rank_payload = self._dfa.rank(covertext[:fixed_slice])
+        except RuntimeError:
+            raise DecodeFailureError(
+                "Covertext is not in the language of regex, can't decode.")
+        digit = rank_payload >> (8 * maximumBytesToRank)
+        rank_payload -= digit << (8 * maximumBytesToRank)
+        X = fte.bit_ops.long_to_bytes(rank_payload)
+        X = string.rjust(X, maximumBytesToRank, '\x00')
+
+        if start:
+            fte.metrics.observe('fte_cell_seconds',
+                                self.getMetricsLabels('decode'),
+                                time.time() - start)
+
+        return [X, covertext[fixed_slice:], digit]
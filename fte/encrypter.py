@@ -17,12 +17,18 @@
 # along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import time
+import struct
+import threading
+
 from Crypto.Cipher import AES
 from Crypto.Hash import HMAC
 from Crypto.Hash import SHA512
 from Crypto.Util import Counter
 
+import fte.conf
 import fte.bit_ops
+import fte.metrics
 
 
 class InvalidKeyLengthError(Exception):
@@ -74,6 +80,7 @@ class Encrypter(object):
     _IV_LENGTH = 7
     _MSG_COUNTER_LENGTH = 8
     _CTXT_EXPANSION = 1 + _IV_LENGTH + _MSG_COUNTER_LENGTH + _MAC_LENGTH
+    _KEY_HINT_LENGTH = 8
 
     def __init__(self, K1=None, K2=None):
 
@@ -167,6 +174,8 @@ class Encrypter(object):
         mac = HMAC.new(self.K2, W1 + W2, SHA512)
         T_actual = mac.digest()[:Encrypter._MAC_LENGTH]
         if T_expected != T_actual:
+            if fte.metrics.enabled:
+                fte.metrics.increment('fte_decrypt_failures_total')
             raise UnrecoverableDecryptionError('Failed to verify MAC.')
 
         iv2_bytes = '\x02' + self._ecb_enc_K1.decrypt(W1)[1:8]
@@ -201,6 +210,10 @@ class Encrypter(object):
         ciphertext_header = ciphertext[:16]
         L = self._ecb_enc_K1.decrypt(ciphertext_header)
 
+        validPrefix = (L[0] == '\x01')
+        if validPrefix is False:
+            raise UnrecoverableDecryptionError('Invalid IV prefix.')
+
         padding_expected = '\x00\x00\x00\x00'
         padding_actual = L[-8:-4]
         validPadding = (padding_actual == padding_expected)
@@ -229,3 +242,73 @@ class Encrypter(object):
 
         assert len(ciphertext) == 16
         return self._ecb_enc_K1.decrypt(ciphertext)
+
+    def getKeyHint(self, epoch=None):
+        """Returns the 8-byte hint that identifies our keys to a ``KeyRing``
+        during ``epoch``, which defaults to the current one. The hint is
+        keyed with ``K2``, so only a holder of our keys can compute it.
+        """
+
+        if epoch is None:
+            epoch = getKeyHintEpoch()
+
+        mac = HMAC.new(self.K2, 'fteproxy key hint' + struct.pack('!Q', epoch),
+                       SHA512)
+        return mac.digest()[:Encrypter._KEY_HINT_LENGTH]
+
+
+def getKeyHintEpoch():
+    """Returns the current epoch of ``runtime.fte.encrypter.key_hint_period``
+    seconds, key hints change with each one.
+    """
+
+    return int(time.time()) // fte.conf.getValue(
+        'runtime.fte.encrypter.key_hint_period')
+
+
+class KeyRing(object):
+
+    """Holds the ``Encrypter`` of each 32-byte ``K1 || K2`` key in ``keys``.
+    ``lookup`` finds the one that computed a key hint with a single dict
+    lookup, however many keys we hold. Hints from the previous and next
+    epochs are accepted too, to allow for clock skew.
+    """
+
+    def __init__(self, keys):
+        self._encrypters = [Encrypter(K1=key[0:16], K2=key[16:32])
+                            for key in keys]
+        self._hints = {}
+        self._lock = threading.Lock()
+
+    def getNumKeys(self):
+        return len(self._encrypters)
+
+    def lookup(self, hint):
+        """Returns the ``Encrypter`` whose key hint is ``hint``, or ``None``.
+        """
+
+        epoch = getKeyHintEpoch()
+        with self._lock:
+            if epoch not in self._hints:
+                self._updateHints(epoch)
+            for hints in self._hints.values():
+                encrypter = hints.get(hint)
+                if encrypter is not None:
+                    return encrypter
+
+        return None
+
+    def _updateHints(self, epoch):
+        """Computes the hints of the epochs around ``epoch`` that we don't
+        have, and forgets the rest.
+        """
+
+        hints = {}
+        for e in [epoch - 1, epoch, epoch + 1]:
+            if e in self._hints:
+                hints[e] = self._hints[e]
+                continue
+            hints[e] = {}
+            for encrypter in self._encrypters:
+                hints[e][encrypter.getKeyHint(e)] = encrypter
+        self._hints = hints
@@ -25,5 +25,9 @@ def debug(msg):
     pass  # print msg
 
 
+def warning(msg):
+    pass  # print msg
+
+
 def error(msg):
     pass  # print msg
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Counters and latency histograms of what fteproxy does, most of them per
+format, which ``start`` serves in the Prometheus text format. Nothing is
+recorded until ``start`` is called, callers check ``enabled`` first.
+"""
+
+import os
+import bisect
+import hashlib
+import threading
+import SocketServer
+import BaseHTTPServer
+
+import fte.conf
+import fte.defs
+
+
+"""The name, type and help of each metric, in the order we export them."""
+METRICS = [
+    ['fte_cells_total', 'counter',
+     'Cells encoded or decoded.'],
+    ['fte_plaintext_bytes_total', 'counter',
+     'Plaintext bytes carried by cells.'],
+    ['fte_covertext_bytes_total', 'counter',
+     'Covertext bytes of cells, on the wire.'],
+    ['fte_capacity_bytes_total', 'counter',
+     'Ciphertext bytes the unranked slices of encoded cells could carry.'],
+    ['fte_capacity_used_bytes_total', 'counter',
+     'Ciphertext bytes the unranked slices of encoded cells carried.'],
+    ['fte_cell_seconds', 'histogram',
+     'Seconds to encode or decode the ranked slice of a cell.'],
+    ['fte_decrypt_failures_total', 'counter',
+     'Ciphertexts that failed to authenticate.'],
+    ['fte_negotiations_total', 'counter',
+     'Server-side negotiations, by outcome.'],
+    ['fte_relay_connections_total', 'counter',
+     'Connections relayed.'],
+    ['fte_relay_connections_closed_total', 'counter',
+     'Relayed connections that have closed.'],
+    ['fte_relay_connect_failures_total', 'counter',
+     'Connections we failed to connect or negotiate, and did not relay.'],
+    ['fte_relay_bytes_total', 'counter',
+     'Bytes read from relayed sockets.'],
+]
+
+"""The upper bounds, in seconds, of the buckets of each histogram."""
+LATENCY_BUCKETS = [0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025]
+
+enabled = False
+
+_lock = threading.Lock()
+# (name, labels) -> value of each counter, labels is a tuple of (key, value)
+_counters = {}
+# (name, labels) -> [count of each bucket, then of +Inf, sum] of each
+# histogram, bucket counts aren't cumulative until we export them
+_histograms = {}
+
+
+def increment(name, labels=(), value=1):
+    with _lock:
+        _counters[(name, labels)] = _counters.get((name, labels), 0) + value
+
+
+def incrementAll(labels, values):
+    """Increments each counter in ``values``, a list of ``[name, value]``,
+    with the same ``labels``. Cheaper than calling ``increment`` for each.
+    """
+
+    with _lock:
+        for name, value in values:
+            key = (name, labels)
+            _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, labels, value):
+    bucket = bisect.bisect_left(LATENCY_BUCKETS, value)
+
+    with _lock:
+        histogram = _histograms.get((name, labels))
+        if histogram is None:
+            histogram = _histograms[(name, labels)] = \
+                [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+        histogram[bucket] += 1
+        histogram[-1] += value
+
+
+def getFormatName(regex, fixed_slice):
+    """Returns the names of the languages of ``fte.defs.release`` with
+    ``regex`` and ``fixed_slice``, or a digest of ``regex`` if there are
+    none.
+    """
+
+    names = []
+    for language in sorted(fte.defs.load_definitions().keys()):
+        definition = fte.defs.getDefinition(language)
+        if definition.regex == regex and \
+                int(definition.fixed_slice) == int(fixed_slice):
+            names.append(language)
+    if names:
+        return ','.join(names)
+
+    return 'regex-' + hashlib.sha1(str(regex)).hexdigest()[:12] + '-' + \
+        str(fixed_slice)
+
+
+def reset():
+    """Forget every value recorded so far."""
+
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def _formatLabels(labels, extra=()):
+    labels = labels + extra
+    if not labels:
+        return ''
+    return '{' + ','.join(key + '="' + str(value).replace('\\', '\\\\')
+                          .replace('"', '\\"') + '"'
+                          for key, value in labels) + '}'
+
+
+def export():
+    """Returns every metric, in the Prometheus text format."""
+
+    with _lock:
+        counters = dict(_counters)
+        histograms = dict((key, list(value))
+                          for key, value in _histograms.items())
+
+    lines = []
+    for [name, metric_type, help_text] in METRICS:
+        lines.append('# HELP ' + name + ' ' + help_text)
+        lines.append('# TYPE ' + name + ' ' + metric_type)
+        if metric_type == 'counter':
+            for key in sorted(k for k in counters if k[0] == name):
+                lines.append(name + _formatLabels(key[1]) + ' ' +
+                             str(counters[key]))
+            continue
+
+        for key in sorted(k for k in histograms if k[0] == name):
+            histogram = histograms[key]
+            count = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS + ['+Inf'],
+                                           histogram[:-1]):
+                count += bucket_count
+                lines.append(name + '_bucket' +
+                             _formatLabels(key[1], (('le', bound),)) +
+                             ' ' + str(count))
+            lines.append(name + '_sum' + _formatLabels(key[1]) + ' ' +
+                         repr(histogram[-1]))
+            lines.append(name + '_count' + _formatLabels(key[1]) + ' ' +
+                         str(count))
+
+    return '\n'.join(lines) + '\n'
+
+
+class _handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        body = export()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _tcpServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _unixServer(SocketServer.ThreadingMixIn,
+                  SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+class server(threading.Thread):
+
+    """Serves ``export()`` over HTTP on ``runtime.fte.metrics.port`` of
+    ``runtime.fte.metrics.ip``, or on the Unix socket
+    ``runtime.fte.metrics.unix_socket``.
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self._unix_socket = fte.conf.getValue('runtime.fte.metrics.unix_socket')
+        if self._unix_socket:
+            if os.path.exists(self._unix_socket):
+                os.unlink(self._unix_socket)
+            self._server = _unixServer(self._unix_socket, _handler)
+        else:
+            self._server = _tcpServer(
+                (fte.conf.getValue('runtime.fte.metrics.ip'),
+                 fte.conf.getValue('runtime.fte.metrics.port')), _handler)
+
+    def getAddress(self):
+        """Returns the address we serve on, a Unix socket path or
+        ``(ip, port)``."""
+
+        return self._server.server_address
+
+    def run(self):
+        self._server.serve_forever(0.5)
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._unix_socket and os.path.exists(self._unix_socket):
+            os.unlink(self._unix_socket)
+
+
+def start():
+    """Start recording, and serving what we've recorded if there's a
+    ``runtime.fte.metrics.port`` or ``runtime.fte.metrics.unix_socket``.
+    Returns the ``server``, or ``None``.
+    """
+
+    global enabled
+
+    enabled = True
+    if fte.conf.getValue('runtime.fte.metrics.port') is None and \
+            not fte.conf.getValue('runtime.fte.metrics.unix_socket'):
+        return None
+
+    retval = server()
+    retval.start()
+    return retval
+
+
+def stop():
+    """Stop recording."""
+
+    global enabled
+
+    enabled = False
@@ -0,0 +1,447 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+import errno
+import socket
+import struct
+import threading
+import collections
+
+import fte.conf
+import fte.logger
+import fte.network_io
+import fte.relay
+
+
+"""Opens a stream, sent by clients only. Carries no payload."""
+FRAME_OPEN = 1
+
+"""Carries data of a stream."""
+FRAME_DATA = 2
+
+"""Closes a stream, sent by either side. Carries no payload."""
+FRAME_CLOSE = 3
+
+"""Allows the peer to send more data on a stream, the payload is the number
+of bytes, as a 32-bit unsigned integer."""
+FRAME_WINDOW = 4
+
+FRAME_TYPES = [FRAME_OPEN, FRAME_DATA, FRAME_CLOSE, FRAME_WINDOW]
+
+# the maximum number of bytes of data per frame
+MAX_FRAME_PAYLOAD = 2 ** 14
+
+# stream id, frame type, payload length
+_HEADER = struct.Struct('!IBH')
+_WINDOW = struct.Struct('!I')
+
+
+class InvalidFrameException(Exception):
+    pass
+
+
+def packFrame(stream_id, frame_type, payload=''):
+    """Returns the frame of ``frame_type`` for ``stream_id``."""
+
+    assert len(payload) <= MAX_FRAME_PAYLOAD
+    return _HEADER.pack(stream_id, frame_type, len(payload)) + payload
+
+
+def unpackFrames(data):
+    """Returns ``[frames, remaining]``, where ``frames`` is a list of
+    ``[stream_id, frame_type, payload]`` for each complete frame at the start
+    of ``data``, and ``remaining`` is the incomplete frame that follows.
+    Raises ``InvalidFrameException`` if a frame is malformed.
+    """
+
+    frames = []
+    offset = 0
+    while len(data) - offset >= _HEADER.size:
+        [stream_id, frame_type, length] = _HEADER.unpack_from(data, offset)
+        if frame_type not in FRAME_TYPES or length > MAX_FRAME_PAYLOAD:
+            raise InvalidFrameException(frame_type)
+        end = offset + _HEADER.size + length
+        if end > len(data):
+            break
+        frames.append([stream_id, frame_type, data[offset + _HEADER.size:end]])
+        offset = end
+
+    return [frames, data[offset:]]
+
+
+class stream(object):
+
+    """One stream of an ``fte.mux.session``, relayed to and from a socket
+    with a thread per direction, as ``fte.relay.worker`` does. Each side
+    sends at most ``runtime.fte.mux.window`` bytes that its peer hasn't yet
+    written to its socket, the peer grants more with ``FRAME_WINDOW``. A
+    slow socket stalls its own stream, but not the rest of the session.
+    """
+
+    def __init__(self, session, stream_id, window):
+        self._session = session
+        self._stream_id = stream_id
+        self._window = window
+        self._send_window = window
+        self._cond = threading.Condition()
+        self._incoming = collections.deque()
+        # the number of bytes in _incoming
+        self._queued = 0
+        # the number of bytes written to our socket since our last FRAME_WINDOW
+        self._consumed = 0
+        self._closed = False
+        self._close_sent = False
+        self._socket = None
+        self._closer = None
+
+    def getStreamId(self):
+        return self._stream_id
+
+    def getNumQueued(self):
+        """Returns the number of bytes received, but not yet written to our
+        socket.
+        """
+
+        return self._queued
+
+    def start(self, sock):
+        """Relay data between ``sock`` and our session, until either closes
+        the stream. ``sock`` is closed once we are done with it.
+        """
+
+        self._socket = sock
+        # whichever direction finishes last closes the socket
+        self._closer = fte.relay._closer([sock], 2)
+        for target in [self._sendLoop, self._recvLoop]:
+            t = threading.Thread(target=target)
+            t.daemon = True
+            t.start()
+
+    def close(self):
+        """Stop relaying, and tell our peer unless it closed the stream."""
+
+        with self._cond:
+            send_close = not self._close_sent
+            self._close_sent = True
+            self._closed = True
+            self._cond.notify_all()
+        if send_close:
+            self._session.send(self._stream_id, FRAME_CLOSE)
+        self._session._removeStream(self)
+
+    def onData(self, data):
+        with self._cond:
+            if self._closed:
+                return
+            self._queued += len(data)
+            overflow = (self._queued > self._window)
+            if not overflow:
+                self._incoming.append(data)
+                self._cond.notify_all()
+        if overflow:
+            fte.logger.error("fte.mux stream " + str(self._stream_id) +
+                             " exceeded its window")
+            self.close()
+
+    def onWindow(self, increment):
+        with self._cond:
+            self._send_window += increment
+            self._cond.notify_all()
+
+    def onClose(self):
+        """Our peer closed the stream, or our session ended. Data we have
+        received is still written to our socket.
+        """
+
+        with self._cond:
+            self._close_sent = True
+            self._closed = True
+            self._cond.notify_all()
+        self._session._removeStream(self)
+
+    def _sendLoop(self):
+        try:
+            while True:
+                with self._cond:
+                    while self._send_window <= 0 and not self._closed:
+                        self._cond.wait()
+                    if self._closed:
+                        break
+                    bufsize = min(self._send_window, MAX_FRAME_PAYLOAD)
+                try:
+                    data = self._socket.recv(bufsize)
+                except socket.error:
+                    data = ''
+                if not data:
+                    break
+                with self._cond:
+                    self._send_window -= len(data)
+                if not self._session.send(self._stream_id, FRAME_DATA, data):
+                    break
+        finally:
+            # our _recvLoop shuts down the socket, once it has written all
+            # that our peer sent
+            self.close()
+            self._closer.release()
+
+    def _recvLoop(self):
+        try:
+            while True:
+                with self._cond:
+                    while not self._incoming and not self._closed:
+                        self._cond.wait()
+                    if not self._incoming:
+                        break
+                    data = self._incoming.popleft()
+                if fte.network_io.sendall_to_socket(self._socket, data) < 0:
+                    break
+                self._onConsumed(len(data))
+        finally:
+            # shutting down our socket stops our _sendLoop
+            self.close()
+            fte.network_io.shutdown_socket(self._socket)
+            self._closer.release()
+
+    def _onConsumed(self, num_bytes):
+        # we grant window in batches, rather than a frame per write
+        with self._cond:
+            self._queued -= num_bytes
+            self._consumed += num_bytes
+            if self._closed or self._consumed < self._window // 2:
+                return
+            increment = self._consumed
+            self._consumed = 0
+        self._session.send(self._stream_id, FRAME_WINDOW,
+                           _WINDOW.pack(increment))
+
+
+class session(threading.Thread):
+
+    """Carries any number of ``fte.mux.stream`` over ``sock``, an fteproxy
+    socket that has negotiated ``fte.record_layer.OPTION_MUX``. Clients open
+    streams with ``openStream``. Servers pass ``onOpen``, which is called
+    from our thread with each stream the client opens, and must hand it to
+    another thread to ``start`` or ``close``. A client may have up to
+    ``runtime.fte.mux.max_streams`` streams open, we close any others as
+    they are opened. The session ends, and closes all of its streams, once
+    ``sock`` is closed.
+    """
+
+    def __init__(self, sock, onOpen=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._socket = sock
+        # frames are small and latency-sensitive, don't wait to coalesce them
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._onOpen = onOpen
+        self._window = fte.conf.getValue('runtime.fte.mux.window')
+        self._max_streams = fte.conf.getValue('runtime.fte.mux.max_streams')
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        # frames waiting for _send_lock, sent together
+        self._outgoing = []
+        self._streams = {}
+        self._next_stream_id = 1
+        self._closed = False
+
+    def openStream(self, sock):
+        """Relay ``sock`` over a new stream. Raises ``socket.error`` if the
+        session has ended.
+        """
+
+        with self._lock:
+            if self._closed:
+                raise socket.error(errno.ENOTCONN, 'The session has ended.')
+            new_stream = stream(self, self._next_stream_id, self._window)
+            self._streams[self._next_stream_id] = new_stream
+            self._next_stream_id += 1
+
+        if not self.send(new_stream.getStreamId(), FRAME_OPEN):
+            new_stream.onClose()
+            raise socket.error(errno.ENOTCONN, 'The session has ended.')
+        new_stream.start(sock)
+        return new_stream
+
+    def getNumStreams(self):
+        return len(self._streams)
+
+    def isClosed(self):
+        return self._closed
+
+    def send(self, stream_id, frame_type, payload=''):
+        """Send a frame to our peer. Returns ``False`` if the session has
+        ended. Frames queued while another thread sends are sent together
+        by the next thread, such that they share cells.
+        """
+
+        with self._lock:
+            if self._closed:
+                return False
+            self._outgoing.append(packFrame(stream_id, frame_type, payload))
+
+        with self._send_lock:
+            with self._lock:
+                frames = self._outgoing
+                self._outgoing = []
+            if not frames:
+                return not self._closed
+            try:
+                self._socket.sendall(''.join(frames))
+            except socket.error:
+                sent = False
+            else:
+                sent = True
+        if not sent:
+            self.close()
+        return sent
+
+    def run(self):
+        data = ''
+        try:
+            while True:
+                received = self._socket.recv(2 ** 16)
+                if not received:
+                    break
+                [frames, data] = unpackFrames(data + received)
+                for [stream_id, frame_type, payload] in frames:
+                    self._onFrame(stream_id, frame_type, payload)
+        except (socket.error, InvalidFrameException) as e:
+            fte.logger.debug("fte.mux session ended: " + repr(e))
+        finally:
+            self.close()
+
+    def close(self):
+        """End the session, and close all of its streams."""
+
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            streams = self._streams.values()
+        fte.network_io.close_socket(self._socket)
+        for s in streams:
+            s.onClose()
+
+    def _onFrame(self, stream_id, frame_type, payload):
+        if frame_type == FRAME_OPEN:
+            if self._onOpen is None:
+                raise InvalidFrameException('Only clients open streams.')
+            with self._lock:
+                if stream_id in self._streams or self._closed:
+                    raise InvalidFrameException(
+                        'Stream ' + str(stream_id) + ' is already open.')
+                new_stream = None
+                if len(self._streams) < self._max_streams:
+                    new_stream = stream(self, stream_id, self._window)
+                    self._streams[stream_id] = new_stream
+            if new_stream is None:
+                fte.logger.error("fte.mux closing stream " + str(stream_id) +
+                                 ", too many streams are open")
+                self.send(stream_id, FRAME_CLOSE)
+            else:
+                self._onOpen(new_stream)
+            return
+
+        # frames may still arrive for streams we have closed
+        s = self._streams.get(stream_id)
+        if s is None:
+            return
+        if frame_type == FRAME_DATA:
+            s.onData(payload)
+        elif frame_type == FRAME_CLOSE:
+            s.onClose()
+        elif frame_type == FRAME_WINDOW:
+            if len(payload) != _WINDOW.size:
+                raise InvalidFrameException(payload)
+            s.onWindow(_WINDOW.unpack(payload)[0])
+
+    def _removeStream(self, s):
+        with self._lock:
+            if self._streams.get(s.getStreamId()) is s:
+                del self._streams[s.getStreamId()]
+
+
+class client(object):
+
+    """Carries the streams of a client over up to ``size`` sessions. Each
+    session is connected with ``connect``, which returns an fteproxy socket
+    that asks for ``fte.record_layer.OPTION_MUX``. A new stream uses the
+    session with the fewest streams, once there are ``size`` sessions.
+    Sessions that end are replaced as new streams need them.
+    """
+
+    def __init__(self, connect, size):
+        self._connect = connect
+        self._size = size
+        self._cond = threading.Condition()
+        self._sessions = []
+        self._connecting = 0
+        self._running = True
+
+    def openStream(self, sock):
+        """Relay ``sock`` over a new stream. Raises ``socket.error`` if no
+        session could be connected.
+        """
+
+        new_session = None
+        with self._cond:
+            while True:
+                if not self._running:
+                    raise socket.error(errno.ENOTCONN, 'The client has stopped.')
+                self._sessions = [s for s in self._sessions
+                                  if not s.isClosed()]
+                if len(self._sessions) + self._connecting < self._size:
+                    self._connecting += 1
+                    break
+                if self._sessions:
+                    new_session = min(self._sessions,
+                                      key=lambda s: s.getNumStreams())
+                    break
+                # wait for the sessions being connected
+                self._cond.wait()
+
+        if new_session is not None:
+            return new_session.openStream(sock)
+
+        try:
+            new_session = session(self._connect())
+            new_session.start()
+        finally:
+            with self._cond:
+                self._connecting -= 1
+                if new_session is not None:
+                    self._sessions.append(new_session)
+                    if not self._running:
+                        new_session.close()
+                self._cond.notify_all()
+
+        return new_session.openStream(sock)
+
+    def getNumSessions(self):
+        return len([s for s in self._sessions if not s.isClosed()])
+
+    def stop(self):
+        """End all of our sessions."""
+
+        with self._cond:
+            self._running = False
+            sessions = self._sessions
+            self._sessions = []
+            self._cond.notify_all()
+        for s in sessions:
+            s.close()
@@ -1,38 +1,63 @@
+import errno
 import select
 import socket
 
 
-def sendall_to_socket(sock, msg, socket_timeout=0.01):
-    """Given a socket ``sock`` and ``msg`` does a best effort to send
-    ``msg`` on ``sock`` as quickly as possible.
+class Waker(object):
+
+    """A self-pipe, used to wake a thread that is blocked in ``select`` or
+    ``poll``. The read end is ``fileno()``, ``wake`` makes it readable and
+    ``drain`` makes it unreadable again.
     """
 
-    totalsent = 0
-    try:
-        _incoming_timeout = sock.gettimeout()
-        sock.settimeout(socket_timeout)
-        while totalsent < len(msg):
-            sent = sock.send(msg[totalsent:])
-            if sent == 0:
-                break
-            totalsent = totalsent + sent
-    except socket.error:
-        totalsent = -1
-    finally:
+    def __init__(self):
+        self._reader, self._writer = socket.socketpair()
+        self._reader.setblocking(0)
+        self._writer.setblocking(0)
+
+    def fileno(self):
+        return self._reader.fileno()
+
+    def wake(self):
+        try:
+            self._writer.send('\x00')
+        except socket.error:
+            # the pipe is full, so the reader is already awake
+            pass
+
+    def drain(self):
         try:
-            sock.settimeout(_incoming_timeout)
-        except:
+            while self._reader.recv(2 ** 12):
+                pass
+        except socket.error:
             pass
 
-    return totalsent
+    def close(self):
+        close_socket(self._reader)
+        close_socket(self._writer)
+
+
+def sendall_to_socket(sock, msg):
+    """Given a socket ``sock`` and ``msg``, blocks until all of ``msg`` is
+    sent on ``sock``. Returns the number of bytes sent, or -1 if ``sock`` is
+    closed.
+    """
+
+    try:
+        sock.sendall(msg)
+    except socket.error:
+        return -1
+
+    return len(msg)
 
 
 def recvall_from_socket(sock,
                         bufsize=2 ** 12,
-                        socket_timeout=0.001,
-                        select_timeout=0.001):
-    """Give ``sock``, does a best effort to pull data from ``sock``.
-    By default, fails quickly if ``sock`` is closed or has no data ready.
+                        select_timeout=None):
+    """Give ``sock``, waits up to ``select_timeout`` seconds for ``sock`` to
+    become readable, or indefinitely if ``select_timeout`` is ``None``, then
+    pulls as much data as it can from ``sock`` without blocking, up to
+    ``bufsize`` bytes.
     The return value ``is_alive`` reports if ``sock`` is still alive.
     The return value ``retval`` is the data extracted from the socket.
     Unlike normal raw sockets, it may be the case that ``retval`` is '', and
@@ -40,45 +65,49 @@ def recvall_from_socket(sock,
     """
 
     retval = ''
-    is_alive = False
+    is_alive = True
 
     try:
-        _incoming_timeout = sock.gettimeout()
-        sock.settimeout(socket_timeout)
-        ready = select.select([sock], [], [sock], select_timeout)
-        if ready[0]:
-            while True:
-                _data = sock.recv(bufsize)
-                if _data:
-                    retval += _data
-                    is_alive = True
-                    if len(retval) >= bufsize:
-                        break
-                    else:
-                        continue
-                else:
-                    is_alive = (len(retval) > 0)
-                    break
-        elif ready[2]:
-            is_alive = (len(retval) > 0)
-        else:
-            # select.timeout
-            is_alive = True
+        if not _isReadable(sock, select_timeout):
+            return [is_alive, retval]
+        while len(retval) < bufsize:
+            _data = sock.recv(bufsize - len(retval))
+            if not _data:
+                is_alive = (len(retval) > 0)
+                break
+            retval += _data
+            if not _isReadable(sock, 0):
+                break
     except socket.timeout:
-        is_alive = True
-    except socket.error:
-        is_alive = (len(retval) > 0)
-    except select.error:
-        is_alive = (len(retval) > 0)
-    finally:
-        try:
-            sock.settimeout(_incoming_timeout)
-        except:
-            pass
+        # fteproxy sockets that are negotiating have no data yet
+        pass
+    except (socket.error, select.error) as e:
+        if e.args[0] != errno.EINTR:
+            is_alive = (len(retval) > 0)
 
     return [is_alive, retval]
 
 
+def _isReadable(sock, timeout):
+    # like ssl sockets, fteproxy sockets may hold data that select
+    # doesn't know about
+    if hasattr(sock, 'pending') and sock.pending():
+        return True
+    ready = select.select([sock], [], [sock], timeout)
+    return bool(ready[0] or ready[2])
+
+
+def shutdown_socket(sock):
+    """Given socket ``sock`` shuts it down for reading and writing, which wakes
+    any thread blocked on ``sock``, but leaves it open.
+    """
+
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except:
+        pass
+
+
 def close_socket(sock, lock=None):
     """Given socket ``sock`` closes the socket for reading and writing.
     If the optional ``lock`` parameter is provided, protects all accesses
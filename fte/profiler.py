@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A sampling profiler that can be started and stopped in a running
+fteproxy, bin/fteproxy toggles it on SIGUSR2. While it runs, the stack of
+every other thread is sampled each ``runtime.fte.profiler.interval``
+seconds. Once stopped, the samples are written to ``general.pid_dir`` as
+folded stacks, which flamegraph.pl draws, together with the calls to and
+time spent in rank, unrank and building DFAs while it ran, summed from the
+``getStats`` of every DFA in ``fte.dfa``. Nothing runs while it is stopped.
+"""
+
+import os
+import sys
+import time
+import weakref
+import threading
+
+import fte.conf
+import fte.dfa
+
+
+_lock = threading.Lock()
+_sampler = None
+# the sampler we last stopped, which may still be writing its profile
+_stopped = None
+
+
+class sampler(threading.Thread):
+
+    """Samples the stacks of all other threads until ``stop`` is called,
+    then writes them, and the work done by our DFAs meanwhile, to files
+    named ``fteproxy-<pid>-<time>`` in ``general.pid_dir``. Samples are of
+    wall time, so threads blocked on a socket are sampled too. The work of
+    a DFA that is freed before we stop isn't counted.
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._interval = fte.conf.getValue('runtime.fte.profiler.interval')
+        self._running = True
+        # folded stack -> number of samples
+        self._stacks = {}
+        self._paths = None
+        self._done = threading.Event()
+
+    def start(self):
+        # count from now, rather than from when our thread first runs
+        self._baseline = _getDFAStats()
+        self._start_time = time.time()
+        threading.Thread.start(self)
+
+    def run(self):
+        try:
+            while self._running:
+                time.sleep(self._interval)
+                self._sample()
+        finally:
+            self._paths = self._dump(time.time() - self._start_time)
+            self._done.set()
+
+    def stop(self):
+        """Stop sampling. The files are written by our thread, ``wait`` for
+        their paths."""
+
+        self._running = False
+
+    def wait(self, timeout=None):
+        """Returns the paths of the folded stacks and the counters, once
+        they're written."""
+
+        self._done.wait(timeout)
+        return self._paths
+
+    def _sample(self):
+        names = dict((thread.ident, type(thread).__name__)
+                     for thread in threading.enumerate())
+        for ident, frame in sys._current_frames().items():
+            if ident == self.ident:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                module = os.path.splitext(
+                    os.path.basename(code.co_filename))[0]
+                stack.append(module + '.' + code.co_name)
+                frame = frame.f_back
+            stack.append(names.get(ident, 'thread'))
+            stack = ';'.join(reversed(stack))
+            self._stacks[stack] = self._stacks.get(stack, 0) + 1
+
+    def _dump(self, elapsed):
+        path = os.path.join(fte.conf.getValue('general.pid_dir'),
+                            'fteproxy-' + str(os.getpid()) + '-' +
+                            time.strftime('%Y%m%d-%H%M%S'))
+
+        with open(path + '.folded', 'w') as f:
+            for stack in sorted(self._stacks.keys()):
+                f.write(stack + ' ' + str(self._stacks[stack]) + '\n')
+
+        profile = _getProfile(self._baseline, _getDFAStats())
+        with open(path + '.cdfa', 'w') as f:
+            f.write('# profiled for %.3fs\n' % elapsed)
+            f.write('# counter calls seconds\n')
+            for name in sorted(profile.keys()):
+                [calls, seconds] = profile[name]
+                f.write('%s %d %.6f\n' % (name, calls, seconds))
+
+        return [path + '.folded', path + '.cdfa']
+
+
+def _getDFAStats():
+    """Returns a weak reference to, and the ``getStats`` of, each DFA in
+    ``fte.dfa``, by its key."""
+
+    return dict((key, [weakref.ref(dfa), dfa.getStats()])
+                for key, dfa in fte.dfa._instance.items())
+
+
+def _getProfile(baseline, current):
+    """Returns ``[calls, seconds]`` for each of rank, unrank and build, done
+    by the DFAs of ``current`` since ``baseline``, both ``_getDFAStats``.
+    A DFA that isn't in ``baseline`` was built since.
+    """
+
+    retval = {'rank': [0, 0.0], 'unrank': [0, 0.0], 'build': [0, 0.0]}
+    for key, [ref, stats] in current.items():
+        [before_ref, before] = baseline.get(key, [None, None])
+        if before_ref is None or before_ref() is not ref():
+            before = dict((name, 0) for name in stats)
+            retval['build'][0] += 1
+            retval['build'][1] += stats['build_ns'] / 1e9
+        for name in ['rank', 'unrank']:
+            retval[name][0] += stats[name + '_calls'] - \
+                before[name + '_calls']
+            retval[name][1] += (stats[name + '_ns'] -
+                                before[name + '_ns']) / 1e9
+    return retval
+
+
+def isRunning():
+    return _sampler is not None
+
+
+def start():
+    """Start profiling, if we aren't."""
+
+    global _sampler
+
+    with _lock:
+        if _sampler is None:
+            # let it finish writing its files first
+            if _stopped is not None:
+                _stopped.wait()
+            _sampler = sampler()
+            _sampler.start()
+
+
+def stop():
+    """Stop profiling, if we are. Returns the ``sampler``, whose ``wait``
+    returns the paths of what it wrote, or ``None``.
+    """
+
+    global _sampler, _stopped
+
+    with _lock:
+        retval = _sampler
+        _sampler = None
+        if retval is not None:
+            _stopped = retval
+            retval.stop()
+    return retval
+
+
+def toggle():
+    """Stops profiling if we are, otherwise starts. Cheap enough to call
+    from a signal handler, the files are written by the sampler's thread.
+    """
+
+    if stop() is None:
+        start()
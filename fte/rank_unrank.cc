@@ -15,6 +15,23 @@
 
 #include <rank_unrank.h>
 
+#include <cstdio>
+#include <cstring>
+#include <ctime>
+
+#include <sys/time.h>
+
+#ifndef _WIN32
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#endif
+
+#ifdef __GLIBC__
+#include <malloc.h>
+#endif
+
 #include "re2/re2.h"
 #include "re2/regexp.h"
 #include "re2/prog.h"
@@ -26,6 +43,37 @@
  */
 
 
+// Relaxed atomic operations on the counters of DFAStats, with the __sync
+// builtins on compilers that predate the __atomic ones.
+#ifdef __ATOMIC_RELAXED
+#define STATS_ADD(counter, value) \
+    __atomic_fetch_add(&(counter), (value), __ATOMIC_RELAXED)
+#define STATS_LOAD(counter) __atomic_load_n(&(counter), __ATOMIC_RELAXED)
+#define STATS_STORE(counter, value) \
+    __atomic_store_n(&(counter), (value), __ATOMIC_RELAXED)
+#else
+#define STATS_ADD(counter, value) __sync_fetch_and_add(&(counter), (value))
+#define STATS_LOAD(counter) __sync_fetch_and_add(&(counter), 0)
+#define STATS_STORE(counter, value) \
+    __sync_lock_test_and_set(&(counter), (value))
+#endif
+
+
+// Returns a timestamp, in nanoseconds, from a monotonic clock where there
+// is one.
+uint64_t now_ns() {
+#ifdef CLOCK_MONOTONIC
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (uint64_t)ts.tv_sec * 1000000000 + ts.tv_nsec;
+#else
+    struct timeval tv;
+    gettimeofday(&tv, NULL);
+    return (uint64_t)tv.tv_sec * 1000000000 + (uint64_t)tv.tv_usec * 1000;
+#endif
+}
+
+
 // Helper fuction. Given a string and a token, performs a python .split()
 // Returns a list of string delimnated on the token
 array_type_string_t1 tokenize( std::string line, char delim ) {
@@ -97,17 +145,42 @@ static class _symbol_not_in_sigma: public std::exception
     }
 } symbol_not_in_sigma;
 
+// The layout of a table file: a table_header, then a table_entry for each
+// _T[q][i], in the order of _T_view, then the limbs of every entry.
+// Table files are only valid on hosts with the same endianness and limb size.
+static const char TABLE_MAGIC[8] = {'F', 'T', 'E', 'T', 'B', 'L', '0', '1'};
+
+struct table_header {
+    char magic[8];
+    uint32_t limb_bytes;
+    uint32_t num_states;
+    uint32_t fixed_slice;
+    uint32_t reserved;
+    uint64_t num_limbs;
+};
+
+struct table_entry {
+    uint64_t size;
+    uint64_t offset;
+};
+
 /*
  * Parameters:
  *   dfa_str: a minimized ATT FST formatted DFA, see: http://www2.research.att.com/~fsmtools/fsm/man4/fsm.5.html
  *   max_len: the maxium length to compute DFA::buildTable
  */
-DFA::DFA(const std::string dfa_str, const uint32_t max_len)
+DFA::DFA(const std::string dfa_str, const uint32_t max_len,
+         const std::string table_path)
     : _fixed_slice(max_len),
       _start_state(0),
       _num_states(0),
-      _num_symbols(0)
+      _num_symbols(0),
+      _table_map(NULL),
+      _table_map_len(0)
 {
+    memset(&_stats, 0, sizeof(_stats));
+    uint64_t start = now_ns();
+
     // construct the _start_state, _final_states and symbols/states of our DFA
     bool startStateIsntSet = true;
     std::string line;
@@ -199,8 +272,83 @@ DFA::DFA(const std::string dfa_str, const uint32_t max_len)
 
     DFA::_validate();
 
+    // map a table that another process has built, if there is one
+    if (!table_path.empty() && DFA::_mapTable( table_path )) {
+        _stats.build_ns = now_ns() - start;
+        return;
+    }
+
     // perform our precalculation to speed up (un)ranking
+    uint64_t build_table_start = now_ns();
     DFA::_buildTable();
+    _stats.build_table_ns = now_ns() - build_table_start;
+    DFA::_viewTable();
+
+    // share our table, and release our private copy of it
+    if (!table_path.empty()
+            && DFA::_writeTable( table_path )
+            && DFA::_mapTable( table_path )) {
+        array_type_mpz_t2().swap(_T);
+#ifdef __GLIBC__
+        malloc_trim(0);
+#endif
+    }
+
+    _stats.build_ns = now_ns() - start;
+}
+
+DFA::~DFA() {
+#ifndef _WIN32
+    if (_table_map != NULL)
+        munmap(_table_map, _table_map_len);
+#endif
+}
+
+bool DFA::isTableShared() {
+    return _table_map != NULL;
+}
+
+size_t DFA::getTableSize() {
+    size_t retval = _T_view.capacity() * sizeof(__mpz_struct);
+    if (_table_map != NULL)
+        return retval + _table_map_len;
+
+    for (uint32_t q=0; q<_T.size(); q++) {
+        retval += _T.at(q).capacity() * sizeof(mpz_class);
+        for (uint32_t i=0; i<_T.at(q).size(); i++)
+            retval += _T.at(q).at(i).get_mpz_t()->_mp_alloc * sizeof(mp_limb_t);
+    }
+    return retval;
+}
+
+uint32_t DFA::getNumStates() {
+    return _num_states;
+}
+
+uint32_t DFA::getNumSymbols() {
+    return _num_symbols;
+}
+
+DFAStats DFA::getStats() {
+    DFAStats retval;
+    retval.rank_calls = STATS_LOAD(_stats.rank_calls);
+    retval.rank_ns = STATS_LOAD(_stats.rank_ns);
+    retval.unrank_calls = STATS_LOAD(_stats.unrank_calls);
+    retval.unrank_ns = STATS_LOAD(_stats.unrank_ns);
+    retval.dense_steps = STATS_LOAD(_stats.dense_steps);
+    retval.goldberg_sipser_steps = STATS_LOAD(_stats.goldberg_sipser_steps);
+    retval.build_ns = _stats.build_ns;
+    retval.build_table_ns = _stats.build_table_ns;
+    return retval;
+}
+
+void DFA::resetStats() {
+    STATS_STORE(_stats.rank_calls, 0);
+    STATS_STORE(_stats.rank_ns, 0);
+    STATS_STORE(_stats.unrank_calls, 0);
+    STATS_STORE(_stats.unrank_ns, 0);
+    STATS_STORE(_stats.dense_steps, 0);
+    STATS_STORE(_stats.goldberg_sipser_steps, 0);
 }
 
 
@@ -265,12 +413,146 @@ void DFA::_buildTable() {
 }
 
 
+void DFA::_viewTable() {
+    _T_view.resize(_num_states * (_fixed_slice + 1));
+    for (uint32_t q=0; q<_num_states; q++) {
+        for (uint32_t i=0; i<=_fixed_slice; i++) {
+            // a shallow copy, that shares the limbs of _T.at(q).at(i)
+            _T_view.at(q * (_fixed_slice + 1) + i) = *(_T.at(q).at(i).get_mpz_t());
+        }
+    }
+}
+
+// mpz_roinit_n and mpz_limbs_read require GMP 6
+#if !defined(_WIN32) && __GNU_MP_VERSION >= 6
+
+bool DFA::_mapTable( const std::string table_path ) {
+    int fd = open(table_path.c_str(), O_RDONLY);
+    if (fd < 0)
+        return false;
+
+    struct stat st;
+    void *map = MAP_FAILED;
+    if (fstat(fd, &st) == 0 && st.st_size >= (off_t)sizeof(table_header))
+        map = mmap(NULL, st.st_size, PROT_READ, MAP_SHARED, fd, 0);
+    close(fd);
+    if (map == MAP_FAILED)
+        return false;
+    size_t map_len = st.st_size;
+
+    // verify the table matches our DFA, and that every entry is in range
+    uint64_t num_entries = (uint64_t)_num_states * (_fixed_slice + 1);
+    const table_header *header = (const table_header *)map;
+    const table_entry *entries = (const table_entry *)(header + 1);
+    const mp_limb_t *limbs = (const mp_limb_t *)(entries + num_entries);
+    bool valid = memcmp(header->magic, TABLE_MAGIC, sizeof(TABLE_MAGIC)) == 0
+                 && header->limb_bytes == sizeof(mp_limb_t)
+                 && header->num_states == _num_states
+                 && header->fixed_slice == _fixed_slice
+                 && num_entries <= map_len / sizeof(table_entry)
+                 && header->num_limbs <= map_len / sizeof(mp_limb_t)
+                 && map_len == sizeof(table_header)
+                               + num_entries * sizeof(table_entry)
+                               + header->num_limbs * sizeof(mp_limb_t);
+
+    std::vector<__mpz_struct> view;
+    if (valid) {
+        view.resize(num_entries);
+        for (uint64_t k=0; k<num_entries; k++) {
+            if (entries[k].offset > header->num_limbs
+                    || entries[k].size > header->num_limbs - entries[k].offset) {
+                valid = false;
+                break;
+            }
+            mpz_roinit_n(&view.at(k), limbs + entries[k].offset,
+                         entries[k].size);
+        }
+    }
+
+    if (!valid) {
+        munmap(map, map_len);
+        return false;
+    }
+
+    if (_table_map != NULL)
+        munmap(_table_map, _table_map_len);
+    _table_map = map;
+    _table_map_len = map_len;
+    _T_view.swap(view);
+
+    return true;
+}
+
+bool DFA::_writeTable( const std::string table_path ) {
+    table_header header;
+    memset(&header, 0, sizeof(header));
+    memcpy(header.magic, TABLE_MAGIC, sizeof(TABLE_MAGIC));
+    header.limb_bytes = sizeof(mp_limb_t);
+    header.num_states = _num_states;
+    header.fixed_slice = _fixed_slice;
+
+    std::vector<table_entry> entries(_T_view.size());
+    for (uint64_t k=0; k<_T_view.size(); k++) {
+        entries.at(k).size = mpz_size(&_T_view.at(k));
+        entries.at(k).offset = header.num_limbs;
+        header.num_limbs += entries.at(k).size;
+    }
+
+    // write to a file of our own, then rename it into place, such that
+    // processes never map a partially written table
+    char pid[32];
+    snprintf(pid, sizeof(pid), ".%d", (int)getpid());
+    const std::string tmp_path = table_path + pid;
+
+    FILE *f = fopen(tmp_path.c_str(), "wb");
+    if (f == NULL)
+        return false;
+    bool ok = fwrite(&header, sizeof(header), 1, f) == 1;
+    if (ok && !entries.empty())
+        ok = fwrite(&entries.at(0), sizeof(table_entry), entries.size(), f)
+             == entries.size();
+    for (uint64_t k=0; ok && k<_T_view.size(); k++) {
+        if (entries.at(k).size > 0)
+            ok = fwrite(mpz_limbs_read(&_T_view.at(k)), sizeof(mp_limb_t),
+                        entries.at(k).size, f) == entries.at(k).size;
+    }
+    ok = (fclose(f) == 0) && ok;
+    ok = ok && rename(tmp_path.c_str(), table_path.c_str()) == 0;
+    if (!ok)
+        unlink(tmp_path.c_str());
+
+    return ok;
+}
+
+#else
+
+bool DFA::_mapTable( const std::string table_path ) {
+    return false;
+}
+
+bool DFA::_writeTable( const std::string table_path ) {
+    return false;
+}
+
+#endif
+
+
 std::string DFA::unrank( const mpz_class c_in ) {
+    return DFA::unrank( c_in, _fixed_slice );
+}
+
+std::string DFA::unrank( const mpz_class c_in, const uint32_t n ) {
     std::string retval;
+    uint64_t start = now_ns();
+    uint64_t dense_steps = 0;
+
+    // throw exception if n is greater than the length of our pre-computed table
+    if ( n > _fixed_slice )
+        throw invalid_unrank_input;
 
     // throw exception if input integer is not in range of pre-computed value
-    mpz_class words_in_slice = getNumWordsInLanguage( _fixed_slice, _fixed_slice );
-    if ( c_in > words_in_slice )
+    mpz_class words_in_slice = getNumWordsInLanguage( n, n );
+    if ( c_in >= words_in_slice )
         throw invalid_unrank_input;
 
     // walk the DFA subtracting values from c until we have our n symbols
@@ -280,21 +562,22 @@ std::string DFA::unrank( const mpz_class c_in ) {
     uint32_t char_cursor = 0;
     uint32_t state = 0;
     mpz_class char_index = 0;
-    for (i=1; i<=_fixed_slice; i++) {
+    for (i=1; i<=n; i++) {
         if (_delta_dense.at(q)) {
             // our optimized version, when _delta[q][i] is equal to n for all symbols i
             state = _delta.at(q).at(0);
             
             // We do the following two lines with a single call
             // to mpz_fdiv_qr, which is much faster.
-            // char_index = (c / _T.at(state).at(_fixed_slice-i));
-            // c = c % _T.at(state).at(_fixed_slice-i);
+            // char_index = (c / _T.at(state).at(n-i));
+            // c = c % _T.at(state).at(n-i);
             mpz_fdiv_qr( char_index.get_mpz_t(),
                          c.get_mpz_t(),
                          c.get_mpz_t(),
-                         _T.at(state).at(_fixed_slice-i).get_mpz_t() );
+                         _t(state, n-i) );
             
             char_cursor = char_index.get_ui();
+            dense_steps++;
         } else {
             // traditional goldberg-sipser ranking
             char_cursor = 0;
@@ -303,13 +586,13 @@ std::string DFA::unrank( const mpz_class c_in ) {
             // A call to mpz_cmp is faster than using >= directly.
             // while (c >= _T.at(state).at(n-i)) {
             while (mpz_cmp( c.get_mpz_t(),
-                            _T.at(state).at(_fixed_slice-i).get_mpz_t() )>=0) {
+                            _t(state, n-i) )>=0) {
                 
                 // Much faster to call mpz_sub, than -=.
                 // c -= _T.at(state).at(n-i);
                 mpz_sub( c.get_mpz_t(),
                          c.get_mpz_t(),
-                         _T.at(state).at(_fixed_slice-i).get_mpz_t() );
+                         _t(state, n-i) );
                 
                 char_cursor += 1;
                 state =_delta.at(q).at(char_cursor);
@@ -325,14 +608,21 @@ std::string DFA::unrank( const mpz_class c_in ) {
         throw invalid_input_exception_not_in_final_states;
     }
 
+    STATS_ADD(_stats.dense_steps, dense_steps);
+    STATS_ADD(_stats.goldberg_sipser_steps, n - dense_steps);
+    STATS_ADD(_stats.unrank_calls, 1);
+    STATS_ADD(_stats.unrank_ns, now_ns() - start);
+
     return retval;
 }
 
 mpz_class DFA::rank( const std::string X ) {
     mpz_class retval = 0;
+    uint64_t start = now_ns();
+    uint64_t dense_steps = 0;
 
     // verify len(X) is what we expect
-    if (X.length()!=_fixed_slice) {
+    if (X.length()>_fixed_slice) {
         throw invalid_rank_input;
     }
 
@@ -359,7 +649,7 @@ mpz_class DFA::rank( const std::string X ) {
             // compared to *.
             // tmp = _T.at(state).at(n-i) * symbol_as_int
             mpz_mul_ui( tmp.get_mpz_t(),
-                        _T.at(state).at(n-i).get_mpz_t(),
+                        _t(state, n-i),
                         symbol_as_int );
             
             // mpz_add is faster than +=
@@ -367,6 +657,7 @@ mpz_class DFA::rank( const std::string X ) {
             mpz_add( retval.get_mpz_t(),
                      retval.get_mpz_t(),
                      tmp.get_mpz_t() );
+            dense_steps++;
         } else {
             // traditional goldberg-sipser ranking
             for (j=1; j<=symbol_as_int; j++) {
@@ -376,7 +667,7 @@ mpz_class DFA::rank( const std::string X ) {
                 //retval += _T.at(state).at(n-i);
                 mpz_add( retval.get_mpz_t(),
                          retval.get_mpz_t(),
-                         _T.at(state).at(n-i).get_mpz_t() );
+                         _t(state, n-i) );
             }
         }
         q = _delta.at(q).at(symbol_as_int);
@@ -388,9 +679,34 @@ mpz_class DFA::rank( const std::string X ) {
         throw invalid_input_exception_not_in_final_states;
     }
 
+    STATS_ADD(_stats.dense_steps, dense_steps);
+    STATS_ADD(_stats.goldberg_sipser_steps, n - dense_steps);
+    STATS_ADD(_stats.rank_calls, 1);
+    STATS_ADD(_stats.rank_ns, now_ns() - start);
+
     return retval;
 }
 
+bool DFA::isPrefix( const std::string X ) {
+    if (X.length()>_fixed_slice) {
+        return false;
+    }
+
+    // walk the DFA, bailing on the first symbol not in our alphabet
+    uint32_t q = _start_state;
+    std::map<char, uint32_t>::const_iterator symbol;
+    for (uint32_t i=0; i<X.length(); i++) {
+        symbol = _sigma_reverse.find(X[i]);
+        if (symbol==_sigma_reverse.end()) {
+            return false;
+        }
+        q = _delta[q][symbol->second];
+    }
+
+    // there must be a path of the remaining length from q to a final state
+    return mpz_sgn(_t(q, _fixed_slice - X.length())) > 0;
+}
+
 mpz_class DFA::getNumWordsInLanguage( const uint32_t min_word_length,
                                       const uint32_t max_word_length )
 {
@@ -405,7 +721,9 @@ mpz_class DFA::getNumWordsInLanguage( const uint32_t min_word_length,
     for (uint32_t word_length = min_word_length;
             word_length <= max_word_length;
             word_length++) {
-        num_words += _T.at(_start_state).at(word_length);
+        mpz_add( num_words.get_mpz_t(),
+                 num_words.get_mpz_t(),
+                 _t(_start_state, word_length) );
     }
     return num_words;
 }
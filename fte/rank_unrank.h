@@ -31,6 +31,7 @@
 #define _RANK_UNRANK_H
 
 #include <map>
+#include <string>
 #include <vector>
 
 #include <stdint.h>
@@ -43,6 +44,27 @@ typedef std::vector< std::vector<uint32_t> > array_type_uint32_t2;
 typedef std::vector< std::vector<mpz_class> > array_type_mpz_t2;
 typedef std::vector< std::string > array_type_string_t1;
 
+// The work a DFA has done. Each counter is updated with a relaxed atomic
+// add, such that threads that share a DFA may rank and unrank concurrently.
+struct DFAStats {
+    // successful calls to rank and unrank, and the nanoseconds they took
+    uint64_t rank_calls;
+    uint64_t rank_ns;
+    uint64_t unrank_calls;
+    uint64_t unrank_ns;
+
+    // the symbols ranked or unranked from a state whose transitions all go
+    // to the same state, which takes a single multiplication or division,
+    // and those that walk the transitions, as Goldberg and Sipser do
+    uint64_t dense_steps;
+    uint64_t goldberg_sipser_steps;
+
+    // the nanoseconds our constructor took, and the part of it spent in
+    // _buildTable, which is 0 if we mapped our table from a file
+    uint64_t build_ns;
+    uint64_t build_table_ns;
+};
+
 class DFA {
 
 private:
@@ -96,18 +118,76 @@ private:
     // accepting paths of length exactly i from state q.
     array_type_mpz_t2 _T;
 
+    // _T_view is a read-only view of _T, indexed by q*(_fixed_slice+1)+i, that
+    // rank and unrank use. Its limbs are either those of _T, or those of a
+    // table file that we have mapped into memory.
+    std::vector<__mpz_struct> _T_view;
+
+    // our mapping of a table file, if any
+    void *_table_map;
+    size_t _table_map_len;
+
+    // Point _T_view at the limbs of _T.
+    void _viewTable();
+
+    // Map the table file at the input path, and point _T_view at its limbs.
+    // Returns false if the file doesn't exist or doesn't match our DFA.
+    bool _mapTable( const std::string );
+
+    // Write _T to a table file at the input path. Returns false on failure.
+    bool _writeTable( const std::string );
+
+    // Returns _T[q][i].
+    inline mpz_srcptr _t( const uint32_t q, const uint32_t i ) const {
+        return &_T_view[q * (_fixed_slice + 1) + i];
+    }
+
+    // see getStats
+    DFAStats _stats;
+
 public:
-    // The constructor of our rank/urank DFA class
-    DFA( const std::string, const uint32_t );
+    // The constructor of our rank/urank DFA class. If a table path is given
+    // our table is mapped from that file, which is written first if it
+    // doesn't exist, such that processes with the same DFA share it.
+    DFA( const std::string, const uint32_t, const std::string = "" );
+
+    ~DFA();
+
+    // returns true if our table is mapped from a table file
+    bool isTableShared();
+
+    // returns the number of bytes our table occupies: its entries, and
+    // either the limbs we allocated for it or the table file we mapped
+    size_t getTableSize();
+
+    // returns the number of states, including our dead state, and symbols
+    // of our DFA
+    uint32_t getNumStates();
+    uint32_t getNumSymbols();
+
+    // returns a snapshot of the work we've done
+    DFAStats getStats();
+
+    // zeroes the counters of calls to rank and unrank, and their steps,
+    // but not our build times
+    void resetStats();
 
     // our unrank function an int -> str mapping
     // given an integer i, return the ith lexicographically ordered string in
     // the language accepted by the DFA
     std::string unrank( const mpz_class );
 
-    // our rank function performs the inverse operation of unrank
+    // as above, but for strings of length n, where n <= _fixed_slice
+    std::string unrank( const mpz_class, const uint32_t );
+
+    // our rank function performs the inverse operation of unrank,
+    // the input string may be of any length up to _fixed_slice
     mpz_class rank( const std::string );
 
+    // returns true if the input string is a prefix of at least one word of
+    // length _fixed_slice accepted by the DFA, without ranking it
+    bool isPrefix( const std::string );
+
     // given integers [n,m] returns the number of words accepted by the
     // DFA that are at least length n and no greater than length m
     mpz_class getNumWordsInLanguage( const uint32_t, const uint32_t );
@@ -117,4 +197,8 @@ public:
 // returns a (non-minimized) ATT FST formatted DFA
 std::string attFstFromRegex( const std::string );
 
+// Returns a timestamp, in nanoseconds, from a monotonic clock where there
+// is one.
+uint64_t now_ns();
+
 #endif /* _RANK_UNRANK_H */
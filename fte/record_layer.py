@@ -17,25 +17,107 @@
 # along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import string
+
 import fte.conf
+import fte.bit_ops
+import fte.metrics
+import fte.trace
 
 
 MAX_CELL_SIZE = fte.conf.getValue('runtime.fte.record_layer.max_cell_size')
 
+"""Cells carry a length header in the unranked region, ahead of the ciphertext."""
+FRAMING_V1 = 1
+
+"""Cells carry only the authenticated length header of the ciphertext."""
+FRAMING_V2 = 2
+
+SUPPORTED_FRAMINGS = [FRAMING_V1, FRAMING_V2]
+
+"""Cells popped together form a run, every cell but the last carries a digit
+in the fractional capacity of its slice. These digits carry bytes trimmed
+from the end of the last cell. Requires FRAMING_V2."""
+OPTION_FRACTIONAL_PACKING = 0x01
+
+"""Cells whose ciphertext fits use the shortest slice in the encoder's ladder.
+The slice is a function of the ciphertext length, the decoder recovers it
+by finding the slice whose ciphertext header maps back to that slice.
+Requires FRAMING_V2."""
+OPTION_VARIABLE_SLICE = 0x02
+
+"""The plaintext of the connection is a sequence of fte.mux frames, which
+carry many streams, rather than a single stream. Cells are unchanged, only
+servers that ask for it in fte.wrap_socket accept this option."""
+OPTION_MUX = 0x04
+
+SUPPORTED_OPTIONS = OPTION_FRACTIONAL_PACKING | OPTION_VARIABLE_SLICE | \
+    OPTION_MUX
+
+
+class InvalidFramingException(Exception):
+    pass
+
+
+def _validateFraming(framing, options):
+    if framing not in SUPPORTED_FRAMINGS:
+        raise InvalidFramingException(framing)
+    if options & ~SUPPORTED_OPTIONS:
+        raise InvalidFramingException(options)
+    if options & OPTION_FRACTIONAL_PACKING and framing != FRAMING_V2:
+        raise InvalidFramingException(
+            'Fractional packing requires FRAMING_V2.')
+    if options & OPTION_VARIABLE_SLICE and framing != FRAMING_V2:
+        raise InvalidFramingException(
+            'Variable slices require FRAMING_V2.')
+
+
+def _getSlice(encoder, ciphertext_len, digit):
+    """Returns the slice used by a variable-slice cell. Cells that carry a
+    digit keep the full slice, such that the decoder knows their radix.
+    """
+
+    if digit > 0:
+        return encoder.getSlices()[-1]
+    return encoder.getShortestSlice(ciphertext_len)
+
+
+def _getCarriedBytes(radix, num_digits):
+    """Returns the number of bytes that ``num_digits`` digits, each taking
+    one of ``radix - 1`` values, can carry.
+    """
+
+    if radix <= 2 or num_digits <= 0:
+        return 0
+    return (((radix - 1) ** num_digits).bit_length() - 1) // 8
+
+
 class Encoder:
 
     def __init__(
         self,
         encrypter,
         encoder,
+        framing=FRAMING_V1,
+        options=0,
     ):
+        _validateFraming(framing, options)
+
         self._encrypter = encrypter
         self._encoder = encoder
+        self._framing = framing
+        self._options = options
         self._buffer = ''
+        # with fte.trace, when the buffer was last empty, and the traces of
+        # the cells we last popped, until whoever writes them takes them
+        self._pushed_at = None
+        self._traces = []
 
     def push(self, data):
         """Push data onto the FIFO buffer."""
 
+        if fte.trace.enabled and not self._buffer:
+            self._pushed_at = fte.trace.now()
         self._buffer += data
 
     def pop(self):
@@ -46,22 +128,140 @@ class Encoder:
         """
         retval = ''
 
+        # one fte.trace.CellTrace per cell, or None if it isn't traced
+        traces = None
+        if fte.trace.enabled and self._buffer:
+            traces = []
+            pop_start = fte.trace.now()
+            if self._traces:
+                # no one took the traces of our last cells
+                fte.trace.write(self.popTraces())
+
+        plaintext_len = len(self._buffer)
         ciphertexts = []
         while len(self._buffer)>0:
             plaintext = self._buffer[:MAX_CELL_SIZE]
             self._buffer = self._buffer[MAX_CELL_SIZE:]
+            if traces is not None:
+                traces.append(self._startTrace(plaintext, pop_start))
+            start = traces and traces[-1] and fte.trace.now()
             ciphertext = self._encrypter.encrypt(plaintext)
+            if start:
+                traces[-1].add('encrypt', start, fte.trace.now())
             ciphertexts.append(ciphertext)
         
+        ciphertext_lens = [len(ciphertext) for ciphertext in ciphertexts]
+        digits = [0] * len(ciphertexts)
+        if self._options & OPTION_FRACTIONAL_PACKING and len(ciphertexts) > 1:
+            [ciphertexts[-1], digits] = self._packFractional(ciphertexts)
+
         covertexts = []
-        for ciphertext in ciphertexts:
-            covertext = self._encoder.encode(ciphertext)
+        fixed_slices = []
+        for i, [ciphertext, ciphertext_len, digit] in enumerate(
+                zip(ciphertexts, ciphertext_lens, digits)):
+            start = traces and traces[i] and fte.trace.now()
+            if self._framing == FRAMING_V1:
+                covertext = self._encoder.encode(ciphertext)
+            else:
+                fixed_slice = None
+                if self._options & OPTION_VARIABLE_SLICE:
+                    fixed_slice = _getSlice(
+                        self._encoder, ciphertext_len, digit)
+                covertext = self._encoder.encodeUnframed(
+                    ciphertext, digit, fixed_slice)
+                fixed_slices.append(fixed_slice)
+            if start:
+                traces[i].add('unrank', start, fte.trace.now())
             covertexts.append(covertext)
         
         retval = ''.join(covertexts)
 
+        if traces:
+            self._pushed_at = None
+            self._traces = [trace for trace in traces if trace is not None]
+
+        if fte.metrics.enabled and covertexts:
+            self._recordMetrics(plaintext_len, ciphertexts, fixed_slices,
+                                len(retval))
+
         return retval
 
+    def popTraces(self):
+        """Returns the ``fte.trace.CellTrace`` of each traced cell of our last
+        ``pop``, to which the caller adds the ``write`` stage, and forgets
+        them. If the caller doesn't take them, our next ``pop`` writes them.
+        """
+
+        retval = self._traces
+        self._traces = []
+        return retval
+
+    def _startTrace(self, plaintext, pop_start):
+        """Returns a trace of the cell of ``plaintext``, sampled at
+        ``runtime.fte.trace.rate``, or ``None``.
+        """
+
+        if not fte.trace.sample():
+            return None
+        retval = fte.trace.CellTrace('encode', self._encoder.getFormatName(),
+                                     len(plaintext))
+        if self._pushed_at is not None:
+            retval.add('queue', self._pushed_at, pop_start)
+        return retval
+
+    def _recordMetrics(self, plaintext_len, ciphertexts, fixed_slices,
+                       covertext_len):
+        """Records the cells we just popped with ``fte.metrics``. The
+        capacity of a cell is the ciphertext its unranked slice can carry,
+        its utilization is how much of that our ciphertext filled.
+        """
+
+        capacity = 0
+        used = 0
+        for i, ciphertext in enumerate(ciphertexts):
+            if self._framing == FRAMING_V1:
+                cell_capacity = self._encoder.getMaximumBytesToRank() - \
+                    fte.encoder.RegexEncoderObject._COVERTEXT_HEADER_LEN_CIPHERTTEXT
+            else:
+                cell_capacity = self._encoder.getMaximumBytesToRank(
+                    fixed_slices[i])
+            capacity += cell_capacity
+            used += min(len(ciphertext), cell_capacity)
+
+        fte.metrics.incrementAll(self._encoder.getMetricsLabels('encode'), [
+            ['fte_cells_total', len(ciphertexts)],
+            ['fte_plaintext_bytes_total', plaintext_len],
+            ['fte_covertext_bytes_total', covertext_len],
+            ['fte_capacity_bytes_total', capacity],
+            ['fte_capacity_used_bytes_total', used],
+        ])
+
+    def _packFractional(self, ciphertexts):
+        """Moves bytes from the end of the last ciphertext in a run into the
+        digits of the other cells. Returns the trimmed last ciphertext and a
+        digit for each cell: in ``[1, radix)`` for all but the last cell, and
+        ``0`` for the last cell, which terminates the run.
+        """
+
+        radix = self._encoder.getRadix()
+        num_digits = len(ciphertexts) - 1
+        last = ciphertexts[-1]
+        tail_len = max(0, len(last) - self._encoder.getMaximumBytesToRank())
+        carried_len = min(_getCarriedBytes(radix, num_digits), tail_len)
+
+        value = 0
+        if carried_len > 0:
+            value = fte.bit_ops.bytes_to_long(last[-carried_len:])
+            last = last[:-carried_len]
+
+        digits = []
+        for i in range(num_digits):
+            digits.append(value % (radix - 1) + 1)
+            value //= (radix - 1)
+        digits.append(0)
+
+        return [last, digits]
+
 
 class Decoder:
 
@@ -69,14 +269,25 @@ class Decoder:
         self,
         decrypter,
         decoder,
+        framing=FRAMING_V1,
+        options=0,
     ):
+        _validateFraming(framing, options)
+
         self._decrypter = decrypter
         self._decoder = decoder
+        self._framing = framing
+        self._options = options
+        self._digits = []
         self._buffer = ''
+        # with fte.trace, when the buffer was last empty
+        self._pushed_at = None
 
     def push(self, data):
         """Push data onto the FIFO buffer."""
 
+        if fte.trace.enabled and not self._buffer:
+            self._pushed_at = fte.trace.now()
         self._buffer += data
 
     def pop(self, oneCell=False):
@@ -86,14 +297,42 @@ class Decoder:
         """
 
         retval = ''
+        cells = 0
+        buffer_len = len(self._buffer)
+        tracing = fte.trace.enabled
+        traces = []
+        start = None
         
         while len(self._buffer)>0:
             try:
-                incoming_msg = self._decoder.decode(self._buffer)
-                to_take = self._decrypter.getCiphertextLen(incoming_msg)
+                digit = 0
+                start = tracing and fte.trace.now()
+                if self._framing == FRAMING_V1:
+                    incoming_msg = self._decoder.decode(self._buffer)
+                    to_take = self._decrypter.getCiphertextLen(incoming_msg)
+                else:
+                    # the ciphertext header is our only length header,
+                    # it's at the start of the unrank payload
+                    [unrank_payload, body, digit, to_take] = \
+                        self._decodeUnframed()
+                    if self._options & OPTION_FRACTIONAL_PACKING and digit == 0:
+                        body = self._unpackFractional(
+                            unrank_payload, body, to_take)
+                    incoming_msg = unrank_payload[:to_take] + body
                 ciphertext = incoming_msg[:to_take]
-                retval += self._decrypter.decrypt(ciphertext)
+                decrypt_start = tracing and fte.trace.now()
+                plaintext = self._decrypter.decrypt(ciphertext)
+                if tracing and fte.trace.sample():
+                    traces.append(self._makeTrace(
+                        plaintext, start, decrypt_start))
+                retval += plaintext
                 self._buffer = incoming_msg[to_take:]
+                cells += 1
+                if self._options & OPTION_FRACTIONAL_PACKING:
+                    if digit > 0:
+                        self._digits.append(digit - 1)
+                    else:
+                        self._digits = []
             except fte.encoder.DecodeFailureError:
                 break
             except fte.encrypter.RecoverableDecryptionError:
@@ -105,4 +344,94 @@ class Decoder:
             finally:
                 if oneCell: break
 
+        if tracing:
+            if traces:
+                fte.trace.write(traces)
+            # we don't know when what's left arrived, it has queued at
+            # least since our last cell
+            self._pushed_at = start if self._buffer else None
+
+        if fte.metrics.enabled and cells:
+            fte.metrics.incrementAll(self._decoder.getMetricsLabels('decode'), [
+                ['fte_cells_total', cells],
+                ['fte_plaintext_bytes_total', len(retval)],
+                ['fte_covertext_bytes_total', buffer_len - len(self._buffer)],
+            ])
+
         return retval
+
+    def _makeTrace(self, plaintext, start, decrypt_start):
+        """Returns the trace of a cell we just decoded, we began ranking it
+        at ``start`` and decrypting it at ``decrypt_start``.
+        """
+
+        retval = fte.trace.CellTrace('decode', self._decoder.getFormatName(),
+                                     len(plaintext))
+        if self._pushed_at is not None:
+            retval.add('queue', self._pushed_at, start)
+        retval.add('rank', start, decrypt_start)
+        retval.add('decrypt', decrypt_start, fte.trace.now())
+        return retval
+
+    def _decodeUnframed(self):
+        """Decodes the unranked region of the cell at the head of the buffer,
+        returns ``[unrank_payload, body, digit, ciphertext_len]``. With
+        variable slices, slices in the ladder are tried in ascending order,
+        until one yields a valid ciphertext header whose length maps back to
+        that slice. Checking the header alone isn't enough, for languages
+        where a short slice ranks to a prefix of a longer one. In those
+        languages the header names the right slice, so we try it next.
+        """
+
+        slices = self._decoder.getSlices()
+        if not self._options & OPTION_VARIABLE_SLICE:
+            slices = slices[-1:]
+
+        candidates = list(slices)
+        while candidates:
+            fixed_slice = candidates.pop(0)
+            try:
+                [unrank_payload, body, digit] = \
+                    self._decoder.decodeUnframed(self._buffer, fixed_slice)
+                to_take = self._decrypter.getCiphertextLen(unrank_payload)
+                if len(slices) == 1:
+                    return [unrank_payload, body, digit, to_take]
+                expected_slice = _getSlice(self._decoder, to_take, digit)
+                if expected_slice == fixed_slice:
+                    return [unrank_payload, body, digit, to_take]
+                if expected_slice in candidates:
+                    candidates.remove(expected_slice)
+                    candidates.insert(0, expected_slice)
+            except fte.encoder.DecodeFailureError:
+                # wait for the rest of the slice, before trying longer ones
+                if len(self._buffer) < fixed_slice:
+                    raise
+            except fte.encrypter.UnrecoverableDecryptionError:
+                if not candidates:
+                    raise
+
+        raise fte.encoder.DecodeFailureError('No slice could be decoded.')
+
+    def _unpackFractional(self, unrank_payload, body, to_take):
+        """Given the last cell of a run, reinserts the bytes carried by the
+        digits of the preceding cells at the end of its ciphertext.
+        """
+
+        radix = self._decoder.getRadix()
+        tail_len = max(0, to_take - len(unrank_payload))
+        carried_len = min(_getCarriedBytes(radix, len(self._digits)), tail_len)
+        if carried_len == 0:
+            return body
+
+        if len(body) < tail_len - carried_len:
+            raise fte.encrypter.RecoverableDecryptionError(
+                'Incomplete ciphertext.')
+
+        value = 0
+        for digit in reversed(self._digits):
+            value = value * (radix - 1) + digit
+        carried = fte.bit_ops.long_to_bytes(value)
+        carried = string.rjust(carried, carried_len, '\x00')[-carried_len:]
+
+        return body[:tail_len - carried_len] + carried + \
+            body[tail_len - carried_len:]
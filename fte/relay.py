@@ -16,13 +16,177 @@
 # You should have received a copy of the GNU General Public License
 # along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
 
+import sys
+import time
+import Queue
+import errno
+import select
 import socket
 import threading
+import collections
 
+import fte
 import fte.conf
 import fte.encoder
+import fte.metrics
 import fte.network_io
 import fte.logger
+import fte.trace
+
+
+# the maximum number of bytes an event loop reads from a socket per wakeup
+_EVENTLOOP_BUFSIZE = 2 ** 16
+
+_WOULDBLOCK = frozenset([errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR])
+
+# the number of seconds an fte.relay._pool waits after a failed connect
+_POOL_RETRY_DELAY = 1.0
+
+# Python 2 doesn't export SO_REUSEPORT, and only Linux balances connections
+# across the sockets that share a port
+_SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT',
+                        15 if sys.platform.startswith('linux') else None)
+
+
+def reuse_port_supported():
+    """Returns ``True`` if several processes can accept connections on the
+    same port, with ``runtime.fte.relay.reuse_port``.
+    """
+
+    return sys.platform.startswith('linux') and _SO_REUSEPORT is not None
+
+
+def _connect(remote_ip, remote_port):
+    """Returns a blocking socket connected to ``remote_ip:remote_port``, or
+    raises ``socket.error`` if the connect fails or takes longer than
+    ``runtime.fte.relay.connect.timeout`` seconds.
+    """
+
+    sock = socket.create_connection(
+        (remote_ip, remote_port),
+        fte.conf.getValue('runtime.fte.relay.connect.timeout'))
+    sock.settimeout(None)
+    return sock
+
+
+def _isIdle(sock):
+    """Returns ``False`` if the peer of ``sock`` has closed it."""
+
+    try:
+        if not select.select([sock], [], [], 0)[0]:
+            return True
+        # the peer may speak first, that data stays queued for the relay
+        return sock.recv(1, socket.MSG_PEEK) != ''
+    except (select.error, socket.error):
+        return False
+
+
+class _pool(threading.Thread):
+
+    """Keeps up to ``size`` idle sockets connected to
+    ``remote_ip:remote_port``, topped up in the background, such that new
+    connections don't wait for a TCP handshake. Each socket is passed
+    through ``prepare`` as it enters the pool, such that an fteproxy
+    client has negotiated before the server gives up on it.
+    """
+
+    def __init__(self, remote_ip, remote_port, size, prepare=None):
+        threading.Thread.__init__(self)
+        self._remote_ip = remote_ip
+        self._remote_port = remote_port
+        self._size = size
+        self._prepare = prepare
+        self._running = True
+        self._idle = collections.deque()
+        self._cond = threading.Condition()
+
+    def get(self):
+        """Returns a connected socket, or ``None`` if the pool is empty."""
+
+        with self._cond:
+            while self._idle:
+                sock = self._idle.popleft()
+                self._cond.notify()
+                # the peer may speak first, peek at what it has sent rather
+                # than decode it
+                if _isIdle(getattr(sock, '_socket', sock)):
+                    return sock
+                fte.network_io.close_socket(sock)
+        return None
+
+    def getNumIdle(self):
+        """Returns the number of connected sockets in the pool."""
+
+        return len(self._idle)
+
+    def run(self):
+        try:
+            while True:
+                with self._cond:
+                    while self._running and len(self._idle) >= self._size:
+                        self._cond.wait()
+                    if not self._running:
+                        break
+
+                try:
+                    sock = _connect(self._remote_ip, self._remote_port)
+                    if self._prepare is not None:
+                        try:
+                            sock = self._prepare(sock)
+                        except:
+                            fte.network_io.close_socket(sock)
+                            raise
+                except Exception as e:
+                    fte.logger.error("fte.relay pool failed to connect to " +
+                                     str((self._remote_ip, self._remote_port)) +
+                                     ": " + repr(e))
+                    with self._cond:
+                        if self._running:
+                            self._cond.wait(_POOL_RETRY_DELAY)
+                    continue
+
+                with self._cond:
+                    if self._running:
+                        self._idle.append(sock)
+                        sock = None
+                if sock is not None:
+                    fte.network_io.close_socket(sock)
+        finally:
+            with self._cond:
+                while self._idle:
+                    fte.network_io.close_socket(self._idle.popleft())
+
+    def stop(self):
+        """Stop topping up the pool, and close its idle sockets."""
+
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+
+class _closer(object):
+
+    """Closes ``sockets`` once ``release`` has been called ``refs`` times.
+    Threads that share sockets close them with a ``_closer``, such that no
+    thread still uses a file descriptor once it is closed and reused. The
+    ``fte.metrics`` counter ``metric``, if any, is incremented once they are.
+    """
+
+    def __init__(self, sockets, refs, metric=None):
+        self._lock = threading.Lock()
+        self._sockets = sockets
+        self._refs = refs
+        self._metric = metric
+
+    def release(self):
+        with self._lock:
+            self._refs -= 1
+            if self._refs > 0:
+                return
+        for sock in self._sockets:
+            fte.network_io.close_socket(sock)
+        if self._metric is not None and fte.metrics.enabled:
+            fte.metrics.increment(self._metric)
 
 
 class worker(threading.Thread):
@@ -34,14 +198,15 @@ class worker(threading.Thread):
     method terminates when either ``socket1`` or ``socket2`` is detected to be closed.
     """
 
-    def __init__(self, socket1, socket2):
+    def __init__(self, socket1, socket2, closer=None):
         threading.Thread.__init__(self)
         self._socket1 = socket1
         self._socket2 = socket2
+        self._closer = closer
 
     def run(self):
         """It's the responsibility of run to forward data from ``socket1`` to
-        ``socket2`` and from ``socket2`` to ``socket1``. The ``run()`` met6od
+        ``socket2`` and from ``socket2`` to ``socket1``. The ``run()`` method
         terminates and closes both sockets if ``fte.network_io.recvall_from_socket``
         returns a negative results for ``success``.
         """
@@ -52,10 +217,382 @@ class worker(threading.Thread):
                     self._socket1)
                 if not success:
                     break
-                if _data:
-                    fte.network_io.sendall_to_socket(self._socket2, _data)
+                if _data and fte.metrics.enabled:
+                    fte.metrics.increment('fte_relay_bytes_total', (),
+                                          len(_data))
+                if _data and fte.network_io.sendall_to_socket(
+                        self._socket2, _data) < 0:
+                    break
         finally:
-            fte.network_io.close_socket(self._socket1)
+            # shutting down socket2 stops the worker relaying the other way,
+            # whichever of us finishes last closes both sockets
+            fte.network_io.shutdown_socket(self._socket1)
+            fte.network_io.shutdown_socket(self._socket2)
+            if self._closer is not None:
+                self._closer.release()
+            else:
+                fte.network_io.close_socket(self._socket1)
+
+
+class _poller(object):
+
+    """A thin wrapper around ``select.epoll``, or ``select.poll`` on platforms
+    without epoll.
+    """
+
+    def __init__(self):
+        if hasattr(select, 'epoll'):
+            self._poll = select.epoll()
+            self._timeout_scale = 1
+            self.READ = select.EPOLLIN
+            self.WRITE = select.EPOLLOUT
+            self.ERROR = select.EPOLLERR | select.EPOLLHUP
+        else:
+            self._poll = select.poll()
+            self._timeout_scale = 1000
+            self.READ = select.POLLIN
+            self.WRITE = select.POLLOUT
+            self.ERROR = select.POLLERR | select.POLLHUP | select.POLLNVAL
+
+    def register(self, fd, events):
+        self._poll.register(fd, events)
+
+    def modify(self, fd, events):
+        self._poll.modify(fd, events)
+
+    def unregister(self, fd):
+        self._poll.unregister(fd)
+
+    def poll(self, timeout=None):
+        """Returns a list of ``(fd, events)``, blocks until at least one
+        ``fd`` is ready if ``timeout`` is ``None``.
+        """
+
+        if timeout is None:
+            timeout = -1
+        else:
+            timeout *= self._timeout_scale
+
+        while True:
+            try:
+                return self._poll.poll(timeout)
+            except (IOError, select.error) as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+
+    def close(self):
+        if hasattr(self._poll, 'close'):
+            self._poll.close()
+
+
+def eventloop_supported():
+    """Returns ``True`` if this platform supports ``fte.relay.eventloop``."""
+
+    return hasattr(select, 'epoll') or hasattr(select, 'poll')
+
+
+class _endpoint(object):
+
+    """One side of a connection relayed by ``fte.relay.eventloop``. Sockets
+    wrapped with ``fte.wrap_socket`` are driven through their ``encode`` and
+    ``decode`` methods, we read and write the underlying socket directly.
+    """
+
+    def __init__(self, sock):
+        self.codec = None
+        if isinstance(sock, fte._FTESocketWrapper):
+            self.codec = sock
+            sock = sock._socket
+        self.socket = sock
+        self.fd = sock.fileno()
+        self.peer = None
+        self.events = 0
+        self.closing = False
+        self.write_queue = collections.deque()
+        # the number of bytes in write_queue
+        self.queued = 0
+        # true while we don't read, because our peer's queue is full
+        self.paused = False
+        # when a server that hasn't negotiated gives up on its client
+        self.deadline = None
+
+
+class eventloop(threading.Thread):
+
+    """``fte.relay.eventloop`` relays data between any number of pairs of
+    sockets, from a single thread. Sockets are non-blocking, readiness is
+    reported by ``epoll`` (or ``poll``), and data that can't be written
+    immediately is queued per socket. Once more than
+    ``runtime.fte.relay.high_watermark`` bytes are queued for a socket we
+    stop reading from its peer, until no more than
+    ``runtime.fte.relay.low_watermark`` bytes are queued. When either socket
+    of a pair is closed, the other is closed once its queue is flushed. Pairs
+    are handed to the loop with ``addConnection``, which is safe to call from
+    any thread. A pair is closed if a server endpoint among it hasn't
+    negotiated within ``runtime.fte.negotiate.timeout`` seconds, or its
+    client fails to.
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+
+        self._high_watermark = fte.conf.getValue(
+            'runtime.fte.relay.high_watermark')
+        self._low_watermark = fte.conf.getValue(
+            'runtime.fte.relay.low_watermark')
+        self._running = False
+        self._poller = _poller()
+        self._waker = fte.network_io.Waker()
+        self._pending = collections.deque()
+        self._endpoints = {}
+        # the endpoints that haven't negotiated yet
+        self._negotiating = set()
+
+    def addConnection(self, socket1, socket2):
+        """Relay all data from ``socket1`` to ``socket2``, and ``socket2`` to
+        ``socket1``.
+        """
+
+        self._pending.append((socket1, socket2))
+        self._waker.wake()
+
+    def getNumConnections(self):
+        """Returns the number of connection pairs relayed by this loop."""
+
+        return len(self._endpoints) // 2
+
+    def run(self):
+        self._poller.register(self._waker.fileno(), self._poller.READ)
+
+        self._running = True
+        try:
+            while self._running:
+                for fd, events in self._poller.poll(self._getTimeout()):
+                    if fd == self._waker.fileno():
+                        self._waker.drain()
+                        continue
+
+                    # the endpoint may have been closed earlier in this pass
+                    endpoint = self._endpoints.get(fd)
+                    if endpoint is not None and \
+                            events & (self._poller.READ | self._poller.ERROR):
+                        self._onReadable(endpoint)
+
+                    endpoint = self._endpoints.get(fd)
+                    if endpoint is not None and events & self._poller.WRITE:
+                        self._onWritable(endpoint)
+
+                self._addPending()
+                self._expireNegotiations()
+        finally:
+            for endpoint in self._endpoints.values():
+                fte.network_io.close_socket(endpoint.socket)
+            self._endpoints = {}
+            self._poller.close()
+            self._waker.close()
+
+    def stop(self):
+        """Stop relaying, and close all sockets relayed by this loop."""
+
+        self._running = False
+        self._waker.wake()
+
+    def _addPending(self):
+        while self._pending:
+            (socket1, socket2) = self._pending.popleft()
+            endpoint1 = _endpoint(socket1)
+            endpoint2 = _endpoint(socket2)
+            endpoint1.peer = endpoint2
+            endpoint2.peer = endpoint1
+
+            for endpoint in [endpoint1, endpoint2]:
+                endpoint.socket.setblocking(0)
+                endpoint.events = self._poller.READ
+                self._poller.register(endpoint.fd, endpoint.events)
+                self._endpoints[endpoint.fd] = endpoint
+                if endpoint.codec and endpoint.codec._isServer and \
+                        not endpoint.codec.isNegotiated():
+                    endpoint.deadline = time.time() + fte.conf.getValue(
+                        'runtime.fte.negotiate.timeout')
+                    self._negotiating.add(endpoint)
+
+            # clients send their negotiation cell before any data
+            for endpoint in [endpoint1, endpoint2]:
+                if endpoint.codec and self._isOpen(endpoint):
+                    self._write(endpoint, endpoint.codec.encode(''))
+
+            # servers may have decoded data before we took over the socket
+            for endpoint in [endpoint1, endpoint2]:
+                if endpoint.codec and endpoint.codec.pending():
+                    data = endpoint.codec._incoming_buffer
+                    endpoint.codec._incoming_buffer = ''
+                    if endpoint.peer.codec:
+                        data = endpoint.peer.codec.encode(data)
+                    self._write(endpoint.peer, data)
+
+    def _onReadable(self, endpoint):
+        data = ''
+        closed = False
+        try:
+            while len(data) < _EVENTLOOP_BUFSIZE:
+                chunk = endpoint.socket.recv(_EVENTLOOP_BUFSIZE)
+                if not chunk:
+                    closed = True
+                    break
+                data += chunk
+        except socket.error as e:
+            if e.args[0] not in _WOULDBLOCK:
+                closed = True
+
+        if data:
+            if endpoint.codec:
+                try:
+                    data = endpoint.codec.decode(data)
+                except fte.ChannelNotReadyException:
+                    data = ''
+                except fte.NegotiationFailedException:
+                    self._closePair(endpoint)
+                    return
+                # once a server has negotiated, flush what it has buffered
+                self._write(endpoint, endpoint.codec.encode(''))
+            peer = endpoint.peer
+            if data and fte.metrics.enabled:
+                fte.metrics.increment('fte_relay_bytes_total', (), len(data))
+            if data and peer.codec:
+                data = peer.codec.encode(data)
+            self._write(peer, data)
+
+        if closed:
+            self._close(endpoint)
+
+    def _getTimeout(self):
+        """Returns the seconds until the first negotiation deadline, or
+        ``None`` if no endpoint is negotiating."""
+
+        if not self._negotiating:
+            return None
+        deadline = min(endpoint.deadline for endpoint in self._negotiating)
+        return max(0, deadline - time.time())
+
+    def _expireNegotiations(self):
+        now = time.time()
+        for endpoint in list(self._negotiating):
+            if not self._isOpen(endpoint) or endpoint.codec.isNegotiated():
+                self._negotiating.discard(endpoint)
+            elif now >= endpoint.deadline:
+                endpoint.codec._negotiation_manager.recordOutcome('timeout')
+                fte.logger.error("fte.relay.eventloop closing a connection "
+                                 "that didn't negotiate in time")
+                self._closePair(endpoint)
+
+    def _onWritable(self, endpoint):
+        while endpoint.write_queue:
+            data = endpoint.write_queue[0]
+            try:
+                sent = endpoint.socket.send(data)
+            except socket.error as e:
+                if e.args[0] in _WOULDBLOCK:
+                    break
+                self._close(endpoint)
+                return
+            endpoint.queued -= sent
+            if sent < len(data):
+                endpoint.write_queue[0] = data[sent:]
+                break
+            endpoint.write_queue.popleft()
+
+        # our peer may read again, once we have caught up
+        peer = endpoint.peer
+        if peer.paused and endpoint.queued <= self._low_watermark:
+            peer.paused = False
+            if self._isOpen(peer):
+                self._updateEvents(peer)
+
+        if not endpoint.write_queue and endpoint.closing:
+            self._close(endpoint)
+        else:
+            self._updateEvents(endpoint)
+
+    def _write(self, endpoint, data):
+        if not data or not self._isOpen(endpoint):
+            return
+
+        # the write stage of traced cells ends once we've handed them to
+        # the socket, or queued them
+        start = endpoint.codec and fte.trace.enabled and fte.trace.now()
+        if endpoint.write_queue:
+            sent = 0
+        else:
+            try:
+                sent = endpoint.socket.send(data)
+            except socket.error as e:
+                if e.args[0] not in _WOULDBLOCK:
+                    self._close(endpoint)
+                    return
+                sent = 0
+        if start:
+            endpoint.codec.writeTraces(start)
+
+        if sent < len(data):
+            endpoint.write_queue.append(data[sent:])
+            endpoint.queued += len(data) - sent
+            # stop reading from our peer, until we have caught up
+            peer = endpoint.peer
+            if self._high_watermark is not None and not peer.paused and \
+                    endpoint.queued > self._high_watermark:
+                peer.paused = True
+                if self._isOpen(peer):
+                    self._updateEvents(peer)
+            self._updateEvents(endpoint)
+
+    def _updateEvents(self, endpoint):
+        """Wait for ``endpoint`` to be readable, unless it's closing or
+        paused, and writable while it has queued data.
+        """
+
+        events = 0
+        if not endpoint.closing and not endpoint.paused:
+            events |= self._poller.READ
+        if endpoint.write_queue:
+            events |= self._poller.WRITE
+        if endpoint.events != events:
+            endpoint.events = events
+            self._poller.modify(endpoint.fd, events)
+
+    def _close(self, endpoint):
+        """Close ``endpoint``, and its peer once the peer's write queue is
+        flushed.
+        """
+
+        self._unregister(endpoint)
+
+        peer = endpoint.peer
+        if not self._isOpen(peer):
+            return
+        if peer.write_queue and not peer.closing:
+            peer.closing = True
+            self._updateEvents(peer)
+        else:
+            self._unregister(peer)
+
+    def _closePair(self, endpoint):
+        """Close ``endpoint`` and its peer, without flushing either."""
+
+        self._negotiating.discard(endpoint)
+        self._unregister(endpoint)
+        self._unregister(endpoint.peer)
+
+    def _isOpen(self, endpoint):
+        # file descriptors are reused, so compare endpoints rather than fds
+        return self._endpoints.get(endpoint.fd) is endpoint
+
+    def _unregister(self, endpoint):
+        if self._isOpen(endpoint):
+            del self._endpoints[endpoint.fd]
+            self._poller.unregister(endpoint.fd)
+            if fte.metrics.enabled and not self._isOpen(endpoint.peer):
+                fte.metrics.increment('fte_relay_connections_closed_total')
+        fte.network_io.close_socket(endpoint.socket)
 
 
 class listener(threading.Thread):
@@ -67,64 +604,207 @@ class listener(threading.Thread):
     All new outgoing connections are wrapped with ``onNewOutgoingConnection``.
     By default the functions ``onNewIncomingConnection`` and
     ``onNewOutgoingConnection`` are the identity function.
+    Connections are relayed by a pair of ``fte.relay.worker`` threads, or by
+    ``fte.relay.eventloop`` threads if ``runtime.fte.relay.engine`` is
+    ``eventloop``.
+    Outgoing connections are established by up to
+    ``runtime.fte.relay.connect.threads`` connector threads, such that slow
+    connects don't delay accepts, and taken from a pool of
+    ``runtime.fte.relay.pool.size`` pre-connected sockets if there is one.
     """
 
     def __init__(self, local_ip, local_port,
                  remote_ip, remote_port):
         threading.Thread.__init__(self)
 
-        self._running = False
+        # set before we start, such that stop may be called at any time
+        self._running = True
         self._local_ip = local_ip
         self._local_port = local_port
         self._remote_ip = remote_ip
         self._remote_port = remote_port
+        self._eventloops = []
+        self._next_eventloop = 0
+        self._eventloops_lock = threading.Lock()
+        self._waker = fte.network_io.Waker()
+        self._accepted = Queue.Queue()
+        self._connectors = []
+        self._pool = None
 
-    def _instantiateSocket(self):
-        self._sock_lock = threading.RLock()
+    def _startEventLoops(self):
+        if fte.conf.getValue('runtime.fte.relay.engine') != 'eventloop':
+            return
+        if not eventloop_supported():
+            fte.logger.info("fte.relay.eventloop isn't supported on " +
+                               "this platform, relaying with threads")
+            return
+
+        for i in range(fte.conf.getValue('runtime.fte.relay.eventloop.threads')):
+            loop = eventloop()
+            loop.start()
+            self._eventloops.append(loop)
+
+    def _startConnectors(self):
+        for i in range(fte.conf.getValue('runtime.fte.relay.connect.threads')):
+            connector = threading.Thread(target=self._runConnector)
+            connector.daemon = True
+            connector.start()
+            self._connectors.append(connector)
+
+        pool_size = fte.conf.getValue('runtime.fte.relay.pool.size')
+        if pool_size > 0:
+            self._pool = _pool(self._remote_ip, self._remote_port, pool_size,
+                               self.onNewOutgoingConnection)
+            self._pool.daemon = True
+            self._pool.start()
+
+    def _runConnector(self):
+        while True:
+            conn = self._accepted.get()
+            if conn is None:
+                break
+            self._connect(conn)
+
+    def _connect(self, conn):
+        new_stream = None
+        try:
+            new_stream = self._connectUpstream()
+            conn = self.onNewIncomingConnection(conn)
+            self._relay(conn, new_stream)
+        except Exception as e:
+            if fte.metrics.enabled:
+                fte.metrics.increment('fte_relay_connect_failures_total')
+            fte.logger.error("fte.relay failed to connect to " +
+                             str((self._remote_ip, self._remote_port)) +
+                             ": " + repr(e))
+            for sock in [conn, new_stream]:
+                if sock is not None:
+                    fte.network_io.close_socket(sock)
+
+    def _connectUpstream(self):
+        """Returns a new outgoing connection, from the pool if there is one,
+        wrapped with ``onNewOutgoingConnection``. The pool wraps its sockets
+        as they enter it.
+        """
+
+        if self._pool is not None:
+            new_stream = self._pool.get()
+            if new_stream is not None:
+                return new_stream
+        new_stream = _connect(self._remote_ip, self._remote_port)
+        fte.logger.debug("New outgoing connection established: " +
+                         str((self._remote_ip, self._remote_port)))
 
+        try:
+            return self.onNewOutgoingConnection(new_stream)
+        except:
+            fte.network_io.close_socket(new_stream)
+            raise
+
+    def _relay(self, conn, new_stream):
+        if fte.metrics.enabled:
+            fte.metrics.increment('fte_relay_connections_total')
+        if self._eventloops:
+            with self._eventloops_lock:
+                loop = self._eventloops[self._next_eventloop]
+                self._next_eventloop = (self._next_eventloop + 1) % \
+                    len(self._eventloops)
+            loop.addConnection(conn, new_stream)
+        else:
+            closer = _closer([conn, new_stream], 2,
+                             'fte_relay_connections_closed_total')
+            w1 = worker(conn, new_stream, closer)
+            w2 = worker(new_stream, conn, closer)
+            w1.start()
+            w2.start()
+
+    def _instantiateSocket(self):
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if fte.conf.getValue('runtime.fte.relay.reuse_port'):
+            self._sock.setsockopt(socket.SOL_SOCKET, _SO_REUSEPORT, 1)
         self._sock.bind((self._local_ip, self._local_port))
         self._sock.listen(fte.conf.getValue('runtime.fte.relay.backlog'))
-        self._sock.settimeout(
-            fte.conf.getValue('runtime.fte.relay.socket_timeout'))
+        # we wait for connections with select, such that stop can wake us
+        self._sock.setblocking(0)
+
+    def _accept(self):
+        """Blocks until a connection is accepted, returns ``None`` if we were
+        woken by ``stop``.
+        """
+
+        while self._running:
+            try:
+                ready = select.select([self._sock, self._waker], [], [])[0]
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if self._waker in ready:
+                self._waker.drain()
+                continue
+            try:
+                conn, addr = self._sock.accept()
+            except socket.error as e:
+                if e.args[0] in _WOULDBLOCK:
+                    continue
+                raise
+            conn.setblocking(1)
+            return conn
+
+        return None
 
     def run(self):
         """Bind to ``local_ip:local_port`` and forward all connections to
         ``remote_ip:remote_port``.
         """
         self._instantiateSocket()
+        self._startEventLoops()
+        self._startConnectors()
 
-        self._running = True
+        try:
+            self._serve()
+        finally:
+            fte.network_io.close_socket(self._sock)
+            self._waker.close()
+
+    def _serve(self):
         while self._running:
             try:
-                with self._sock_lock:
-                    conn, addr = self._sock.accept()
-
-                new_stream = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                new_stream.connect((self._remote_ip, self._remote_port))
-                fte.logger.debug("New outgoing connection established: " +
-                                 str((self._remote_ip, self._remote_port)))
-
-                conn = self.onNewIncomingConnection(conn)
-                new_stream = self.onNewOutgoingConnection(new_stream)
-
-                w1 = worker(conn, new_stream)
-                w2 = worker(new_stream, conn)
-                w1.start()
-                w2.start()
-            except socket.timeout:
-                continue
+                conn = self._accept()
+                if conn is None:
+                    break
+                self._dispatch(conn)
             except socket.error:
                 fte.logger.error("socket.error received in fte.relay")
                 continue
 
+    def _dispatch(self, conn):
+        # connectors establish the outgoing connection
+        self._accepted.put(conn)
+
     def stop(self):
         """Terminate the thread and stop listening on ``local_ip:local_port``.
+        Returns once the listening socket is closed, and the connector
+        threads have exited, or waiting for them has taken
+        ``runtime.fte.relay.connect.timeout`` seconds.
         """
         self._running = False
-        fte.network_io.close_socket(self._sock,
-                                    lock=self._sock_lock)
+        self._waker.wake()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+        # connectors finish the connections we have accepted, then exit
+        for connector in self._connectors:
+            self._accepted.put(None)
+        if self._pool is not None:
+            self._pool.stop()
+        deadline = time.time() + \
+            fte.conf.getValue('runtime.fte.relay.connect.timeout')
+        for thread in self._connectors + [self._pool]:
+            if thread is not None and thread is not threading.current_thread():
+                thread.join(max(0, deadline - time.time()))
+        for loop in self._eventloops:
+            loop.stop()
 
     def onNewIncomingConnection(self, socket):
         """``onNewIncomingConnection`` returns the socket unmodified, by default we do not need to
@@ -16,24 +16,242 @@
 # You should have received a copy of the GNU General Public License
 # along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
 
+import time
+import threading
+import collections
 import multiprocessing
 
-import twisted.protocols.socks
-
 SOCKS_LOG = "socks.log"
 
+import fte
 import fte.conf
+import fte.logger
+import fte.metrics
+import fte.mux
+import fte.network_io
 import fte.relay
 
 
+class _negotiator(threading.Thread):
+
+    """Negotiates the incoming connections of an ``fte.server.listener``
+    from a single thread, such that clients that are slow to negotiate don't
+    hold a connector thread. A connection is passed to ``onNegotiated`` once
+    it has negotiated, and closed if its client fails to, or takes more than
+    ``runtime.fte.negotiate.timeout`` seconds. Up to
+    ``runtime.fte.negotiate.max_pending`` connections negotiate at once.
+    """
+
+    def __init__(self, onNegotiated):
+        threading.Thread.__init__(self)
+
+        self._onNegotiated = onNegotiated
+        self._max_pending = fte.conf.getValue(
+            'runtime.fte.negotiate.max_pending')
+        self._running = True
+        self._poller = fte.relay._poller()
+        self._waker = fte.network_io.Waker()
+        self._added = collections.deque()
+        # fd -> [conn, deadline]
+        self._negotiating = {}
+        # the connections added, that haven't been passed on or closed
+        self._num_pending = 0
+        self._lock = threading.Lock()
+
+    def add(self, conn):
+        """Negotiate ``conn``, a socket wrapped with ``fte.wrap_socket``.
+        Returns ``False`` if ``runtime.fte.negotiate.max_pending``
+        connections are negotiating already.
+        """
+
+        with self._lock:
+            if self._num_pending >= self._max_pending:
+                return False
+            self._num_pending += 1
+        self._added.append(conn)
+        self._waker.wake()
+        return True
+
+    def getNumPending(self):
+        """Returns the number of connections that are negotiating."""
+
+        return self._num_pending
+
+    def run(self):
+        self._poller.register(self._waker.fileno(), self._poller.READ)
+        try:
+            while self._running:
+                for fd, events in self._poller.poll(self._getTimeout()):
+                    if fd == self._waker.fileno():
+                        self._waker.drain()
+                    elif fd in self._negotiating:
+                        self._onReadable(fd)
+                self._addPending()
+                self._expire()
+        finally:
+            for [conn, deadline] in self._negotiating.values():
+                fte.network_io.close_socket(conn)
+            while self._added:
+                fte.network_io.close_socket(self._added.popleft())
+            self._negotiating = {}
+            self._poller.close()
+            self._waker.close()
+
+    def stop(self):
+        """Stop negotiating, and close the connections that haven't."""
+
+        self._running = False
+        self._waker.wake()
+
+    def _addPending(self):
+        timeout = fte.conf.getValue('runtime.fte.negotiate.timeout')
+        while self._added:
+            conn = self._added.popleft()
+            conn.settimeout(0.0)
+            fd = conn.fileno()
+            self._negotiating[fd] = [conn, time.time() + timeout]
+            self._poller.register(fd, self._poller.READ)
+
+    def _onReadable(self, fd):
+        [conn, deadline] = self._negotiating[fd]
+        try:
+            if not conn.continueNegotiation():
+                return
+        except Exception as e:
+            self._fail(fd, "fte.server failed to negotiate: " + repr(e))
+            return
+
+        self._remove(fd)
+        conn.settimeout(None)
+        self._onNegotiated(conn)
+
+    def _getTimeout(self):
+        if not self._negotiating:
+            return None
+        deadline = min(deadline for [conn, deadline]
+                       in self._negotiating.values())
+        return max(0, deadline - time.time())
+
+    def _expire(self):
+        now = time.time()
+        for fd, [conn, deadline] in self._negotiating.items():
+            if now >= deadline:
+                conn._negotiation_manager.recordOutcome('timeout')
+                self._fail(fd, "fte.server closing a connection that "
+                               "didn't negotiate in time")
+
+    def _fail(self, fd, message):
+        if fte.metrics.enabled:
+            fte.metrics.increment('fte_relay_connect_failures_total')
+        fte.logger.error(message)
+        conn = self._remove(fd)
+        fte.network_io.close_socket(conn)
+
+    def _remove(self, fd):
+        [conn, deadline] = self._negotiating.pop(fd)
+        self._poller.unregister(fd)
+        with self._lock:
+            self._num_pending -= 1
+        return conn
+
+
 class listener(fte.relay.listener):
 
+    """Incoming connections are negotiated by an ``fte.server._negotiator``
+    before they are handed to the connector threads, on platforms that
+    support ``fte.relay.eventloop``, and by the connector threads otherwise.
+    """
+
+    def __init__(self, local_ip, local_port,
+                 remote_ip, remote_port):
+        fte.relay.listener.__init__(self, local_ip, local_port,
+                                    remote_ip, remote_port)
+        self._negotiator = None
+
+    def _startConnectors(self):
+        fte.relay.listener._startConnectors(self)
+        if fte.relay.eventloop_supported():
+            self._negotiator = _negotiator(self._onNegotiated)
+            self._negotiator.daemon = True
+            self._negotiator.start()
+
+    def _dispatch(self, conn):
+        if self._negotiator is None:
+            fte.relay.listener._dispatch(self, conn)
+        elif not self._negotiator.add(fte.wrap_socket(conn, mux=True)):
+            if fte.metrics.enabled:
+                fte.metrics.increment('fte_relay_connect_failures_total')
+            fte.logger.error("fte.server closing a connection, too many "
+                             "connections are negotiating")
+            fte.network_io.close_socket(conn)
+
+    def _onNegotiated(self, conn):
+        if self._running:
+            self._accepted.put(conn)
+        else:
+            fte.network_io.close_socket(conn)
+
+    def stop(self):
+        fte.relay.listener.stop(self)
+        if self._negotiator is not None:
+            self._negotiator.stop()
+            self._negotiator.join()
+
+    def _connect(self, conn):
+        """A client that multiplexes its streams with ``fte.mux`` needs an
+        outgoing connection per stream, rather than one, so we negotiate
+        before we connect. Its streams are connected by our connector
+        threads too.
+        """
+
+        if isinstance(conn, fte.mux.stream):
+            self._connectStream(conn)
+            return
+
+        new_stream = None
+        try:
+            if self._negotiator is None:
+                conn = self.onNewIncomingConnection(conn)
+            if conn.isMultiplexed():
+                fte.mux.session(conn, self._openStream).start()
+                return
+            new_stream = self._connectUpstream()
+            self._relay(conn, new_stream)
+        except Exception as e:
+            if fte.metrics.enabled:
+                fte.metrics.increment('fte_relay_connect_failures_total')
+            fte.logger.error("fte.server failed to relay a connection to " +
+                             str((self._remote_ip, self._remote_port)) +
+                             ": " + repr(e))
+            for sock in [conn, new_stream]:
+                if sock is not None:
+                    fte.network_io.close_socket(sock)
+
+    def _openStream(self, stream):
+        # connecting upstream mustn't stall the rest of the session
+        if self._running:
+            self._accepted.put(stream)
+        else:
+            stream.close()
+
+    def _connectStream(self, stream):
+        try:
+            stream.start(self._connectUpstream())
+        except Exception as e:
+            fte.logger.error("fte.server failed to open a stream to " +
+                             str((self._remote_ip, self._remote_port)) +
+                             ": " + repr(e))
+            stream.close()
+
     def onNewIncomingConnection(self, socket):
         """On an incoming data stream we wrap it with ``fte.wrap_socket``, with no parameters.
         By default we want the regular expressions to be negotiated in-band, specified by the client.
+        We accept clients that multiplex streams, and wait up to
+        ``runtime.fte.negotiate.timeout`` seconds for negotiation to complete.
         """
 
-        socket = fte.wrap_socket(socket)
+        socket = fte.wrap_socket(socket, mux=True)
+        socket.negotiate(fte.conf.getValue('runtime.fte.negotiate.timeout'))
 
         return socket
 
@@ -48,6 +266,10 @@ class SocksProxyV4(multiprocessing.Process):
         self._event = multiprocessing.Event()
 
     def run(self):
+        # only now, such that fte.server doesn't load Twisted
+        import twisted.internet.task
+        import twisted.protocols.socks
+
         factory = twisted.protocols.socks.SOCKSv4Factory("socks.log")
         twisted.internet.reactor.listenTCP(
             self._proxyPort, factory, interface=self._proxyIP)
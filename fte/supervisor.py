@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import errno
+import signal
+import threading
+import traceback
+
+import fte.logger
+
+
+# workers that exit sooner than this after they are started are restarted
+# after _RESTART_DELAY seconds, rather than immediately
+_MIN_UPTIME = 1.0
+_RESTART_DELAY = 1.0
+
+
+def supported():
+    """Returns ``True`` if this platform can fork workers."""
+
+    return hasattr(os, 'fork')
+
+
+class supervisor(object):
+
+    """``fte.supervisor.supervisor`` forks ``num_workers`` processes, each of
+    which calls ``target`` and exits once it returns. Workers are forked from
+    the calling process, so anything it has loaded, such as every
+    ``fte.encoder.RegexEncoder``, is shared with them copy-on-write. Workers
+    that exit are restarted until ``stop`` is called, and exit themselves if
+    the supervisor dies. ``on_change``, if given, is called with the list of
+    worker PIDs whenever it changes.
+    """
+
+    def __init__(self, target, num_workers, on_change=None):
+        self._target = target
+        self._num_workers = num_workers
+        self._on_change = on_change
+        self._running = True
+        self._workers = {}
+        self._lock = threading.Lock()
+
+    def run(self):
+        """Fork the workers, and restart them as they exit. Returns once
+        ``stop`` is called and every worker has exited.
+        """
+
+        # workers watch the read end, it is closed once we exit
+        [lifeline, self._lifeline] = os.pipe()
+        try:
+            for i in range(self._num_workers):
+                self._fork(lifeline)
+
+            while self._workers:
+                try:
+                    [pid, status] = os.wait()
+                except OSError as e:
+                    if e.errno == errno.EINTR:
+                        continue
+                    if e.errno == errno.ECHILD:
+                        break
+                    raise
+
+                with self._lock:
+                    started = self._workers.pop(pid, None)
+                if started is None:
+                    continue
+                self._changed()
+
+                if not self._running:
+                    continue
+                fte.logger.error("fteproxy worker " + str(pid) +
+                                 " exited with status " + str(status) +
+                                 ", restarting")
+                if time.time() - started < _MIN_UPTIME:
+                    time.sleep(_RESTART_DELAY)
+                self._fork(lifeline)
+        finally:
+            os.close(lifeline)
+            os.close(self._lifeline)
+
+    def stop(self):
+        """Stop restarting workers, and terminate those that are running."""
+
+        with self._lock:
+            self._running = False
+            for pid in self._workers.keys():
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+
+    def kill(self, signum):
+        """Send ``signum`` to every running worker."""
+
+        with self._lock:
+            for pid in self._workers.keys():
+                try:
+                    os.kill(pid, signum)
+                except OSError:
+                    pass
+
+    def getPids(self):
+        """Returns the PIDs of the running workers."""
+
+        with self._lock:
+            return sorted(self._workers.keys())
+
+    def _fork(self, lifeline):
+        with self._lock:
+            if not self._running:
+                return
+            pid = os.fork()
+            if pid == 0:
+                self._runWorker(lifeline)
+            self._workers[pid] = time.time()
+        self._changed()
+
+    def _changed(self):
+        if self._on_change is not None:
+            self._on_change(self.getPids())
+
+    def _runWorker(self, lifeline):
+        status = 0
+        try:
+            os.close(self._lifeline)
+            # our copy of the supervisor has no workers of its own, and
+            # its lock was held by _fork
+            self._workers = {}
+            self._lock = threading.Lock()
+            # the supervisor decides when we exit
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            if hasattr(signal, 'set_wakeup_fd'):
+                signal.set_wakeup_fd(-1)
+            watcher = threading.Thread(target=_watchLifeline, args=(lifeline,))
+            watcher.daemon = True
+            watcher.start()
+            self._target()
+        except:
+            fte.logger.error(traceback.format_exc())
+            status = 1
+        finally:
+            os._exit(status)
+
+
+def _watchLifeline(lifeline):
+    """Exit once the write end of ``lifeline`` is closed, which happens when
+    our supervisor exits.
+    """
+
+    while True:
+        try:
+            if not os.read(lifeline, 1):
+                break
+        except OSError as e:
+            if e.errno != errno.EINTR:
+                break
+    os._exit(0)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+import socket
+import time
+import unittest
+
+import fte.conf
+import fte.defs
+import fte.server
+
+try:
+    import trollius as asyncio
+    from trollius import From
+    import concurrent.futures
+    import fte.aio
+except ImportError:
+    asyncio = None
+
+LOCAL_INTERFACE = '127.0.0.1'
+TIMEOUT = 10
+
+
+def getLanguages():
+    outgoing_language = fte.conf.getValue('runtime.state.upstream_language')
+    incoming_language = fte.conf.getValue(
+        'runtime.state.downstream_language')
+    return [fte.defs.getRegex(outgoing_language),
+            fte.defs.getFixedSlice(outgoing_language),
+            fte.defs.getRegex(incoming_language),
+            fte.defs.getFixedSlice(incoming_language)]
+
+
+@unittest.skipIf(asyncio is None, 'trollius is not installed')
+class TestAio(unittest.TestCase):
+
+    def setUp(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(None)
+        self._executor = None
+
+    def tearDown(self):
+        self._loop.close()
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def testOpenConnection(self):
+        self._testStream()
+
+    def testOpenConnectionExecutor(self):
+        self._executor = concurrent.futures.ThreadPoolExecutor(2)
+        self._testStream()
+
+    def testOpenConnectionExecutorWatermarks(self):
+        high_watermark = fte.conf.getValue('runtime.fte.relay.high_watermark')
+        low_watermark = fte.conf.getValue('runtime.fte.relay.low_watermark')
+        fte.conf.setValue('runtime.fte.relay.high_watermark', 2 ** 10)
+        fte.conf.setValue('runtime.fte.relay.low_watermark', 2 ** 9)
+        try:
+            self._executor = concurrent.futures.ThreadPoolExecutor(2)
+            self._testStream()
+        finally:
+            fte.conf.setValue('runtime.fte.relay.high_watermark',
+                              high_watermark)
+            fte.conf.setValue('runtime.fte.relay.low_watermark',
+                              low_watermark)
+
+    def testNegotiationTimeout(self):
+        timeout = fte.conf.getValue('runtime.fte.negotiate.timeout')
+        fte.conf.setValue('runtime.fte.negotiate.timeout', 0.5)
+
+        @asyncio.coroutine
+        def test():
+            server = yield From(fte.aio.start_server(
+                self._echo, LOCAL_INTERFACE,
+                fte.conf.getValue('runtime.server.port'), loop=self._loop))
+            try:
+                [reader, writer] = yield From(asyncio.open_connection(
+                    LOCAL_INTERFACE, fte.conf.getValue('runtime.server.port'),
+                    loop=self._loop))
+                start = time.time()
+                try:
+                    data = yield From(reader.read())
+                except socket.error:
+                    data = ''
+                elapsed = time.time() - start
+                writer.close()
+            finally:
+                server.close()
+            self.assertEquals('', data)
+            self.assertLess(elapsed, 3)
+
+        try:
+            self._run(test())
+        finally:
+            fte.conf.setValue('runtime.fte.negotiate.timeout', timeout)
+
+    def testServerSpeaksFirst(self):
+        @asyncio.coroutine
+        def greet(reader, writer):
+            writer.write('hello')
+            yield From(writer.drain())
+            data = yield From(reader.readexactly(len('world')))
+            writer.write(data)
+            writer.close()
+
+        @asyncio.coroutine
+        def test():
+            server = yield From(fte.aio.start_server(
+                greet, LOCAL_INTERFACE, fte.conf.getValue('runtime.server.port'),
+                loop=self._loop))
+            try:
+                [reader, writer] = yield From(self._openConnection())
+                greeting = yield From(reader.readexactly(len('hello')))
+                writer.write('world')
+                reply = yield From(reader.readexactly(len('world')))
+                eof = yield From(reader.read())
+                writer.close()
+            finally:
+                server.close()
+            self.assertEquals('hello', greeting)
+            self.assertEquals('world', reply)
+            self.assertEquals('', eof)
+
+        self._run(test())
+
+    def testListeners(self):
+        self._testListeners(fte.aio.server_listener(
+            LOCAL_INTERFACE, fte.conf.getValue('runtime.server.port'),
+            LOCAL_INTERFACE, fte.conf.getValue('runtime.proxy.port'),
+            loop=self._loop))
+
+    def testListenersThreadedServer(self):
+        server = fte.server.listener(LOCAL_INTERFACE,
+                                     fte.conf.getValue('runtime.server.port'),
+                                     LOCAL_INTERFACE,
+                                     fte.conf.getValue('runtime.proxy.port'))
+        server.start()
+        time.sleep(0.1)
+        try:
+            self._testListeners(None)
+        finally:
+            server.stop()
+
+    def _testListeners(self, server):
+        client = fte.aio.client_listener(
+            LOCAL_INTERFACE, fte.conf.getValue('runtime.client.port'),
+            LOCAL_INTERFACE, fte.conf.getValue('runtime.server.port'),
+            loop=self._loop)
+
+        @asyncio.coroutine
+        def test():
+            proxy = yield From(asyncio.start_server(
+                self._echo, LOCAL_INTERFACE,
+                fte.conf.getValue('runtime.proxy.port'), loop=self._loop))
+            if server is not None:
+                yield From(server.start())
+            yield From(client.start())
+            try:
+                for i in range(10):
+                    [reader, writer] = yield From(asyncio.open_connection(
+                        LOCAL_INTERFACE, fte.conf.getValue('runtime.client.port'),
+                        loop=self._loop))
+                    expected = str(i) * 2 ** 14
+                    writer.write(expected)
+                    actual = yield From(reader.readexactly(len(expected)))
+                    # wait for the relays to close the connection
+                    writer.write_eof()
+                    eof = yield From(reader.read())
+                    writer.close()
+                    self.assertEquals(expected, actual)
+                    self.assertEquals('', eof)
+            finally:
+                client.stop()
+                if server is not None:
+                    server.stop()
+                proxy.close()
+
+        self._run(test())
+
+    def _testStream(self):
+        @asyncio.coroutine
+        def test():
+            server = yield From(fte.aio.start_server(
+                self._echo, LOCAL_INTERFACE,
+                fte.conf.getValue('runtime.server.port'),
+                loop=self._loop, executor=self._executor))
+            try:
+                [reader, writer] = yield From(self._openConnection())
+                for i in range(1, 2 ** 16, 2 ** 12):
+                    expected = str(i % 10) * i
+                    writer.write(expected)
+                    yield From(writer.drain())
+                    actual = yield From(reader.readexactly(len(expected)))
+                    self.assertEquals(expected, actual)
+                writer.close()
+            finally:
+                server.close()
+
+        self._run(test())
+
+    def _openConnection(self):
+        [outgoing_regex, outgoing_fixed_slice,
+         incoming_regex, incoming_fixed_slice] = getLanguages()
+        return fte.aio.open_connection(
+            LOCAL_INTERFACE, fte.conf.getValue('runtime.server.port'),
+            outgoing_regex, outgoing_fixed_slice,
+            incoming_regex, incoming_fixed_slice,
+            loop=self._loop, executor=self._executor)
+
+    @asyncio.coroutine
+    def _echo(self, reader, writer):
+        while True:
+            data = yield From(reader.read(2 ** 16))
+            if not data:
+                break
+            writer.write(data)
+            yield From(writer.drain())
+        writer.close()
+
+    def _run(self, coro):
+        self._loop.run_until_complete(
+            asyncio.wait_for(coro, TIMEOUT, loop=self._loop))
@@ -16,6 +16,7 @@
 # You should have received a copy of the GNU General Public License
 # along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import unittest
 import random
 import fte.bit_ops
@@ -58,6 +59,32 @@ class TestEncoders(unittest.TestCase):
             M = fte.bit_ops.bytes_to_long(M)
             self.assertEquals(N, M)
 
+    def testRandomBytes(self):
+        outputs = set()
+        for i in range(2 ** 10):
+            N = random.randint(0, 2 ** 13)
+            M = fte.bit_ops.random_bytes(N)
+            self.assertEquals(N, len(M))
+            if N >= 16:
+                self.assertTrue(M not in outputs)
+                outputs.add(M)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'requires os.fork')
+    def testRandomBytesFork(self):
+        fte.bit_ops.random_bytes(1)
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(r)
+            os.write(w, fte.bit_ops.random_bytes(32))
+            os._exit(0)
+        os.close(w)
+        child_bytes = os.read(r, 32)
+        os.close(r)
+        os.waitpid(pid, 0)
+        self.assertEquals(32, len(child_bytes))
+        self.assertNotEqual(child_bytes, fte.bit_ops.random_bytes(32))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+import fte.conf
+import fte.defs
+import fte.encoder
+
+RELEASE = '20140101'
+
+
+class TestDefinitions(unittest.TestCase):
+
+    def setUp(self):
+        self._defs_dir = tempfile.mkdtemp()
+        self._conf = {}
+        for key in ['general.defs_dir', 'fte.defs.release',
+                    'fte.defs.check_interval']:
+            self._conf[key] = fte.conf.getValue(key)
+        fte.conf.setValue('general.defs_dir', self._defs_dir)
+        fte.conf.setValue('fte.defs.release', RELEASE)
+        self._write('^(a|b)+$', 0)
+
+    def tearDown(self):
+        for key, value in self._conf.items():
+            fte.conf.setValue(key, value)
+        fte.defs.reload()
+        shutil.rmtree(self._defs_dir)
+
+    def testGetDefinition(self):
+        definition = fte.defs.getDefinition('test-request')
+        self.assertEquals('^(a|b)+$', definition.regex)
+        self.assertEquals(32, definition.fixed_slice)
+        self.assertEquals(fte.conf.getValue('fte.default_fixed_slice'),
+                          fte.defs.getDefinition('test-response').fixed_slice)
+        self.assertTrue(definition.getEncoder() is
+                        fte.encoder.RegexEncoder('^(a|b)+$', 32))
+        self.assertRaises(fte.defs.InvalidRegexName,
+                          fte.defs.getDefinition, 'missing-request')
+
+    def testReloadOnChange(self):
+        fte.conf.setValue('fte.defs.check_interval', None)
+        definitions = fte.defs.load_definitions()
+        self._write('^(c|d)+$', 1)
+        self.assertTrue(fte.defs.load_definitions() is definitions)
+        self.assertEquals('^(a|b)+$', fte.defs.getRegex('test-request'))
+
+        fte.conf.setValue('fte.defs.check_interval', 0)
+        self.assertEquals('^(c|d)+$', fte.defs.getRegex('test-request'))
+        definitions = fte.defs.load_definitions()
+        self.assertTrue(fte.defs.load_definitions() is definitions)
+
+    def testReload(self):
+        fte.conf.setValue('fte.defs.check_interval', None)
+        fte.defs.load_definitions()
+        self._write('^(c|d)+$', 1)
+        fte.defs.reload()
+        self.assertEquals('^(c|d)+$', fte.defs.getRegex('test-request'))
+
+    def _write(self, regex, mtime):
+        """Writes our definitions file, with ``mtime`` seconds since the
+        epoch as its mtime, as changes within a second may not change it.
+        """
+
+        path = os.path.join(self._defs_dir, RELEASE + '.json')
+        with open(path, 'w') as fh:
+            json.dump({'test-request': {'regex': regex, 'fixed_slice': 32},
+                       'test-response': {'regex': regex}}, fh)
+        os.utime(path, (mtime, mtime))
@@ -17,10 +17,16 @@
 # along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import unittest
+import os
+import shutil
 import random
+import tempfile
+import unittest
+import threading
 
+import fte.conf
 import fte.dfa
+import fte.cDFA
 
 NUM_TRIALS = 2 ** 10
 
@@ -44,5 +50,157 @@ class TestDFA(unittest.TestCase):
                 M = dfa.rank(X)
                 self.assertEquals(N, M)
 
+    def testUnrankRankShortSlices(self):
+        for regex in _regexs:
+            dfa = fte.dfa.from_regex(regex, MAX_LEN)
+            for n in [1, 8, 64, MAX_LEN - 1]:
+                words_in_slice = dfa.getNumWordsInSlice(n)
+                if words_in_slice == 0:
+                    continue
+                for i in range(NUM_TRIALS / 8):
+                    N = random.randint(0, words_in_slice - 1)
+                    X = dfa.unrank(N, n)
+                    self.assertEquals(len(X), n)
+                    M = dfa.rank(X)
+                    self.assertEquals(N, M)
+                self.assertRaises(RuntimeError, dfa.unrank, words_in_slice, n)
+
+    def testIsPrefix(self):
+        for regex in _regexs:
+            dfa = fte.dfa.from_regex(regex, MAX_LEN)
+            X = dfa.unrank(random.randint(0, (1 << dfa.getCapacity())))
+            for n in [0, 1, 8, MAX_LEN - 1, MAX_LEN]:
+                self.assertTrue(dfa.isPrefix(X[:n]))
+            self.assertFalse(dfa.isPrefix(X + X[-1:]))
+
+        dfa = fte.dfa.from_regex('^(acat|adog)+$', MAX_LEN)
+        self.assertFalse(dfa.isPrefix('acab'))
+        # a prefix of the language, but no word of length MAX_LEN has it
+        dfa = fte.dfa.from_regex('^(acat|adogg)+$', MAX_LEN)
+        self.assertTrue(dfa.isPrefix('acat' * (MAX_LEN / 4 - 1)))
+        self.assertFalse(dfa.isPrefix('acat' * (MAX_LEN / 4 - 2) + 'adogg'))
+
+    def testStats(self):
+        for regex in _regexs:
+            dfa = fte.dfa.from_regex(regex, MAX_LEN)
+            dfa.resetStats()
+            for i in range(NUM_TRIALS / 8):
+                dfa.rank(dfa.unrank(random.randint(0, 1 << dfa.getCapacity())))
+            self.assertRaises(RuntimeError, dfa.unrank,
+                              dfa.getNumWordsInSlice(MAX_LEN))
+
+            stats = dfa.getStats()
+            self.assertEquals(NUM_TRIALS / 8, stats['rank_calls'])
+            self.assertEquals(NUM_TRIALS / 8, stats['unrank_calls'])
+            self.assertTrue(stats['rank_ns'] > 0)
+            self.assertTrue(stats['unrank_ns'] > 0)
+            self.assertEquals(2 * MAX_LEN * NUM_TRIALS / 8,
+                              stats['dense_steps'] +
+                              stats['goldberg_sipser_steps'])
+            self.assertEquals(dfa.getTableSize(), stats['table_bytes'])
+            self.assertTrue(stats['states'] > 0)
+            self.assertTrue(stats['symbols'] > 0)
+            self.assertTrue(stats['build_ns'] >= stats['build_table_ns'])
+            self.assertEquals(MAX_LEN, stats['fixed_slice'])
+
+            dfa.resetStats()
+            reset = dfa.getStats()
+            for counter in ['rank_calls', 'rank_ns', 'unrank_calls',
+                            'unrank_ns', 'dense_steps',
+                            'goldberg_sipser_steps']:
+                self.assertEquals(0, reset[counter])
+            self.assertEquals(stats['build_ns'], reset['build_ns'])
+
+    def testStatsThreads(self):
+        dfa = fte.dfa.from_regex(_regexs[1], MAX_LEN)
+        dfa.resetStats()
+
+        def work():
+            for i in range(NUM_TRIALS / 8):
+                dfa.rank(dfa.unrank(i))
+        threads = [threading.Thread(target=work) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = dfa.getStats()
+        self.assertEquals(4 * NUM_TRIALS / 8, stats['rank_calls'])
+        self.assertEquals(4 * NUM_TRIALS / 8, stats['unrank_calls'])
+
+
+class TestSharedTable(unittest.TestCase):
+
+    def setUp(self):
+        self._table_dir = tempfile.mkdtemp()
+        self._conf_table_dir = fte.conf.getValue('fte.dfa.table_dir')
+        fte.conf.setValue('fte.dfa.table_dir', self._table_dir)
+
+    def tearDown(self):
+        fte.conf.setValue('fte.dfa.table_dir', self._conf_table_dir)
+        shutil.rmtree(self._table_dir)
+
+    def testTableDir(self):
+        # a format that no other test has built
+        regex = '^(table|dir)+' + str(random.randint(0, 2 ** 30)) + '$'
+        dfa = fte.dfa.from_regex(regex, MAX_LEN)
+        self.assertTrue(dfa.isTableShared())
+        self.assertEquals(1, len(os.listdir(self._table_dir)))
+
+    def testSharedTable(self):
+        for regex in _regexs:
+            att_fst = self._getAttFst(regex)
+            table_path = os.path.join(self._table_dir, 'table')
+            private = fte.cDFA.DFA(att_fst, MAX_LEN)
+            writer = fte.cDFA.DFA(att_fst, MAX_LEN, table_path)
+            reader = fte.cDFA.DFA(att_fst, MAX_LEN, table_path)
+            self.assertFalse(private.isTableShared())
+            self.assertTrue(writer.isTableShared())
+            self.assertTrue(reader.isTableShared())
+            self._assertEqualDFAs(private, reader)
+
+            # a shared table is the table file, and the view of its entries
+            # in each process
+            self.assertEquals(writer.getTableSize(), reader.getTableSize())
+            self.assertTrue(reader.getTableSize() >
+                            os.path.getsize(table_path))
+            self.assertTrue(private.getTableSize() > 0)
+            os.unlink(table_path)
+
+    def testInvalidTable(self):
+        att_fst = self._getAttFst(_regexs[0])
+        table_path = os.path.join(self._table_dir, 'table')
+        private = fte.cDFA.DFA(att_fst, MAX_LEN)
+
+        # the table of another DFA, a truncated table, and garbage
+        fte.cDFA.DFA(att_fst, MAX_LEN - 1, table_path)
+        with open(table_path, 'rb') as f:
+            table = f.read()
+        for contents in [table, table[:-1], 'X' * len(table)]:
+            with open(table_path, 'wb') as f:
+                f.write(contents)
+            dfa = fte.cDFA.DFA(att_fst, MAX_LEN, table_path)
+            self.assertTrue(dfa.isTableShared())
+            self._assertEqualDFAs(private, dfa)
+
+    def testInvalidArguments(self):
+        att_fst = self._getAttFst(_regexs[0])
+        for args in [(att_fst,), (None, MAX_LEN), (att_fst, 'X'),
+                     (att_fst, MAX_LEN, None), ('X', MAX_LEN)]:
+            self.assertRaises(RuntimeError, fte.cDFA.DFA, *args)
+
+    def _getAttFst(self, regex):
+        return fte.dfa._attFstMinimize(fte.dfa._attFstFromRegex(regex))
+
+    def _assertEqualDFAs(self, expected, actual):
+        self.assertEquals(expected.getNumWordsInLanguage(0, MAX_LEN),
+                          actual.getNumWordsInLanguage(0, MAX_LEN))
+        words_in_slice = expected.getNumWordsInLanguage(MAX_LEN, MAX_LEN)
+        for i in range(NUM_TRIALS / 8):
+            N = random.randint(0, words_in_slice - 1)
+            X = expected.unrank(N)
+            self.assertEquals(X, actual.unrank(N))
+            self.assertEquals(N, actual.rank(X))
+
 if __name__ == '__main__':
     unittest.main()
@@ -16,9 +16,13 @@
 # You should have received a copy of the GNU General Public License
 # along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
 
+import time
 import unittest
 import random
+import threading
 
+import fte.conf
+import fte.dfa
 import fte.encoder
 import fte.bit_ops
 import fte.defs
@@ -42,6 +46,28 @@ class TestEncoders(unittest.TestCase):
             self.doTestEncoder(encoder, 8)
             self.doTestEncoder(encoder, 16)
 
+    def testRegexEncoderUnframed(self):
+        definitions = fte.defs.load_definitions()
+        for language in definitions.keys():
+            regex = fte.defs.getRegex(language)
+            fixed_slice = fte.defs.getFixedSlice(language)
+            encoder = fte.encoder.RegexEncoder(regex, fixed_slice)
+            for fixed_slice in encoder.getSlices():
+                radix = encoder.getRadix(fixed_slice)
+                self.assertTrue(radix >= 2)
+                n = encoder.getMaximumBytesToRank(fixed_slice)
+                for digit in [0, 1, random.randint(0, radix - 1), radix - 1]:
+                    X = fte.bit_ops.random_bytes(n + 32)
+                    covertext = encoder.encodeUnframed(X, digit, fixed_slice)
+                    self.assertEquals(len(covertext), fixed_slice + 32)
+                    [head, body, D] = encoder.decodeUnframed(
+                        covertext, fixed_slice)
+                    self.assertEquals(X, head + body)
+                    self.assertEquals(digit, D)
+                self.assertRaises(fte.encoder.InvalidInputException,
+                                  encoder.encodeUnframed, 'X', radix,
+                                  fixed_slice)
+
     def doTestEncoder(self, encoder, factor=1):
         for i in range(NUM_TRIALS):
             N = int(encoder.getCapacity() * factor)
@@ -50,3 +76,154 @@ class TestEncoders(unittest.TestCase):
             X = encoder.encode(C)
             D = encoder.decode(X)
             self.assertEquals(C, D)
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        self._minimize = fte.dfa.minimize
+        self._RegexEncoderObject = fte.encoder.RegexEncoderObject
+        self._builds = {'minimize': 0, 'RegexEncoderObject': 0}
+
+    def tearDown(self):
+        fte.dfa.minimize = self._minimize
+        fte.encoder.RegexEncoderObject = self._RegexEncoderObject
+
+    def testOneBuildPerKey(self):
+        regexes = ['^(single|flight|x)+$', '^(single|flight|y)+$']
+        lock = threading.Lock()
+
+        def minimize(regex):
+            with lock:
+                self._builds['minimize'] += 1
+            # widen the window in which others could start a build
+            time.sleep(0.2)
+            return self._minimize(regex)
+        fte.dfa.minimize = minimize
+
+        builds = self._builds
+        base = self._RegexEncoderObject
+
+        class RegexEncoderObject(base):
+
+            def __init__(self, regex, fixed_slice):
+                with lock:
+                    builds['RegexEncoderObject'] += 1
+                base.__init__(self, regex, fixed_slice)
+        fte.encoder.RegexEncoderObject = RegexEncoderObject
+
+        # 64 first connections, half of them to each format
+        start = threading.Event()
+        encoders = [None] * 64
+
+        def connect(i):
+            start.wait()
+            encoders[i] = fte.encoder.RegexEncoder(regexes[i % 2], 64)
+        threads = [threading.Thread(target=connect, args=(i,))
+                   for i in range(64)]
+        for t in threads:
+            t.start()
+        start.set()
+        for t in threads:
+            t.join()
+
+        self.assertEquals(2, self._builds['minimize'])
+        self.assertEquals(2, self._builds['RegexEncoderObject'])
+        for i in range(64):
+            self.assertTrue(encoders[i] is encoders[i % 2])
+        self.assertFalse(encoders[0] is encoders[1])
+        self.assertEquals({}, fte.encoder._pending)
+
+    def testFailedBuildIsRetried(self):
+        regex = '^(single|flight|z)+$'
+
+        def minimize(regex):
+            self._builds['minimize'] += 1
+            if self._builds['minimize'] == 1:
+                raise Exception('first build fails')
+            return self._minimize(regex)
+        fte.dfa.minimize = minimize
+
+        self.assertRaises(Exception, fte.encoder.RegexEncoder, regex, 64)
+        self.assertEquals({}, fte.dfa._pending)
+        encoder = fte.encoder.RegexEncoder(regex, 64)
+        self.assertEquals(2, self._builds['minimize'])
+        self.assertTrue(encoder is fte.encoder.RegexEncoder(regex, 64))
+
+
+class TestEncoderCache(unittest.TestCase):
+
+    def setUp(self):
+        self._cache = fte.encoder._instance
+        self._cache_bytes = fte.conf.getValue('runtime.fte.encoder.cache_bytes')
+        fte.encoder._instance = fte.encoder.EncoderCache()
+
+    def tearDown(self):
+        fte.encoder._instance = self._cache
+        fte.conf.setValue('runtime.fte.encoder.cache_bytes', self._cache_bytes)
+
+    def testEviction(self):
+        [a, b, c, d] = ['^(cache|evict|' + x + ')+$' for x in 'abcd']
+
+        encoder = fte.encoder.RegexEncoder(a, 32)
+        size = encoder.getTableSize()
+        self.assertTrue(size > 0)
+        fte.conf.setValue('runtime.fte.encoder.cache_bytes', 5 * size / 2)
+
+        # b, now the least-recently-used encoder, is evicted to fit c and
+        # its table freed, then a is evicted to fit d
+        fte.encoder.RegexEncoder(b, 32)
+        self.assertTrue(encoder is fte.encoder.RegexEncoder(a, 32))
+        fte.encoder.RegexEncoder(c, 32)
+        fte.encoder.RegexEncoder(d, 32)
+        self.assertFalse((b, 32) in fte.encoder._instance)
+        self.assertFalse((b, 32) in fte.dfa._instance)
+        self.assertStats(2, 1, 4, 2)
+
+        # a was evicted while in use, its replacement shares its DFA
+        self.assertFalse((a, 32) in fte.encoder._instance)
+        self.assertTrue((a, 32) in fte.dfa._instance)
+        self.assertTrue(encoder._dfa is fte.encoder.RegexEncoder(a, 32)._dfa)
+        self.assertStats(2, 1, 5, 3)
+
+    def assertStats(self, entries, hits, misses, evictions):
+        stats = fte.encoder.getCacheStats()
+        self.assertEquals([entries, hits, misses, evictions],
+                          [stats['entries'], stats['hits'], stats['misses'],
+                           stats['evictions']])
+        self.assertTrue(stats['bytes'] <=
+                        fte.conf.getValue('runtime.fte.encoder.cache_bytes'))
+
+    def testEncodersInUseKeepTheirTables(self):
+        fte.conf.setValue('runtime.fte.encoder.cache_bytes', 0)
+        encoders = [fte.encoder.RegexEncoder('^(cache|kept|' + x + ')+$', 32)
+                    for x in 'abc']
+        stats = fte.encoder.getCacheStats()
+        self.assertEquals(1, stats['entries'])
+        self.assertEquals(encoders[-1].getTableSize(), stats['bytes'])
+        self.assertEquals(2, stats['evictions'])
+        for encoder in encoders:
+            self.assertTrue(
+                fte.dfa._instance.get((encoder._regex, 32)) is encoder._dfa)
+
+        # the cache still holds c
+        del encoder, encoders
+        for x in 'ab':
+            self.assertFalse(('^(cache|kept|' + x + ')+$', 32) in
+                             fte.dfa._instance)
+        self.assertTrue(('^(cache|kept|c)+$', 32) in fte.dfa._instance)
+
+    def testEntryOverBudget(self):
+        [a, b] = ['^(cache|large|' + x + ')+$' for x in 'ab']
+        size = fte.encoder.RegexEncoder(a, 32).getTableSize()
+        fte.conf.setValue('runtime.fte.encoder.cache_bytes', size / 2)
+
+        # an encoder larger than the cache is kept, until the next is added
+        encoder = fte.encoder.RegexEncoder(b, 32)
+        self.assertTrue(encoder.getTableSize() > size / 2)
+        self.assertTrue((b, 32) in fte.encoder._instance)
+        self.assertFalse((a, 32) in fte.encoder._instance)
+        self.assertTrue(encoder is fte.encoder.RegexEncoder(b, 32))
+        stats = fte.encoder.getCacheStats()
+        self.assertEquals([1, 1, 2, 1], [stats['entries'], stats['hits'],
+                                         stats['misses'], stats['evictions']])
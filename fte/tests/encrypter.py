@@ -19,6 +19,7 @@
 import unittest
 import random
 
+import fte.bit_ops
 import fte.encrypter
 
 TRIALS = 2 ** 12
@@ -58,6 +59,19 @@ class TestEncoders(unittest.TestCase):
             H_out = self.encrypter.decryptOneBlock(retval)
             self.assertEquals(M1, H_out)
 
+    def testKeyRing(self):
+        keys = [fte.bit_ops.random_bytes(32) for i in range(100)]
+        keyring = fte.encrypter.KeyRing(keys)
+        encrypter = fte.encrypter.Encrypter(K1=keys[57][:16], K2=keys[57][16:])
+        epoch = fte.encrypter.getKeyHintEpoch()
+
+        for e in [epoch - 1, epoch, epoch + 1]:
+            found = keyring.lookup(encrypter.getKeyHint(e))
+            self.assertEquals(keys[57], found.K1 + found.K2)
+        self.assertEquals(None, keyring.lookup(encrypter.getKeyHint(epoch - 2)))
+        self.assertEquals(None, keyring.lookup(
+            fte.encrypter.Encrypter().getKeyHint(epoch)))
+
 
 if __name__ == '__main__':
     unittest.main()
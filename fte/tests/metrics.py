@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import socket
+import shutil
+import urllib2
+import tempfile
+import unittest
+
+import fte
+import fte.conf
+import fte.defs
+import fte.encoder
+import fte.encrypter
+import fte.metrics
+import fte.record_layer
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        fte.metrics.reset()
+        self._server = None
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        if self._server is not None:
+            self._server.stop()
+        fte.metrics.stop()
+        fte.metrics.reset()
+        fte.conf.setValue('runtime.fte.metrics.port', None)
+        fte.conf.setValue('runtime.fte.metrics.unix_socket', None)
+        shutil.rmtree(self._dir)
+
+    def testExport(self):
+        labels = (('format', 'a"b'),)
+        fte.metrics.increment('fte_cells_total', labels, 3)
+        fte.metrics.increment('fte_cells_total', labels)
+        fte.metrics.observe('fte_cell_seconds', labels, 0.00002)
+        fte.metrics.observe('fte_cell_seconds', labels, 1)
+
+        lines = fte.metrics.export().split('\n')
+        self.assertTrue('# TYPE fte_cells_total counter' in lines)
+        self.assertTrue('fte_cells_total{format="a\\"b"} 4' in lines)
+        self.assertTrue(
+            'fte_cell_seconds_bucket{format="a\\"b",le="1e-05"} 0' in lines)
+        self.assertTrue(
+            'fte_cell_seconds_bucket{format="a\\"b",le="2.5e-05"} 1' in lines)
+        self.assertTrue(
+            'fte_cell_seconds_bucket{format="a\\"b",le="0.025"} 1' in lines)
+        self.assertTrue(
+            'fte_cell_seconds_bucket{format="a\\"b",le="+Inf"} 2' in lines)
+        self.assertTrue('fte_cell_seconds_count{format="a\\"b"} 2' in lines)
+
+    def testNothingRecordedUntilStarted(self):
+        [encoder, decoder] = self._getRecordLayer()
+        self._roundTrip(encoder, decoder, 'X' * 1024)
+        self.assertEquals({}, fte.metrics._counters)
+        self.assertEquals({}, fte.metrics._histograms)
+
+    def testRecordLayer(self):
+        self.assertEquals(None, fte.metrics.start())
+        [encoder, decoder] = self._getRecordLayer()
+        self._roundTrip(encoder, decoder, 'X' * 1024)
+
+        language = fte.conf.getValue('runtime.state.upstream_language')
+        for direction in ['encode', 'decode']:
+            labels = (('format', language), ('direction', direction))
+            self.assertTrue(self._getCounter('fte_cells_total', labels) > 0)
+            self.assertEquals(
+                1024, self._getCounter('fte_plaintext_bytes_total', labels))
+            self.assertTrue(
+                self._getCounter('fte_covertext_bytes_total', labels) > 1024)
+            self.assertEquals(
+                self._getCounter('fte_cells_total', labels),
+                fte.metrics._histograms[('fte_cell_seconds', labels)][-2] +
+                sum(fte.metrics._histograms[('fte_cell_seconds', labels)][:-2]))
+
+        labels = (('format', language), ('direction', 'encode'))
+        capacity = self._getCounter('fte_capacity_bytes_total', labels)
+        used = self._getCounter('fte_capacity_used_bytes_total', labels)
+        self.assertTrue(0 < used <= capacity)
+
+    def testDecryptFailure(self):
+        fte.metrics.start()
+        ciphertext = fte.encrypter.Encrypter().encrypt('X')
+        self.assertRaises(fte.encrypter.UnrecoverableDecryptionError,
+                          fte.encrypter.Encrypter(K2='\x01' * 16).decrypt,
+                          ciphertext)
+        self.assertEquals(
+            1, self._getCounter('fte_decrypt_failures_total', ()))
+
+    def testNegotiationOutcomes(self):
+        fte.metrics.start()
+        language = fte.conf.getValue('runtime.state.upstream_language')
+        definition = fte.defs.getDefinition(language)
+        cell = fte.NegotiationManager().makeClientNegotiationCell(
+            fte.encrypter.Encrypter(), definition.regex,
+            definition.fixed_slice, definition.regex, definition.fixed_slice)
+        fte.NegotiationManager().doServerSideNegotiation(
+            fte.encrypter.Encrypter(), cell)
+
+        manager = fte.NegotiationManager()
+        for i in range(2):
+            self.assertRaises(fte.NegotiationFailedException,
+                              manager.doServerSideNegotiation,
+                              fte.encrypter.Encrypter(), '\x00' * 2 ** 12)
+
+        self.assertEquals(1, self._getCounter('fte_negotiations_total',
+                                              (('outcome', 'accepted'),)))
+        self.assertEquals(1, self._getCounter('fte_negotiations_total',
+                                              (('outcome', 'failed'),)))
+
+    def testServePort(self):
+        fte.conf.setValue('runtime.fte.metrics.port', 0)
+        self._server = fte.metrics.start()
+        fte.metrics.increment('fte_relay_connections_total')
+
+        [ip, port] = self._server.getAddress()
+        body = urllib2.urlopen('http://' + ip + ':' + str(port) + '/metrics',
+                               timeout=10).read()
+        self.assertEquals(fte.metrics.export(), body)
+        self.assertTrue('\nfte_relay_connections_total 1\n' in body)
+
+    def testServeUnixSocket(self):
+        path = os.path.join(self._dir, 'metrics.sock')
+        fte.conf.setValue('runtime.fte.metrics.unix_socket', path)
+        self._server = fte.metrics.start()
+        self.assertEquals(path, self._server.getAddress())
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(10)
+        sock.connect(path)
+        sock.sendall('GET /metrics HTTP/1.0\r\n\r\n')
+        response = ''
+        while True:
+            data = sock.recv(2 ** 12)
+            if not data:
+                break
+            response += data
+        sock.close()
+
+        [head, body] = response.split('\r\n\r\n', 1)
+        self.assertTrue(head.startswith('HTTP/1.0 200'))
+        self.assertEquals(fte.metrics.export(), body)
+
+        self._server.stop()
+        self._server = None
+        self.assertFalse(os.path.exists(path))
+
+    def _getRecordLayer(self):
+        language = fte.conf.getValue('runtime.state.upstream_language')
+        regex_encoder = fte.encoder.RegexEncoder(
+            fte.defs.getRegex(language), fte.defs.getFixedSlice(language))
+        encrypter = fte.encrypter.Encrypter()
+        return [fte.record_layer.Encoder(
+                    encrypter=encrypter, encoder=regex_encoder,
+                    framing=fte.record_layer.FRAMING_V2),
+                fte.record_layer.Decoder(
+                    decrypter=encrypter, decoder=regex_encoder,
+                    framing=fte.record_layer.FRAMING_V2)]
+
+    def _roundTrip(self, encoder, decoder, data):
+        encoder.push(data)
+        decoder.push(encoder.pop())
+        retval = ''
+        while True:
+            frag = decoder.pop()
+            if not frag:
+                break
+            retval += frag
+        self.assertEquals(data, retval)
+
+    def _getCounter(self, name, labels):
+        return fte.metrics._counters.get((name, labels), 0)
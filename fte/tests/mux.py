@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import socket
+import unittest
+import threading
+
+import fte
+import fte.conf
+import fte.defs
+import fte.encrypter
+import fte.mux
+import fte.network_io
+import fte.record_layer
+import fte.client
+import fte.server
+
+LOCAL_INTERFACE = '127.0.0.1'
+TIMEOUT = 10
+
+
+class TestFrames(unittest.TestCase):
+
+    def testUnpackPartialFrames(self):
+        frames = [[1, fte.mux.FRAME_OPEN, ''],
+                  [1, fte.mux.FRAME_DATA, 'X' * fte.mux.MAX_FRAME_PAYLOAD],
+                  [2 ** 32 - 1, fte.mux.FRAME_WINDOW, '\x00\x01\x00\x00'],
+                  [1, fte.mux.FRAME_CLOSE, '']]
+        data = ''.join(fte.mux.packFrame(*frame) for frame in frames)
+        for i in range(0, len(data), 97):
+            [head, remaining] = fte.mux.unpackFrames(data[:i])
+            [tail, remaining] = fte.mux.unpackFrames(remaining + data[i:])
+            self.assertEquals('', remaining)
+            self.assertEquals(frames, head + tail)
+
+    def testInvalidFrame(self):
+        self.assertRaises(fte.mux.InvalidFrameException,
+                          fte.mux.unpackFrames, '\x00\x00\x00\x01\x09\x00\x00')
+
+
+class TestNegotiation(unittest.TestCase):
+
+    def testServerMustAcceptMux(self):
+        language = fte.conf.getValue('runtime.state.upstream_language')
+        regex = fte.defs.getRegex(language)
+        fixed_slice = fte.defs.getFixedSlice(language)
+        cell = fte.NegotiationManager().makeClientNegotiationCell(
+            fte.encrypter.Encrypter(), regex, fixed_slice, regex, fixed_slice,
+            fte.record_layer.FRAMING_V1, fte.record_layer.OPTION_MUX)
+
+        self.assertRaises(fte.NegotiationFailedException,
+                          fte.NegotiationManager().doServerSideNegotiation,
+                          fte.encrypter.Encrypter(), cell)
+
+        manager = fte.NegotiationManager(mux=True)
+        manager.doServerSideNegotiation(fte.encrypter.Encrypter(), cell)
+        self.assertEquals(fte.record_layer.OPTION_MUX, manager.getOptions())
+
+
+class TestMux(unittest.TestCase):
+
+    def setUp(self):
+        fte.conf.setValue('runtime.fte.mux.connections', 1)
+        self._sockets = []
+        self._proxy_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._proxy_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._proxy_socket.bind(
+            (LOCAL_INTERFACE, fte.conf.getValue('runtime.proxy.port')))
+        self._proxy_socket.listen(fte.conf.getValue('runtime.fte.relay.backlog'))
+        self._proxy_socket.settimeout(TIMEOUT)
+
+        self._server = fte.server.listener(LOCAL_INTERFACE,
+                                           fte.conf.getValue(
+                                               'runtime.server.port'),
+                                           LOCAL_INTERFACE,
+                                           fte.conf.getValue('runtime.proxy.port'))
+        self._client = fte.client.listener(LOCAL_INTERFACE,
+                                           fte.conf.getValue(
+                                               'runtime.client.port'),
+                                           LOCAL_INTERFACE,
+                                           fte.conf.getValue('runtime.server.port'))
+        self._server.start()
+        self._client.start()
+        time.sleep(0.1)
+
+    def tearDown(self):
+        fte.conf.setValue('runtime.fte.mux.connections', 0)
+        self._client.stop()
+        self._server.stop()
+        for sock in [self._proxy_socket] + self._sockets:
+            fte.network_io.close_socket(sock)
+
+    def testConcurrentStreams(self):
+        num_streams = 16
+        pairs = [self._connect() for i in range(num_streams)]
+
+        for i, [client, server] in enumerate(pairs):
+            server.sendall('server' + str(i))
+            client.sendall(str(i) * 2 ** 12)
+        for i, [client, server] in enumerate(pairs):
+            self.assertEquals('server' + str(i),
+                              self._recvall(client, len('server' + str(i))))
+            self.assertEquals(str(i) * 2 ** 12,
+                              self._recvall(server, len(str(i) * 2 ** 12)))
+
+        self.assertEquals(1, self._client._mux.getNumSessions())
+
+        # closing either side closes the stream
+        [client, server] = pairs[0]
+        fte.network_io.close_socket(client)
+        self.assertEquals('', self._recvall(server, 1))
+
+    def testSlowStreamDoesNotStallSession(self):
+        [slow_client, slow_server] = self._connect()
+
+        # more than the socket buffers between us can hold
+        payload_len = 2 ** 25
+        sender = threading.Thread(target=self._sendall,
+                                  args=(slow_server, 'X' * payload_len))
+        sender.daemon = True
+        sender.start()
+        time.sleep(1)
+        self.assertTrue(sender.is_alive())
+        [session] = self._client._mux._sessions
+        [slow_stream] = session._streams.values()
+        self.assertTrue(slow_stream.getNumQueued() <=
+                        fte.conf.getValue('runtime.fte.mux.window'))
+
+        [client, server] = self._connect()
+        client.sendall('client')
+        self.assertEquals('client', self._recvall(server, len('client')))
+        server.sendall('server')
+        self.assertEquals('server', self._recvall(client, len('server')))
+
+        self.assertEquals(payload_len,
+                          len(self._recvall(slow_client, payload_len)))
+
+    def testMaxStreams(self):
+        fte.conf.setValue('runtime.fte.mux.max_streams', 1)
+        try:
+            [client, server] = self._connect()
+
+            # the server closes the stream, rather than connecting it
+            extra = socket.create_connection(
+                (LOCAL_INTERFACE, fte.conf.getValue('runtime.client.port')),
+                TIMEOUT)
+            self._sockets.append(extra)
+            self.assertEquals('', self._recvall(extra, 1))
+
+            client.sendall('client')
+            self.assertEquals('client', self._recvall(server, len('client')))
+        finally:
+            fte.conf.setValue('runtime.fte.mux.max_streams', 256)
+
+    def _connect(self):
+        client = socket.create_connection(
+            (LOCAL_INTERFACE, fte.conf.getValue('runtime.client.port')),
+            TIMEOUT)
+        self._sockets.append(client)
+        server, addr = self._proxy_socket.accept()
+        server.settimeout(TIMEOUT)
+        self._sockets.append(server)
+        return [client, server]
+
+    def _sendall(self, sock, data):
+        try:
+            sock.sendall(data)
+        except socket.error:
+            pass
+
+    def _recvall(self, sock, n):
+        retval = ''
+        while len(retval) < n:
+            data = sock.recv(n - len(retval))
+            if not data:
+                break
+            retval += data
+        return retval
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+import fte
+import fte.conf
+import fte.bit_ops
+import fte.defs
+import fte.encoder
+import fte.encrypter
+
+
+class TestNegotiationManager(unittest.TestCase):
+
+    def setUp(self):
+        language = fte.conf.getValue('runtime.state.upstream_language')
+        self._regex = fte.defs.getRegex(language)
+        self._fixed_slice = fte.defs.getFixedSlice(language)
+        self._decode = fte.encoder.RegexEncoderObject.decodeWithHint
+        self._num_decodes = 0
+
+        def decodeWithHint(encoder, covertext):
+            self._num_decodes += 1
+            return self._decode(encoder, covertext)
+        fte.encoder.RegexEncoderObject.decodeWithHint = decodeWithHint
+
+    def tearDown(self):
+        fte.encoder.RegexEncoderObject.decodeWithHint = self._decode
+        fte.conf.setValue('runtime.fte.encrypter.keys', None)
+        fte.conf.setValue('runtime.fte.encrypter.key_hint', False)
+
+    def testPartialReads(self):
+        cell = self._makeCell(fte.encrypter.Encrypter())
+        data = cell + 'X' * 16
+
+        manager = fte.NegotiationManager()
+        for i in range(1, len(cell)):
+            self.assertRaises(fte.ChannelNotReadyException,
+                              manager.doServerSideNegotiation,
+                              fte.encrypter.Encrypter(), data[:i])
+        [encoder, decoder] = manager.doServerSideNegotiation(
+            fte.encrypter.Encrypter(), data)
+        self.assertEquals('X' * 16, decoder._buffer)
+
+        # each language's first slice is ranked at most once
+        self.assertTrue(self._num_decodes <=
+                        len(fte.NegotiationManager._getLanguages()))
+
+    def testUnknownKey(self):
+        cell = self._makeCell(fte.encrypter.Encrypter(K1='\x01' * 16))
+
+        manager = fte.NegotiationManager()
+        self.assertRaises(fte.NegotiationFailedException,
+                          manager.doServerSideNegotiation,
+                          fte.encrypter.Encrypter(), cell)
+        self.assertRaises(fte.NegotiationFailedException,
+                          manager.doServerSideNegotiation,
+                          fte.encrypter.Encrypter(), cell + 'X')
+
+    def testKeyHint(self):
+        keys = [fte.bit_ops.random_bytes(32) for i in range(100)]
+        fte.conf.setValue('runtime.fte.encrypter.keys', keys)
+        client_encrypter = fte.encrypter.Encrypter(K1=keys[57][:16],
+                                                   K2=keys[57][16:])
+
+        # without a hint, a client must use the default key
+        cell = self._makeCell(client_encrypter)
+        self.assertRaises(fte.NegotiationFailedException,
+                          fte.NegotiationManager().doServerSideNegotiation,
+                          fte.encrypter.Encrypter(), cell)
+        cell = self._makeCell(fte.encrypter.Encrypter())
+        fte.NegotiationManager().doServerSideNegotiation(
+            fte.encrypter.Encrypter(), cell)
+
+        fte.conf.setValue('runtime.fte.encrypter.key_hint', True)
+        cell = self._makeCell(client_encrypter)
+        [encoder, decoder] = fte.NegotiationManager().doServerSideNegotiation(
+            fte.encrypter.Encrypter(), cell)
+        self.assertEquals(keys[57],
+                          decoder._decrypter.K1 + decoder._decrypter.K2)
+
+    def _makeCell(self, encrypter):
+        return fte.NegotiationManager().makeClientNegotiationCell(
+            encrypter, self._regex, self._fixed_slice,
+            self._regex, self._fixed_slice)
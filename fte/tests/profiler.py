@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import threading
+
+import fte.conf
+import fte.encoder
+import fte.profiler
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self._pid_dir = fte.conf.getValue('general.pid_dir')
+        self._dir = tempfile.mkdtemp()
+        fte.conf.setValue('general.pid_dir', self._dir)
+        fte.conf.setValue('runtime.fte.profiler.interval', 0.001)
+
+    def tearDown(self):
+        fte.profiler.stop()
+        fte.conf.setValue('general.pid_dir', self._pid_dir)
+        fte.conf.setValue('runtime.fte.profiler.interval', 0.005)
+        shutil.rmtree(self._dir)
+
+    def testProfile(self):
+        encoder = fte.encoder.RegexEncoder('^(a|b)+$', 512)
+
+        fte.profiler.start()
+        self.assertTrue(fte.profiler.isRunning())
+        deadline = time.time() + 0.5
+        cells = 0
+        while time.time() < deadline:
+            encoder.decode(encoder.encode('X' * 64))
+            cells += 1
+        [folded, cdfa] = fte.profiler.stop().wait(10)
+        self.assertFalse(fte.profiler.isRunning())
+
+        with open(folded) as f:
+            stacks = [line.rsplit(' ', 1) for line in f]
+        self.assertTrue(stacks)
+        self.assertTrue(all(int(count) > 0 for [stack, count] in stacks))
+        thread = type(threading.current_thread()).__name__
+        self.assertTrue(any(stack.startswith(thread + ';') and
+                            'encoder.encode' in stack
+                            for [stack, count] in stacks))
+        self.assertFalse(any('profiler._sample' in stack
+                             for [stack, count] in stacks))
+
+        with open(cdfa) as f:
+            counters = dict((line.split()[0], line.split()[1:])
+                            for line in f if not line.startswith('#'))
+        self.assertEquals(cells, int(counters['unrank'][0]))
+        self.assertEquals(cells, int(counters['rank'][0]))
+        self.assertTrue(float(counters['unrank'][1]) > 0)
+
+    def testBuild(self):
+        fte.profiler.start()
+        # a format that no other test has built
+        fte.encoder.RegexEncoder(
+            '^(a|b)+' + str(int(time.time() * 1000)) + '$', 128)
+        [folded, cdfa] = fte.profiler.stop().wait(10)
+
+        with open(cdfa) as f:
+            counters = dict((line.split()[0], line.split()[1:])
+                            for line in f if not line.startswith('#'))
+        self.assertEquals(1, int(counters['build'][0]))
+        self.assertTrue(float(counters['build'][1]) > 0)
+
+    def testToggle(self):
+        fte.profiler.toggle()
+        self.assertTrue(fte.profiler.isRunning())
+        fte.profiler.toggle()
+        self.assertFalse(fte.profiler.isRunning())
+        for i in range(100):
+            if len(os.listdir(self._dir)) == 2:
+                break
+            time.sleep(0.1)
+        self.assertEquals(2, len(os.listdir(self._dir)))
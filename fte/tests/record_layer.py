@@ -18,6 +18,7 @@
 
 import unittest
 
+import fte.bit_ops
 import fte.encoder
 import fte.encrypter
 import fte.record_layer
@@ -26,6 +27,14 @@ import fte.record_layer
 START = 0
 ITERATIONS = 2048
 STEP = 64
+FRAMINGS = [
+    (fte.record_layer.FRAMING_V1, 0),
+    (fte.record_layer.FRAMING_V2, 0),
+    (fte.record_layer.FRAMING_V2, fte.record_layer.OPTION_FRACTIONAL_PACKING),
+    (fte.record_layer.FRAMING_V2, fte.record_layer.OPTION_VARIABLE_SLICE),
+    (fte.record_layer.FRAMING_V2, fte.record_layer.OPTION_FRACTIONAL_PACKING |
+     fte.record_layer.OPTION_VARIABLE_SLICE),
+]
 
 
 class TestEncoders(unittest.TestCase):
@@ -42,13 +51,16 @@ class TestEncoders(unittest.TestCase):
             regex = fte.defs.getRegex(language)
             fixed_slice = fte.defs.getFixedSlice(language)
             regex_encoder = fte.encoder.RegexEncoder(regex, fixed_slice)
-            encoder = fte.record_layer.Encoder(
-                encrypter=encrypter, encoder=regex_encoder)
-            decoder = fte.record_layer.Decoder(
-                decrypter=encrypter, decoder=regex_encoder)
-            self.record_layers_info.append(language)
-            self.record_layers_outgoing.append(encoder)
-            self.record_layers_incoming.append(decoder)
+            for framing, options in FRAMINGS:
+                encoder = fte.record_layer.Encoder(
+                    encrypter=encrypter, encoder=regex_encoder,
+                    framing=framing, options=options)
+                decoder = fte.record_layer.Decoder(
+                    decrypter=encrypter, decoder=regex_encoder,
+                    framing=framing, options=options)
+                self.record_layers_info.append((language, framing, options))
+                self.record_layers_outgoing.append(encoder)
+                self.record_layers_incoming.append(decoder)
 
     def testReclayer_basic(self):
         for i in range(len(self.record_layers_outgoing)):
@@ -95,6 +107,95 @@ class TestEncoders(unittest.TestCase):
                     Y += data
                 self.assertEquals(ptxt, Y, self.record_layers_info[i])
 
+    def testReclayer_framingV2IsSmaller(self):
+        encrypter = fte.encrypter.Encrypter()
+        definitions = fte.defs.load_definitions()
+        for language in definitions.keys():
+            regex = fte.defs.getRegex(language)
+            fixed_slice = fte.defs.getFixedSlice(language)
+            regex_encoder = fte.encoder.RegexEncoder(regex, fixed_slice)
+            covertext_len = {}
+            for framing in fte.record_layer.SUPPORTED_FRAMINGS:
+                encoder = fte.record_layer.Encoder(
+                    encrypter=encrypter, encoder=regex_encoder,
+                    framing=framing)
+                encoder.push('X' * 1024)
+                covertext_len[framing] = len(encoder.pop())
+            self.assertEquals(covertext_len[fte.record_layer.FRAMING_V1] - 16,
+                              covertext_len[fte.record_layer.FRAMING_V2],
+                              language)
+
+    def testReclayer_fractionalPacking(self):
+        encrypter = fte.encrypter.Encrypter()
+        definitions = fte.defs.load_definitions()
+        for language in definitions.keys():
+            regex = fte.defs.getRegex(language)
+            fixed_slice = fte.defs.getFixedSlice(language)
+            regex_encoder = fte.encoder.RegexEncoder(regex, fixed_slice)
+            num_cells = 8
+            P = fte.bit_ops.random_bytes(
+                fte.record_layer.MAX_CELL_SIZE * (num_cells - 1) + 1024)
+            covertext = {}
+            for options in [0, fte.record_layer.OPTION_FRACTIONAL_PACKING]:
+                encoder = fte.record_layer.Encoder(
+                    encrypter=encrypter, encoder=regex_encoder,
+                    framing=fte.record_layer.FRAMING_V2, options=options)
+                encoder.push(P)
+                covertext[options] = encoder.pop()
+
+                # deliver the run in pieces, so that cells are decoded before
+                # the last cell of the run has arrived
+                decoder = fte.record_layer.Decoder(
+                    decrypter=encrypter, decoder=regex_encoder,
+                    framing=fte.record_layer.FRAMING_V2, options=options)
+                Y = ''
+                for i in range(0, len(covertext[options]), 4096):
+                    decoder.push(covertext[options][i:i + 4096])
+                    Y += decoder.pop()
+                self.assertEquals(P, Y, language)
+
+            carried = fte.record_layer._getCarriedBytes(
+                regex_encoder.getRadix(), num_cells - 1)
+            self.assertEquals(
+                len(covertext[0]) - carried,
+                len(covertext[fte.record_layer.OPTION_FRACTIONAL_PACKING]),
+                language)
+
+
+    def testReclayer_variableSlice(self):
+        encrypter = fte.encrypter.Encrypter()
+        definitions = fte.defs.load_definitions()
+        for language in definitions.keys():
+            regex = fte.defs.getRegex(language)
+            fixed_slice = fte.defs.getFixedSlice(language)
+            regex_encoder = fte.encoder.RegexEncoder(regex, fixed_slice)
+            slices = regex_encoder.getSlices()
+            encoder = fte.record_layer.Encoder(
+                encrypter=encrypter, encoder=regex_encoder,
+                framing=fte.record_layer.FRAMING_V2,
+                options=fte.record_layer.OPTION_VARIABLE_SLICE)
+            decoder = fte.record_layer.Decoder(
+                decrypter=encrypter, decoder=regex_encoder,
+                framing=fte.record_layer.FRAMING_V2,
+                options=fte.record_layer.OPTION_VARIABLE_SLICE)
+
+            # a run of short cells, each on a different rung of the ladder,
+            # delivered one byte at a time
+            covertext = ''
+            P = []
+            for fixed_slice in slices:
+                payload_len = regex_encoder.getMaximumBytesToRank(
+                    fixed_slice) - fte.encrypter.Encrypter._CTXT_EXPANSION
+                P.append(fte.bit_ops.random_bytes(max(0, payload_len)))
+                encoder.push(P[-1])
+                cell = encoder.pop()
+                self.assertEquals(len(cell), fixed_slice, language)
+                covertext += cell
+            Y = ''
+            for c in covertext:
+                decoder.push(c)
+                Y += decoder.pop()
+            self.assertEquals(''.join(P), Y, language)
 
 if __name__ == '__main__':
     unittest.main()
@@ -21,8 +21,13 @@ import time
 import socket
 import random
 import unittest
+import threading
 import traceback
 
+import fte
+import fte.conf
+import fte.defs
+import fte.encrypter
 import fte.network_io
 import fte.relay
 import fte.client
@@ -61,6 +66,89 @@ class TestRelay(unittest.TestCase):
         for i in range(100):
             self._testStream()
 
+    def testOneStreamFramingV2(self):
+        framing = fte.conf.getValue('runtime.fte.record_layer.framing')
+        fte.conf.setValue('runtime.fte.record_layer.framing',
+                          fte.record_layer.FRAMING_V2)
+        try:
+            self._testStream()
+        finally:
+            fte.conf.setValue('runtime.fte.record_layer.framing', framing)
+
+    def testOneStreamVariableSlice(self):
+        framing = fte.conf.getValue('runtime.fte.record_layer.framing')
+        fte.conf.setValue('runtime.fte.record_layer.framing',
+                          fte.record_layer.FRAMING_V2)
+        fte.conf.setValue('runtime.fte.record_layer.variable_slice', True)
+        try:
+            self._testStream()
+        finally:
+            fte.conf.setValue('runtime.fte.record_layer.framing', framing)
+            fte.conf.setValue('runtime.fte.record_layer.variable_slice',
+                              False)
+
+    def testOneStreamFractionalPacking(self):
+        framing = fte.conf.getValue('runtime.fte.record_layer.framing')
+        fte.conf.setValue('runtime.fte.record_layer.framing',
+                          fte.record_layer.FRAMING_V2)
+        fte.conf.setValue('runtime.fte.record_layer.fractional_packing', True)
+        try:
+            self._testStream()
+        finally:
+            fte.conf.setValue('runtime.fte.record_layer.framing', framing)
+            fte.conf.setValue('runtime.fte.record_layer.fractional_packing',
+                              False)
+
+    def testConcurrentStreams(self):
+        num_streams = 16
+        proxy_socket = None
+        client_sockets = []
+        server_conns = []
+        try:
+            proxy_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            proxy_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            proxy_socket.bind(
+                (LOCAL_INTERFACE, fte.conf.getValue('runtime.proxy.port')))
+            proxy_socket.listen(fte.conf.getValue('runtime.fte.relay.backlog'))
+
+            for i in range(num_streams):
+                client_socket = socket.create_connection(
+                    (LOCAL_INTERFACE, fte.conf.getValue('runtime.client.port')))
+                client_socket.settimeout(5)
+                client_sockets.append(client_socket)
+                server_conn, addr = proxy_socket.accept()
+                server_conn.settimeout(5)
+                server_conns.append(server_conn)
+
+            # the server speaks first, before the fteproxy server has
+            # received the negotiation cell of the fteproxy client
+            for i in range(num_streams):
+                server_conns[i].sendall('server' + str(i))
+            for i in range(num_streams):
+                self.assertEquals('server' + str(i),
+                                  self._recvall(client_sockets[i],
+                                                len('server' + str(i))))
+
+            for i in range(num_streams):
+                client_sockets[i].sendall(str(i) * 2 ** 12)
+            for i in range(num_streams):
+                self.assertEquals(str(i) * 2 ** 12,
+                                  self._recvall(server_conns[i],
+                                                len(str(i) * 2 ** 12)))
+        finally:
+            for sock in [proxy_socket] + client_sockets + server_conns:
+                if sock:
+                    fte.network_io.close_socket(sock)
+
+    def _recvall(self, sock, n):
+        retval = ''
+        while len(retval) < n:
+            data = sock.recv(n - len(retval))
+            if not data:
+                break
+            retval += data
+        return retval
+
     def _testStream(self):
         uniq_id = str(random.choice(range(2 ** 10)))
         expected_msg = 'Hello, world' * 100 + uniq_id
@@ -110,5 +198,418 @@ class TestRelay(unittest.TestCase):
             self.assertEquals(expected_msg, actual_msg)
 
 
+
+class blockingListener(fte.relay.listener):
+
+    """Blocks in ``onNewOutgoingConnection`` for the first connection, until
+    ``unblock`` is set.
+    """
+
+    def __init__(self, *args):
+        fte.relay.listener.__init__(self, *args)
+        self.unblock = threading.Event()
+        self._first = True
+
+    def onNewOutgoingConnection(self, socket):
+        if self._first:
+            self._first = False
+            self.unblock.wait()
+        return socket
+
+
+class TestListener(unittest.TestCase):
+
+    def setUp(self):
+        self._listener = None
+        self._sockets = []
+        self._proxy_socket = self._listen(
+            fte.conf.getValue('runtime.proxy.port'))
+
+    def tearDown(self):
+        if self._listener is not None:
+            self._listener.unblock.set()
+            self._listener.stop()
+        fte.conf.setValue('runtime.fte.relay.pool.size', 0)
+        for sock in [self._proxy_socket] + self._sockets:
+            fte.network_io.close_socket(sock)
+
+    def testSlowConnectDoesNotBlockAccepts(self):
+        self._startListener()
+        first = self._connect()
+        first_conn = self._accept()
+        second = self._connect()
+        second_conn = self._accept()
+
+        # the first connection is still being established
+        second.sendall('second')
+        self.assertEquals('second', self._recvall(second_conn, len('second')))
+
+        first.sendall('first')
+        self._listener.unblock.set()
+        self.assertEquals('first', self._recvall(first_conn, len('first')))
+
+    def testPool(self):
+        fte.conf.setValue('runtime.fte.relay.pool.size', 2)
+        self._startListener()
+        self._listener.unblock.set()
+        pooled = [self._accept(), self._accept()]
+
+        # a pooled connection is used, and the pool is topped up
+        client = self._connect()
+        client.sendall('pooled')
+        self.assertTrue('pooled' in [self._recvall(conn, len('pooled'), 1)
+                                     for conn in pooled])
+        self._accept()
+
+    def testPoolDiscardsClosedConnections(self):
+        fte.conf.setValue('runtime.fte.relay.pool.size', 1)
+        self._startListener()
+        self._listener.unblock.set()
+        fte.network_io.close_socket(self._accept())
+        time.sleep(0.1)
+
+        # the closed connection is discarded, we connect and top up the pool
+        client = self._connect()
+        client.sendall('replacement')
+        received = [self._recvall(conn, len('replacement'), 1)
+                    for conn in [self._accept(), self._accept()]]
+        self.assertTrue('replacement' in received)
+
+    def testStopJoinsThreads(self):
+        fte.conf.setValue('runtime.fte.relay.pool.size', 1)
+        self._startListener()
+        self._listener.unblock.set()
+        self._accept()
+        self._listener.stop()
+        for thread in self._listener._connectors + [self._listener._pool]:
+            self.assertFalse(thread.is_alive())
+
+    def testEventLoopBackpressure(self):
+        engine = fte.conf.getValue('runtime.fte.relay.engine')
+        fte.conf.setValue('runtime.fte.relay.engine', 'eventloop')
+        try:
+            self._startListener()
+            self._listener.unblock.set()
+            client = self._connect()
+            conn = self._accept()
+
+            # more than the socket buffers between us can hold
+            payload_len = 2 ** 26
+            sender = threading.Thread(target=self._sendall,
+                                      args=(conn, 'X' * payload_len))
+            sender.daemon = True
+            sender.start()
+            time.sleep(1)
+
+            # the sender is blocked, rather than queued by the relay
+            self.assertTrue(sender.is_alive())
+            [loop] = self._listener._eventloops
+            queued = max(endpoint.queued
+                         for endpoint in list(loop._endpoints.values()))
+            self.assertTrue(queued <= fte.conf.getValue(
+                'runtime.fte.relay.high_watermark') +
+                fte.relay._EVENTLOOP_BUFSIZE)
+
+            self.assertEquals(payload_len,
+                              len(self._recvall(client, payload_len)))
+        finally:
+            fte.conf.setValue('runtime.fte.relay.engine', engine)
+
+    def _sendall(self, sock, data):
+        try:
+            sock.sendall(data)
+        except socket.error:
+            pass
+
+    def _startListener(self):
+        self._listener = blockingListener(
+            LOCAL_INTERFACE, fte.conf.getValue('runtime.client.port'),
+            LOCAL_INTERFACE, fte.conf.getValue('runtime.proxy.port'))
+        self._listener.start()
+        time.sleep(0.1)
+
+    def _listen(self, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((LOCAL_INTERFACE, port))
+        sock.listen(fte.conf.getValue('runtime.fte.relay.backlog'))
+        sock.settimeout(5)
+        return sock
+
+    def _connect(self):
+        sock = socket.create_connection(
+            (LOCAL_INTERFACE, fte.conf.getValue('runtime.client.port')), 5)
+        self._sockets.append(sock)
+        return sock
+
+    def _accept(self):
+        conn, addr = self._proxy_socket.accept()
+        conn.settimeout(5)
+        self._sockets.append(conn)
+        return conn
+
+    def _recvall(self, sock, n, timeout=5):
+        sock.settimeout(timeout)
+        retval = ''
+        try:
+            while len(retval) < n:
+                data = sock.recv(n - len(retval))
+                if not data:
+                    break
+                retval += data
+        except socket.timeout:
+            pass
+        return retval
+
+
+class TestRelayEventLoop(TestRelay):
+
+    def setUp(self):
+        self._engine = fte.conf.getValue('runtime.fte.relay.engine')
+        fte.conf.setValue('runtime.fte.relay.engine', 'eventloop')
+        TestRelay.setUp(self)
+
+    def tearDown(self):
+        TestRelay.tearDown(self)
+        fte.conf.setValue('runtime.fte.relay.engine', self._engine)
+
+    def testEventLoopsStarted(self):
+        self._testStream()
+        self.assertEquals(len(self._server._eventloops), 1)
+        self.assertEquals(len(self._client._eventloops), 1)
+
+class TestEventLoopNegotiation(unittest.TestCase):
+
+    def setUp(self):
+        self._timeout = fte.conf.getValue('runtime.fte.negotiate.timeout')
+        self._max_buffer = fte.conf.getValue('runtime.fte.negotiate.max_buffer')
+        self._loop = fte.relay.eventloop()
+        self._loop.start()
+        # the client's end of an fteproxy connection, and the proxy's end of
+        # the connection the server relays it to
+        [self._client, server] = socket.socketpair()
+        [self._proxy, relayed] = socket.socketpair()
+        self._server = fte.wrap_socket(server, mux=True)
+        self._relayed = relayed
+        for sock in [self._client, self._proxy]:
+            sock.settimeout(5)
+
+    def tearDown(self):
+        self._loop.stop()
+        self._loop.join()
+        fte.conf.setValue('runtime.fte.negotiate.timeout', self._timeout)
+        fte.conf.setValue('runtime.fte.negotiate.max_buffer', self._max_buffer)
+        for sock in [self._client, self._proxy]:
+            fte.network_io.close_socket(sock)
+
+    def testNegotiateDeadline(self):
+        # a byte at a time doesn't extend a blocking negotiate's deadline
+        # either
+        cell = self._getNegotiationCell()
+
+        def dribble():
+            try:
+                for i in range(8):
+                    self._client.sendall(cell[i])
+                    time.sleep(0.25)
+            except socket.error:
+                pass
+        sender = threading.Thread(target=dribble)
+        sender.start()
+        start = time.time()
+        try:
+            self.assertRaises(fte.NegotiateTimeoutException,
+                              self._server.negotiate, 1)
+            self.assertTrue(time.time() - start < 1.5)
+        finally:
+            sender.join()
+            fte.network_io.close_socket(self._server)
+            fte.network_io.close_socket(self._relayed)
+
+    def testNegotiationFailure(self):
+        self._loop.addConnection(self._server, self._relayed)
+        self._client.sendall('\xff' * 2 ** 12)
+        self.assertEquals('', self._proxy.recv(1))
+        self.assertEquals(0, self._loop.getNumConnections())
+
+    def testMaxBuffer(self):
+        fte.conf.setValue('runtime.fte.negotiate.max_buffer', 8)
+        self._loop.addConnection(self._server, self._relayed)
+        # a valid prefix of a negotiation cell, that's too long
+        self._client.sendall(self._getNegotiationCell()[:16])
+        self.assertEquals('', self._proxy.recv(1))
+        self.assertEquals(0, self._loop.getNumConnections())
+
+    def testNegotiationTimeout(self):
+        fte.conf.setValue('runtime.fte.negotiate.timeout', 1)
+        self._loop.addConnection(self._server, self._relayed)
+        # a valid negotiation cell, a byte at a time, doesn't extend the
+        # deadline
+        cell = self._getNegotiationCell()
+        start = time.time()
+        for i in range(3):
+            self._client.sendall(cell[i])
+            time.sleep(0.25)
+        self.assertEquals('', self._proxy.recv(1))
+        self.assertTrue(time.time() - start < 3)
+        self.assertEquals(0, self._loop.getNumConnections())
+
+    def _getNegotiationCell(self):
+        definition = fte.defs.getDefinition(
+            fte.conf.getValue('runtime.state.upstream_language'))
+        return fte.NegotiationManager().makeClientNegotiationCell(
+            fte.encrypter.Encrypter(), definition.regex,
+            definition.fixed_slice, definition.regex, definition.fixed_slice)
+
+
+class TestServerNegotiation(unittest.TestCase):
+
+    def setUp(self):
+        self._threads = fte.conf.getValue('runtime.fte.relay.connect.threads')
+        fte.conf.setValue('runtime.fte.relay.connect.threads', 1)
+        self._server = fte.server.listener(
+            LOCAL_INTERFACE, fte.conf.getValue('runtime.server.port'),
+            LOCAL_INTERFACE, fte.conf.getValue('runtime.proxy.port'))
+        self._client = fte.client.listener(
+            LOCAL_INTERFACE, fte.conf.getValue('runtime.client.port'),
+            LOCAL_INTERFACE, fte.conf.getValue('runtime.server.port'))
+        self._server.start()
+        self._client.start()
+        self._sockets = []
+        time.sleep(0.1)
+
+    def tearDown(self):
+        for sock in self._sockets:
+            fte.network_io.close_socket(sock)
+        self._server.stop()
+        self._client.stop()
+        fte.conf.setValue('runtime.fte.relay.connect.threads', self._threads)
+
+    def testIdleClients(self):
+        # clients that never negotiate don't hold our one connector thread
+        for i in range(4):
+            self._sockets.append(self._connect('runtime.server.port'))
+        time.sleep(0.1)
+        self.assertEquals(4, self._server._negotiator.getNumPending())
+
+        proxy_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        proxy_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        proxy_socket.bind(
+            (LOCAL_INTERFACE, fte.conf.getValue('runtime.proxy.port')))
+        proxy_socket.listen(1)
+        proxy_socket.settimeout(2)
+        self._sockets.append(proxy_socket)
+        client_socket = self._connect('runtime.client.port')
+        self._sockets.append(client_socket)
+        server_conn, addr = proxy_socket.accept()
+        server_conn.settimeout(2)
+        self._sockets.append(server_conn)
+
+        client_socket.sendall('Hello, world')
+        actual = ''
+        while len(actual) < len('Hello, world'):
+            actual += server_conn.recv(1024)
+        self.assertEquals('Hello, world', actual)
+
+    def testNegotiationFailure(self):
+        sock = self._connect('runtime.server.port')
+        self._sockets.append(sock)
+        sock.sendall('\xff' * 2 ** 12)
+        self.assertEquals('', sock.recv(1))
+        self.assertEquals(0, self._server._negotiator.getNumPending())
+
+    def _connect(self, port):
+        sock = socket.create_connection(
+            (LOCAL_INTERFACE, fte.conf.getValue(port)))
+        sock.settimeout(2)
+        return sock
+
+class TestClientPool(unittest.TestCase):
+
+    def setUp(self):
+        self._conf = {}
+        for key in ['runtime.fte.relay.pool.size',
+                    'runtime.fte.negotiate.timeout']:
+            self._conf[key] = fte.conf.getValue(key)
+        fte.conf.setValue('runtime.fte.relay.pool.size', 1)
+        fte.conf.setValue('runtime.fte.negotiate.timeout', 0.5)
+        # negotiate once now, such that the encoders of the client and the
+        # server are built before the timeouts start
+        [client, server] = socket.socketpair()
+        try:
+            outgoing = fte.defs.getDefinition(
+                fte.conf.getValue('runtime.state.upstream_language'))
+            incoming = fte.defs.getDefinition(
+                fte.conf.getValue('runtime.state.downstream_language'))
+            fte.wrap_socket(client, outgoing.regex, outgoing.fixed_slice,
+                            incoming.regex, incoming.fixed_slice).send('')
+            fte.wrap_socket(server, mux=True).negotiate(10)
+        finally:
+            client.close()
+            server.close()
+
+        # the connections our client makes to the server
+        self._connects = []
+        self._connect = fte.relay._connect
+
+        def connect(remote_ip, remote_port):
+            if remote_port == fte.conf.getValue('runtime.server.port'):
+                self._connects.append(remote_port)
+            return self._connect(remote_ip, remote_port)
+        fte.relay._connect = connect
+
+        self._proxy_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._proxy_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR,
+                                      1)
+        self._proxy_socket.bind(
+            (LOCAL_INTERFACE, fte.conf.getValue('runtime.proxy.port')))
+        self._proxy_socket.listen(8)
+        self._proxy_socket.settimeout(5)
+        self._sockets = [self._proxy_socket]
+
+        self._server = fte.server.listener(
+            LOCAL_INTERFACE, fte.conf.getValue('runtime.server.port'),
+            LOCAL_INTERFACE, fte.conf.getValue('runtime.proxy.port'))
+        self._client = fte.client.listener(
+            LOCAL_INTERFACE, fte.conf.getValue('runtime.client.port'),
+            LOCAL_INTERFACE, fte.conf.getValue('runtime.server.port'))
+        self._server.start()
+        self._client.start()
+
+    def tearDown(self):
+        self._client.stop()
+        self._server.stop()
+        fte.relay._connect = self._connect
+        for key, value in self._conf.items():
+            fte.conf.setValue(key, value)
+        for sock in self._sockets:
+            fte.network_io.close_socket(sock)
+
+    def testPooledSocketAfterNegotiationTimeout(self):
+        # the pooled socket has negotiated, so the server keeps it past its
+        # negotiation timeout
+        time.sleep(1.5)
+        self.assertEquals(1, len(self._connects))
+        self.assertEquals(1, self._client._pool.getNumIdle())
+
+        client_socket = socket.create_connection(
+            (LOCAL_INTERFACE, fte.conf.getValue('runtime.client.port')), 5)
+        self._sockets.append(client_socket)
+        # the server connected to the proxy when the pooled socket
+        # negotiated
+        server_conn, addr = self._proxy_socket.accept()
+        server_conn.settimeout(5)
+        self._sockets.append(server_conn)
+
+        client_socket.sendall('pooled')
+        actual = ''
+        while len(actual) < len('pooled'):
+            actual += server_conn.recv(1024)
+        self.assertEquals('pooled', actual)
+
+        # the pooled socket was used, then the pool topped up
+        time.sleep(0.5)
+        self.assertEquals(2, len(self._connects))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import signal
+import socket
+import unittest
+import threading
+
+import fte.conf
+import fte.relay
+import fte.supervisor
+
+LOCAL_INTERFACE = '127.0.0.1'
+NUM_WORKERS = 2
+TIMEOUT = 10
+
+
+def sleepForever():
+    while True:
+        time.sleep(1)
+
+
+def isAlive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    # orphans may linger as zombies, if nothing reaps them
+    try:
+        with open('/proc/' + str(pid) + '/stat') as f:
+            return f.read().split(')')[-1].split()[0] != 'Z'
+    except IOError:
+        return True
+
+
+def waitFor(condition):
+    start = time.time()
+    while not condition():
+        if time.time() - start > TIMEOUT:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+@unittest.skipIf(not fte.supervisor.supported(), 'fork is not supported')
+class TestSupervisor(unittest.TestCase):
+
+    def setUp(self):
+        self._supervisor = fte.supervisor.supervisor(sleepForever,
+                                                     NUM_WORKERS)
+        self._thread = threading.Thread(target=self._supervisor.run)
+        self._thread.daemon = True
+        self._thread.start()
+        self.assertTrue(waitFor(
+            lambda: len(self._supervisor.getPids()) == NUM_WORKERS))
+
+    def tearDown(self):
+        self._supervisor.stop()
+        self._thread.join(TIMEOUT)
+
+    def testStop(self):
+        pids = self._supervisor.getPids()
+        self._supervisor.stop()
+        self._thread.join(TIMEOUT)
+        self.assertFalse(self._thread.is_alive())
+        self.assertEquals([], self._supervisor.getPids())
+        for pid in pids:
+            self.assertFalse(isAlive(pid))
+
+    def testRestart(self):
+        pids = self._supervisor.getPids()
+        os.kill(pids[0], signal.SIGKILL)
+        self.assertTrue(waitFor(
+            lambda: len(self._supervisor.getPids()) == NUM_WORKERS and
+            pids[0] not in self._supervisor.getPids()))
+        self.assertTrue(pids[1] in self._supervisor.getPids())
+
+    def testOrphanedWorkersExit(self):
+        # our supervisor would reap the supervisor we fork
+        self._supervisor.stop()
+        self._thread.join(TIMEOUT)
+
+        [reader, writer] = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(reader)
+
+                def onChange(pids):
+                    if len(pids) == NUM_WORKERS:
+                        os.write(writer, ' '.join(map(str, pids)) + '\n')
+                fte.supervisor.supervisor(sleepForever, NUM_WORKERS,
+                                          onChange).run()
+            finally:
+                os._exit(0)
+
+        os.close(writer)
+        with os.fdopen(reader) as f:
+            worker_pids = map(int, f.readline().split())
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+        self.assertEquals(NUM_WORKERS, len(worker_pids))
+        self.assertTrue(waitFor(
+            lambda: not any(map(isAlive, worker_pids))))
+
+
+@unittest.skipIf(not fte.relay.reuse_port_supported(),
+                 'SO_REUSEPORT is not supported')
+class TestReusePort(unittest.TestCase):
+
+    def testSharedPort(self):
+        reuse_port = fte.conf.getValue('runtime.fte.relay.reuse_port')
+        fte.conf.setValue('runtime.fte.relay.reuse_port', True)
+        port = fte.conf.getValue('runtime.server.port')
+        listeners = [fte.relay.listener(LOCAL_INTERFACE, port,
+                                        LOCAL_INTERFACE,
+                                        fte.conf.getValue('runtime.proxy.port'))
+                     for i in range(NUM_WORKERS)]
+        try:
+            for listener in listeners:
+                listener.start()
+            time.sleep(0.1)
+            for listener in listeners:
+                self.assertTrue(listener.is_alive())
+            conn = socket.create_connection((LOCAL_INTERFACE, port), TIMEOUT)
+            conn.close()
+        finally:
+            fte.conf.setValue('runtime.fte.relay.reuse_port', reuse_port)
+            for listener in listeners:
+                listener.stop()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import socket
+import shutil
+import tempfile
+import unittest
+
+import fte
+import fte.conf
+import fte.defs
+import fte.trace
+
+
+class TestTrace(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._dir, 'trace')
+        fte.conf.setValue('runtime.fte.trace.file', self._path)
+        fte.conf.setValue('runtime.fte.trace.rate', 1.0)
+
+    def tearDown(self):
+        fte.trace.stop()
+        fte.conf.setValue('runtime.fte.trace.file', None)
+        fte.conf.setValue('runtime.fte.trace.rate', 0.01)
+        fte.conf.setValue('runtime.fte.trace.format', 'jsonl')
+        shutil.rmtree(self._dir)
+
+    def testFormats(self):
+        traces = []
+        for i, direction in enumerate(fte.trace.DIRECTIONS):
+            trace = fte.trace.CellTrace(direction, 'format-' + str(i), i)
+            start = fte.trace.now()
+            for stage in fte.trace.STAGES:
+                trace.add(stage, start, start + 0.001)
+                start += 0.002
+            traces.append(trace)
+
+        for trace_format in fte.trace.FORMATS:
+            fte.conf.setValue('runtime.fte.trace.format', trace_format)
+            fte.trace.start()
+            fte.trace.write(traces)
+            fte.trace.write(traces[:1])
+            fte.trace.stop()
+            # we write times on the monotonic clock as wall-clock times
+            offset = fte.trace._wall_anchor - fte.trace._monotonic_anchor
+
+            read = list(fte.trace.read(self._path))
+            self.assertEquals(3, len(read))
+            for expected, actual in zip(traces + traces[:1], read):
+                self.assertEquals(expected.direction, actual.direction)
+                self.assertEquals(expected.format, actual.format)
+                self.assertEquals(expected.length, actual.length)
+                self.assertEquals(len(expected.stages), len(actual.stages))
+                for [stage, start, end], [actual_stage, actual_start,
+                                          actual_end] in zip(expected.stages,
+                                                             actual.stages):
+                    self.assertEquals(stage, actual_stage)
+                    self.assertAlmostEquals(start + offset, actual_start,
+                                            places=5)
+                    self.assertAlmostEquals(end + offset, actual_end, places=5)
+
+    def testCellStages(self):
+        started = time.time()
+        fte.trace.start()
+        [client, server] = self._wrapSocketPair()
+        data = 'X' * 2 ** 16
+        client.sendall(data)
+        received = ''
+        while len(received) < len(data):
+            received += server.recv(len(data) - len(received))
+        self.assertEquals(data, received)
+        client.close()
+        server.close()
+        fte.trace.stop()
+        stopped = time.time()
+
+        language = fte.conf.getValue('runtime.state.upstream_language')
+        traces = list(fte.trace.read(self._path))
+        encoded = [t for t in traces if t.direction == 'encode']
+        decoded = [t for t in traces if t.direction == 'decode']
+        self.assertEquals(len(encoded), len(decoded))
+        self.assertEquals(len(data), sum(t.length for t in encoded))
+        self.assertEquals(len(data), sum(t.length for t in decoded))
+        for trace in encoded:
+            self.assertEquals(language, trace.format)
+            self.assertEquals(['queue', 'encrypt', 'unrank', 'write'],
+                              [stage for [stage, start, end] in trace.stages])
+        for trace in decoded:
+            self.assertEquals(['rank', 'decrypt'],
+                              [stage for [stage, start, end] in trace.stages
+                               if stage != 'queue'])
+        for trace in traces:
+            for [stage, start, end] in trace.stages:
+                self.assertTrue(started <= start <= end <= stopped)
+
+    def testNotSampled(self):
+        fte.conf.setValue('runtime.fte.trace.rate', 0.0)
+        fte.trace.start()
+        [client, server] = self._wrapSocketPair()
+        client.sendall('X' * 1024)
+        self.assertEquals('X' * 1024, server.recv(1024))
+        client.close()
+        server.close()
+        fte.trace.stop()
+
+        self.assertEquals([], list(fte.trace.read(self._path)))
+
+    def _wrapSocketPair(self):
+        [client, server] = socket.socketpair()
+        language = fte.conf.getValue('runtime.state.upstream_language')
+        outgoing = fte.defs.getDefinition(language)
+        incoming = fte.defs.getDefinition(
+            fte.conf.getValue('runtime.state.downstream_language'))
+        client = fte.wrap_socket(client,
+                                 outgoing.regex, outgoing.fixed_slice,
+                                 incoming.regex, incoming.fixed_slice)
+        server = fte.wrap_socket(server)
+        return [client, server]
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import time
+import unittest
+import subprocess
+
+import fte.conf
+
+
+class TestTransport(unittest.TestCase):
+
+    def testImportDoesNotLoadTwisted(self):
+        code = ('import sys; import fte, fte.client, fte.server, fte.warmup; '
+                'sys.exit(int(any(name.split(".")[0] in ["twisted", '
+                '"obfsproxy"] for name in sys.modules)))')
+        self.assertEquals(0, subprocess.call(
+            [sys.executable, '-c', code],
+            cwd=fte.conf.getValue('general.base_dir')))
+
+    def testTransport(self):
+        import fte.transport
+        import obfsproxy.transports.base
+
+        for transport_class in [fte.transport.FTETransportClient,
+                                fte.transport.FTETransportServer]:
+            self.assertTrue(issubclass(transport_class,
+                                       obfsproxy.transports.base.BaseTransport))
+        self.assertRaises(fte.InvalidRoleException,
+                          fte.transport.launch_transport_listener,
+                          'fte', None, 'unknown', None, None)
+
+    def testRelay(self):
+        for threads in [0, 2]:
+            fte.conf.setValue('runtime.fte.transport.threads', threads)
+            try:
+                self._testRelay()
+            finally:
+                self._stopThreadPool()
+
+    def testFlushOnNegotiation(self):
+        import obfsproxy.network.buffer
+
+        for threads in [0, 2]:
+            fte.conf.setValue('runtime.fte.transport.threads', threads)
+            try:
+                [client, server, client_circuit, server_circuit] = \
+                    self._getTransports()
+
+                # the server buffers what it sends until the client's
+                # negotiation cell arrives, then sends it without another
+                # write
+                server.receivedUpstream(
+                    obfsproxy.network.buffer.Buffer('server'), server_circuit)
+                self._iterate(lambda: server._preNegotiationBuffer_outgoing)
+                self.assertEquals([], server_circuit.downstream.written)
+                server.receivedDownstream(obfsproxy.network.buffer.Buffer(
+                    client.encode('')), server_circuit)
+                self._iterate(lambda: server_circuit.downstream.written)
+                self.assertEquals('server', client.decode(
+                    ''.join(server_circuit.downstream.written)))
+            finally:
+                self._stopThreadPool()
+
+    def testRelayFailure(self):
+        import obfsproxy.network.buffer
+
+        fte.conf.setValue('runtime.fte.transport.threads', 2)
+        try:
+            [client, server, client_circuit, server_circuit] = \
+                self._getTransports()
+
+            def decode(data):
+                raise ValueError()
+            server.decode = decode
+            server.receivedDownstream(obfsproxy.network.buffer.Buffer(
+                client.encode('')), server_circuit)
+            self._iterate(lambda: server_circuit.closed)
+            self.assertTrue(server_circuit.closed)
+            self.assertEquals([], server_circuit.upstream.written)
+        finally:
+            self._stopThreadPool()
+
+    def _testRelay(self):
+        import obfsproxy.network.buffer
+
+        [client, server, client_circuit, server_circuit] = \
+            self._getTransports()
+        client_circuit.downstream.receiver = \
+            lambda data: server.receivedDownstream(
+                obfsproxy.network.buffer.Buffer(data), server_circuit)
+        server_circuit.downstream.receiver = \
+            lambda data: client.receivedDownstream(
+                obfsproxy.network.buffer.Buffer(data), client_circuit)
+
+        # in order, however many cells each write is encoded and decoded in
+        for [transport, circuit, peer_circuit] in [
+                [client, client_circuit, server_circuit],
+                [server, server_circuit, client_circuit]]:
+            chunks = [str(i) * (i * 1024) for i in range(10)]
+            for chunk in chunks:
+                transport.receivedUpstream(
+                    obfsproxy.network.buffer.Buffer(chunk), circuit)
+            self._iterate(lambda: len(''.join(peer_circuit.upstream.written))
+                          >= len(''.join(chunks)))
+            self.assertEquals(''.join(chunks),
+                              ''.join(peer_circuit.upstream.written))
+        self.assertFalse(client_circuit.closed)
+        self.assertFalse(server_circuit.closed)
+
+    def _getTransports(self):
+        import fte.transport
+
+        mode = fte.conf.getValue('runtime.mode')
+        try:
+            fte.conf.setValue('runtime.mode', 'client')
+            client = fte.transport.FTETransportClient(None)
+            fte.conf.setValue('runtime.mode', 'server')
+            server = fte.transport.FTETransportServer(None)
+        finally:
+            fte.conf.setValue('runtime.mode', mode)
+        return [client, server, _circuit(), _circuit()]
+
+    def _iterate(self, done, timeout=30):
+        import twisted.internet
+
+        deadline = time.time() + timeout
+        while not done() and time.time() < deadline:
+            twisted.internet.reactor.iterate(0.01)
+
+    def _stopThreadPool(self):
+        import fte.transport
+
+        if fte.transport._pool is not None:
+            fte.transport._pool.stop()
+            fte.transport._pool = None
+        fte.conf.setValue('runtime.fte.transport.threads', 0)
+
+
+class _connection(object):
+
+    """An end of an obfsproxy circuit, that passes what's written to it to
+    ``receiver``, or keeps it. Its transport is itself."""
+
+    def __init__(self):
+        self.transport = self
+        self.receiver = None
+        self.written = []
+
+    def write(self, data):
+        if self.receiver is None:
+            self.written.append(data)
+        else:
+            self.receiver(data)
+
+    def pauseProducing(self):
+        pass
+
+    def resumeProducing(self):
+        pass
+
+
+class _circuit(object):
+
+    def __init__(self):
+        self.upstream = _connection()
+        self.downstream = _connection()
+        self.closed = False
+
+    def close(self):
+        self.closed = True
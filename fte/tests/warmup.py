@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+import threading
+
+import fte.conf
+import fte.defs
+import fte.dfa
+import fte.encoder
+import fte.warmup
+
+RELEASE = '20140102'
+
+
+def _hang(regex, fixed_slice):
+    """Stands in for ``fte.warmup._build`` in a pool process that never
+    returns, as if it had been killed."""
+
+    time.sleep(60)
+
+
+def _fail(regex, fixed_slice):
+    """Stands in for ``fte.warmup._build`` in a pool process whose build
+    failed."""
+
+    return [None, 1.0]
+
+
+class TestWarmup(unittest.TestCase):
+
+    def setUp(self):
+        self._defs_dir = tempfile.mkdtemp()
+        self._table_dir = tempfile.mkdtemp()
+        self._conf = {}
+        for key in ['general.defs_dir', 'fte.defs.release',
+                    'runtime.fte.warmup.timeout', 'fte.dfa.table_dir']:
+            self._conf[key] = fte.conf.getValue(key)
+        fte.conf.setValue('general.defs_dir', self._defs_dir)
+        fte.conf.setValue('fte.dfa.table_dir', self._table_dir)
+        fte.conf.setValue('fte.defs.release', RELEASE)
+        self._build = fte.warmup._build
+
+        definitions = {}
+        for i in range(4):
+            definitions['warmup' + str(i) + '-request'] = {
+                'regex': '^(warm|up|x)+' + str(i) + '$', 'fixed_slice': 64}
+        with open(os.path.join(self._defs_dir, RELEASE + '.json'), 'w') as fh:
+            json.dump(definitions, fh)
+
+    def tearDown(self):
+        fte.warmup._build = self._build
+        for key, value in self._conf.items():
+            fte.conf.setValue(key, value)
+        fte.defs.reload()
+        shutil.rmtree(self._defs_dir)
+        shutil.rmtree(self._table_dir)
+
+    def testWarmup(self):
+        languages = fte.defs.load_definitions().keys()
+        warmup = fte.warmup.warmup(languages)
+        warmup.start()
+        self.assertTrue(warmup.wait(60))
+
+        self.assertEquals(sorted(languages),
+                          sorted(warmup.getBuildTimes().keys()))
+        for language in languages:
+            definition = fte.defs.getDefinition(language)
+            self.assertTrue(definition.isReady())
+            self.assertTrue(fte.encoder.RegexEncoder(
+                definition.regex, definition.fixed_slice)._dfa.isTableShared())
+            self.assertTrue((definition.regex, definition.fixed_slice) in
+                            fte.encoder._instance)
+
+    def testWaitForPendingFormat(self):
+        definition = fte.defs.getDefinition('warmup0-request')
+        regex = str(definition.regex)
+        event = threading.Event()
+        fte.dfa._pending[(regex, 64)] = event
+
+        encoders = []
+        waiter = threading.Thread(
+            target=lambda: encoders.append(fte.encoder.RegexEncoder(regex, 64)))
+        waiter.daemon = True
+        waiter.start()
+        waiter.join(0.5)
+        self.assertTrue(waiter.is_alive())
+        self.assertFalse(definition.isReady())
+
+        dfa = fte.dfa.from_regex(regex, 64, fte.dfa.minimize(regex))
+        fte.dfa._pending.pop((regex, 64)).set()
+        waiter.join(10)
+        self.assertFalse(waiter.is_alive())
+        self.assertTrue(encoders[0]._dfa is dfa)
+
+    def testBuildFailure(self):
+        fte.warmup._build = _fail
+        # a format that no other test has built
+        regex = '^(warm|up|x)+' + str(int(time.time() * 1000)) + '$'
+        warmup = fte.warmup.warmup([])
+        warmup._formats[(regex, 64)] = ['failure-request']
+        warmup.start()
+        self.assertTrue(warmup.wait(10))
+
+        # we build the format ourselves, and record no build time
+        self.assertEquals({}, warmup.getBuildTimes())
+        self.assertFalse((regex, 64) in fte.dfa._pending)
+        fte.encoder.RegexEncoder(regex, 64)
+
+    def testTimeout(self):
+        fte.conf.setValue('runtime.fte.warmup.timeout', 1)
+        fte.warmup._build = _hang
+        # a format that no other test has built
+        regex = '^(warm|up|x)+' + str(int(time.time() * 1000)) + '$'
+        warmup = fte.warmup.warmup([])
+        warmup._formats[(regex, 64)] = ['timeout-request']
+        start = time.time()
+        warmup.start()
+        self.assertTrue((regex, 64) in fte.dfa._pending)
+        self.assertTrue(warmup.wait(10))
+        self.assertTrue(time.time() - start < 5)
+
+        # we build the format ourselves, rather than wait for warmup
+        self.assertEquals({}, warmup.getBuildTimes())
+        self.assertFalse((regex, 64) in fte.dfa._pending)
+        fte.encoder.RegexEncoder(regex, 64)
+        self.assertTrue((regex, 64) in fte.encoder._instance)
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Per-cell latency traces. Once ``start`` is called, a sample of the cells
+that ``fte.record_layer`` encodes and decodes is traced: when each stage of
+the cell began and ended. Traces are written to ``runtime.fte.trace.file``,
+as JSON lines or in a compact binary format, which ``read`` parses and
+``scripts/analyze_trace.py`` summarizes. Callers check ``enabled`` first,
+and time stages with ``now``, a monotonic clock. We write each time as the
+wall-clock time that ``start`` was called, plus the time since then on the
+monotonic clock, such that stepping the wall clock doesn't skew traces.
+"""
+
+import json
+import time
+import random
+import struct
+import threading
+
+import fte.conf
+import fte.cDFA
+
+
+"""The stages of a cell, in the order they happen. Encoding a cell, its
+plaintext waits in the record layer's buffer, is encrypted, unranked into
+covertext, and written to the socket. Decoding, its covertext waits in
+the buffer, is ranked, and decrypted."""
+STAGES = ['queue', 'encrypt', 'unrank', 'write', 'rank', 'decrypt']
+
+DIRECTIONS = ['encode', 'decode']
+
+FORMATS = ['jsonl', 'binary']
+
+# binary traces start with _MAGIC, followed by records that each start with
+# their type: a format name, then the id that the cells that follow use for
+# it, or a cell
+_MAGIC = 'FTETRACE1\n'
+_RECORD_FORMAT = 'F'
+_RECORD_CELL = 'C'
+# type, id, length of the name
+_FORMAT_HEADER = struct.Struct('!cHH')
+# type, direction, format id, plaintext bytes, timestamp, number of stages
+_CELL_HEADER = struct.Struct('!cBHIdB')
+# stage, microseconds from the cell's timestamp to the start of the stage,
+# and the stage's duration in microseconds
+_CELL_STAGE = struct.Struct('!BII')
+
+enabled = False
+
+_lock = threading.Lock()
+_file = None
+_format = None
+_rate = 1.0
+# format name -> id, of the formats written to a binary trace so far
+_format_ids = {}
+# the wall-clock and monotonic times that start was called at
+_wall_anchor = 0.0
+_monotonic_anchor = 0.0
+
+# seconds on a monotonic clock, where there is one
+now = fte.cDFA.monotonic
+
+
+class CellTrace(object):
+
+    """The stages of one cell, each ``[stage, start, end]``."""
+
+    def __init__(self, direction, format_name, length):
+        self.direction = direction
+        self.format = format_name
+        self.length = length
+        self.stages = []
+
+    def add(self, stage, start, end):
+        self.stages.append([stage, start, end])
+
+    def getDuration(self, stage):
+        """Returns the seconds spent in ``stage``, or ``None``."""
+
+        for [name, start, end] in self.stages:
+            if name == stage:
+                return end - start
+        return None
+
+    def toDict(self):
+        return {'direction': self.direction, 'format': self.format,
+                'length': self.length, 'stages': self.stages}
+
+    @staticmethod
+    def fromDict(d):
+        retval = CellTrace(d['direction'], d['format'], d['length'])
+        for [stage, start, end] in d['stages']:
+            retval.add(stage, start, end)
+        return retval
+
+
+def sample():
+    """Returns ``True`` if the next cell should be traced, at
+    ``runtime.fte.trace.rate``."""
+
+    return _rate >= 1.0 or random.random() < _rate
+
+
+def write(traces):
+    """Writes each of ``traces`` to our trace file."""
+
+    with _lock:
+        if _file is None:
+            return
+        for trace in traces:
+            trace = _toWallClock(trace)
+            if _format == 'jsonl':
+                _file.write(json.dumps(trace.toDict(),
+                                       separators=(',', ':')) + '\n')
+            else:
+                _writeBinary(trace)
+
+
+def _toWallClock(trace):
+    """Returns a copy of ``trace``, with its times from ``now`` as
+    wall-clock times."""
+
+    retval = CellTrace(trace.direction, trace.format, trace.length)
+    offset = _wall_anchor - _monotonic_anchor
+    for [stage, start, end] in trace.stages:
+        retval.add(stage, start + offset, end + offset)
+    return retval
+
+
+def _writeBinary(trace):
+    format_id = _format_ids.get(trace.format)
+    if format_id is None:
+        format_id = _format_ids[trace.format] = len(_format_ids)
+        name = trace.format.encode('utf-8')
+        _file.write(_FORMAT_HEADER.pack(_RECORD_FORMAT, format_id, len(name)) +
+                    name)
+
+    timestamp = min(start for [stage, start, end] in trace.stages)
+    data = [_CELL_HEADER.pack(_RECORD_CELL,
+                              DIRECTIONS.index(trace.direction), format_id,
+                              trace.length, timestamp, len(trace.stages))]
+    for [stage, start, end] in trace.stages:
+        data.append(_CELL_STAGE.pack(
+            STAGES.index(stage), int(round((start - timestamp) * 1e6)),
+            max(0, int(round((end - start) * 1e6)))))
+    _file.write(''.join(data))
+
+
+def read(path):
+    """Yields each ``CellTrace`` in the trace file ``path``, of either
+    format. Timestamps in binary traces are rounded to microseconds.
+    """
+
+    with open(path, 'rb') as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            f.seek(0)
+            for line in f:
+                if line.strip():
+                    yield CellTrace.fromDict(json.loads(line))
+            return
+
+        formats = {}
+        while True:
+            record_type = f.read(1)
+            if not record_type:
+                return
+            if record_type == _RECORD_FORMAT:
+                [_, format_id, name_len] = _FORMAT_HEADER.unpack(
+                    record_type + f.read(_FORMAT_HEADER.size - 1))
+                formats[format_id] = f.read(name_len).decode('utf-8')
+                continue
+
+            [_, direction, format_id, length, timestamp, num_stages] = \
+                _CELL_HEADER.unpack(record_type +
+                                    f.read(_CELL_HEADER.size - 1))
+            trace = CellTrace(DIRECTIONS[direction], formats[format_id],
+                              length)
+            for i in range(num_stages):
+                [stage, offset, duration] = _CELL_STAGE.unpack(
+                    f.read(_CELL_STAGE.size))
+                start = timestamp + offset / 1e6
+                trace.add(STAGES[stage], start, start + duration / 1e6)
+            yield trace
+
+
+def start():
+    """Start tracing a sample of ``runtime.fte.trace.rate`` of all cells,
+    to ``runtime.fte.trace.file`` in ``runtime.fte.trace.format``.
+    """
+
+    global enabled, _file, _format, _rate, _wall_anchor, _monotonic_anchor
+
+    trace_format = fte.conf.getValue('runtime.fte.trace.format')
+    if trace_format not in FORMATS:
+        raise ValueError('Unknown trace format: ' + str(trace_format))
+
+    with _lock:
+        _format = trace_format
+        _rate = fte.conf.getValue('runtime.fte.trace.rate')
+        _format_ids.clear()
+        _wall_anchor = time.time()
+        _monotonic_anchor = now()
+        _file = open(fte.conf.getValue('runtime.fte.trace.file'), 'wb')
+        if _format == 'binary':
+            _file.write(_MAGIC)
+    enabled = True
+
+
+def stop():
+    """Stop tracing, and close our trace file."""
+
+    global enabled, _file
+
+    enabled = False
+    with _lock:
+        if _file is not None:
+            _file.close()
+            _file = None
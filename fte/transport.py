@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The pluggable transport that ``bin/fteproxy --managed`` runs for Tor,
+on obfsproxy and Twisted. It's in a module of its own, such that
+``import fte`` doesn't load either of them.
+"""
+
+import obfsproxy.network.network as network
+import obfsproxy.network.socks as socks
+import obfsproxy.network.extended_orport as extended_orport
+import obfsproxy.transports.base
+
+import twisted.internet
+import twisted.internet.threads
+import twisted.python.failure
+import twisted.python.threadpool
+
+import fte
+import fte.conf
+import fte.defs
+import fte.logger
+import fte.encrypter
+
+
+# the thread pool of every FTETransport, started by the first that uses it
+_pool = None
+
+
+def getThreadPool():
+    """Returns the pool of ``runtime.fte.transport.threads`` threads on which
+    transports encode and decode cells, or ``None`` if that's zero. It's
+    started on first use, and stopped when the reactor shuts down.
+    """
+
+    global _pool
+
+    threads = fte.conf.getValue('runtime.fte.transport.threads')
+    if not threads:
+        return None
+    if _pool is None:
+        _pool = twisted.python.threadpool.ThreadPool(1, threads,
+                                                     'fte.transport')
+        _pool.start()
+        twisted.internet.reactor.addSystemEventTrigger('during', 'shutdown',
+                                                       _pool.stop)
+    return _pool
+
+
+class _pipeline(object):
+
+    """Calls ``process`` with the data pushed to it, in order and one call
+    at a time, on the threads of ``pool``, and passes each result to
+    ``write`` on the reactor thread, or the failure to ``fail``. Data pushed
+    while a call runs is processed by the next call all at once, so a busy
+    circuit's cells are written in batches. We stop reading from ``source``
+    while more than ``runtime.fte.relay.high_watermark`` bytes wait.
+    """
+
+    def __init__(self, pool, process, write, fail, source):
+        self._pool = pool
+        self._process = process
+        self._write = write
+        self._fail = fail
+        self._source = source
+        self._high_watermark = fte.conf.getValue(
+            'runtime.fte.relay.high_watermark')
+        self._pending = []
+        self._pending_len = 0
+        self._running = False
+        self._paused = False
+
+    def push(self, data):
+        self._pending.append(data)
+        self._pending_len += len(data)
+        if not self._running:
+            self._next()
+        elif self._high_watermark is not None and not self._paused and \
+                self._pending_len > self._high_watermark:
+            self._paused = True
+            self._source.transport.pauseProducing()
+
+    def _next(self):
+        data = ''.join(self._pending)
+        self._pending = []
+        self._pending_len = 0
+        if self._paused:
+            self._paused = False
+            self._source.transport.resumeProducing()
+
+        self._running = True
+        d = twisted.internet.threads.deferToThreadPool(
+            twisted.internet.reactor, self._pool, self._process, data)
+        d.addBoth(self._done)
+
+    def _done(self, result):
+        self._running = False
+        if isinstance(result, twisted.python.failure.Failure):
+            self._pending = []
+            self._pending_len = 0
+            self._fail(result)
+            return
+        self._write(result)
+        if self._pending:
+            self._next()
+
+
+class FTETransport(fte.FTEHelper, obfsproxy.transports.base.BaseTransport):
+
+    def __init__(self, pt_config):
+        self._isClient = (fte.conf.getValue('runtime.mode') == 'client')
+        self._isServer = not self._isClient
+        if self._isClient:
+            outgoing = fte.defs.getDefinition(
+                fte.conf.getValue('runtime.state.upstream_language'))
+            incoming = fte.defs.getDefinition(
+                fte.conf.getValue('runtime.state.downstream_language'))
+            self._outgoing_regex = outgoing.regex
+            self._outgoing_fixed_slice = outgoing.fixed_slice
+            self._incoming_regex = incoming.regex
+            self._incoming_fixed_slice = incoming.fixed_slice
+        else:
+            self._outgoing_regex = None
+            self._outgoing_fixed_slice = -1
+            self._incoming_regex = None
+            self._incoming_fixed_slice = -1
+
+        self._K1 = fte.conf.getValue('runtime.fte.encrypter.key')[0:16]
+        self._K2 = fte.conf.getValue('runtime.fte.encrypter.key')[16:32]
+        self._encrypter = fte.encrypter.Encrypter(K1=self._K1,
+                                                  K2=self._K2)
+
+        self._negotiation_manager = fte.NegotiationManager()
+        self._negotiationComplete = False
+        self._incoming_buffer = ''
+        self._preNegotiationBuffer_outgoing = ''
+        self._preNegotiationBuffer_incoming = ''
+
+        # on the reactor thread, if None
+        self._pool = getThreadPool()
+        self._encoding = None
+        self._decoding = None
+
+    def circuitConnected(self, circuit=None):
+        """Stop reading from either side of our circuit while the other side
+        has more than ``runtime.fte.relay.high_watermark`` bytes to write,
+        until it has written them, with Twisted's push producers.
+        """
+
+        # older obfsproxy releases pass our circuit
+        if circuit is None:
+            circuit = self.circuit
+
+        high_watermark = fte.conf.getValue('runtime.fte.relay.high_watermark')
+        if high_watermark is None:
+            return
+        for [producer, consumer] in [[circuit.upstream, circuit.downstream],
+                                     [circuit.downstream, circuit.upstream]]:
+            consumer.transport.bufferSize = high_watermark
+            consumer.transport.registerProducer(producer.transport, True)
+
+    def receivedDownstream(self, data, circuit=None):
+        """decode fteproxy stream"""
+
+        # older obfsproxy releases pass our circuit
+        if circuit is None:
+            circuit = self.circuit
+
+        data = data.read()
+        if self._pool is None:
+            try:
+                plaintext = self._decode(data)
+            except fte.NegotiationFailedException:
+                self._fail(circuit, twisted.python.failure.Failure())
+                return
+            self._writeUpstream(circuit, plaintext)
+            return
+
+        if self._decoding is None:
+            self._decoding = _pipeline(
+                self._pool, self._decode,
+                lambda plaintext: self._writeUpstream(circuit, plaintext),
+                lambda failure: self._fail(circuit, failure),
+                circuit.downstream)
+        self._decoding.push(data)
+
+    def receivedUpstream(self, data, circuit=None):
+        """encode fteproxy stream"""
+
+        if circuit is None:
+            circuit = self.circuit
+
+        self._encodeUpstream(circuit, data.read())
+
+    def _encodeUpstream(self, circuit, data):
+        if self._pool is None:
+            self._writeDownstream(circuit, self.encode(data))
+            return
+
+        if self._encoding is None:
+            self._encoding = _pipeline(
+                self._pool, self.encode,
+                lambda covertext: self._writeDownstream(circuit, covertext),
+                lambda failure: self._fail(circuit, failure),
+                circuit.upstream)
+        self._encoding.push(data)
+
+    def _decode(self, data):
+        try:
+            return self.decode(data)
+        except fte.ChannelNotReadyException:
+            return ''
+
+    def _writeUpstream(self, circuit, plaintext):
+        if circuit.closed:
+            return
+        if plaintext:
+            circuit.upstream.write(plaintext)
+        self._flushOutgoing(circuit)
+
+    def _writeDownstream(self, circuit, covertext):
+        if circuit.closed:
+            return
+        if covertext:
+            circuit.downstream.write(covertext)
+        self._flushOutgoing(circuit)
+
+    def _flushOutgoing(self, circuit):
+        """A server buffers what it sends until it has negotiated. With a
+        thread pool, negotiation may complete on a decoding thread while an
+        encoding thread buffers, so we check once either has finished.
+        """
+
+        if self._preNegotiationBuffer_outgoing and self._negotiationComplete:
+            self._encodeUpstream(circuit, '')
+
+    def _fail(self, circuit, failure):
+        fte.logger.error('fte.transport closing circuit: ' +
+                         failure.getErrorMessage())
+        circuit.close()
+
+
+class FTETransportClient(FTETransport):
+    pass
+
+
+class FTETransportServer(FTETransport):
+    pass
+
+
+def launch_transport_listener(transport, bindaddr, role, remote_addrport, pt_config, ext_or_cookie_file=None):
+    """
+    Launch a listener for 'transport' in role 'role' (socks/client/server/ext_server).
+
+    If 'bindaddr' is set, then listen on bindaddr. Otherwise, listen
+    on an ephemeral port on localhost.
+    'remote_addrport' is the TCP/IP address of the other end of the
+    circuit. It's not used if we are in 'socks' role.
+
+    'pt_config' contains configuration options (such as the state location)
+    which are of interest to the pluggable transport.
+
+    'ext_or_cookie_file' is the filesystem path where the Extended
+    ORPort Authentication cookie is stored. It's only used in
+    'ext_server' mode.
+
+    Return a tuple (addr, port) representing where we managed to bind.
+
+    Throws obfsproxy.transports.transports.TransportNotFound if the
+    transport could not be found.
+
+    Throws twisted.internet.error.CannotListenError if the listener
+    could not be set up.
+    """
+
+    listen_host = bindaddr[0] if bindaddr else 'localhost'
+    listen_port = int(bindaddr[1]) if bindaddr else 0
+
+    if role == 'socks':
+        transport_class = FTETransportClient
+        factory = socks.SOCKSv4Factory(transport_class, pt_config)
+    elif role == 'ext_server':
+        assert(remote_addrport and ext_or_cookie_file)
+        transport_class = FTETransportServer
+        factory = extended_orport.ExtORPortServerFactory(
+            remote_addrport, ext_or_cookie_file, transport, transport_class, pt_config)
+    elif role == 'client':
+        assert(remote_addrport)
+        transport_class = FTETransportClient
+        factory = network.StaticDestinationServerFactory(
+            remote_addrport, role, transport_class, pt_config)
+    elif role == 'server':
+        assert(remote_addrport)
+        transport_class = FTETransportServer
+        factory = network.StaticDestinationServerFactory(
+            remote_addrport, role, transport_class, pt_config)
+    else:
+        raise fte.InvalidRoleException()
+
+    addrport = twisted.internet.reactor.listenTCP(
+        listen_port, factory, interface=listen_host)
+
+    return (addrport.getHost().host, addrport.getHost().port)
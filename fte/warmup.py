@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import threading
+import traceback
+import multiprocessing
+
+import fte.conf
+import fte.cDFA
+import fte.defs
+import fte.dfa
+import fte.encoder
+import fte.logger
+
+# the number of seconds between the watchdog's checks on the pool
+_WATCH_INTERVAL = 0.5
+
+
+def _build(regex, fixed_slice):
+    """Run in a pool process. Returns ``[att_fst, elapsed]``, where
+    ``att_fst`` is the minimized FST of ``regex``, or ``None`` on failure.
+    If there's a ``fte.dfa.table_dir``, we also write the rank table to it,
+    such that our parent maps it rather than building it.
+    """
+
+    start = time.time()
+    try:
+        att_fst = fte.dfa.minimize(regex)
+        table_path = fte.dfa._getTablePath(att_fst, fixed_slice)
+        if table_path:
+            fte.cDFA.DFA(att_fst, fixed_slice, table_path)
+    except Exception:
+        fte.logger.error(traceback.format_exc())
+        att_fst = None
+    return [att_fst, time.time() - start]
+
+
+class warmup(object):
+
+    """Builds the encoder of each of ``languages`` in a pool of
+    ``runtime.fte.warmup.processes`` processes, while we get on with
+    listening. Each process hands back the minimized FST of its format,
+    and its rank table through ``fte.dfa.table_dir``. Until a format is
+    built, ``fte.dfa.from_regex`` waits for it rather than building it.
+    A watchdog thread gives up on formats whose build failed, or that aren't
+    built within ``runtime.fte.warmup.timeout`` seconds, e.g. because a pool
+    process was killed, such that whoever needs them builds them.
+    """
+
+    def __init__(self, languages):
+        # the languages of each (regex, fixed_slice), some share one
+        self._formats = {}
+        for language in languages:
+            definition = fte.defs.getDefinition(language)
+            key = (str(definition.regex), int(definition.fixed_slice))
+            self._formats.setdefault(key, []).append(language)
+        self._build_times = {}
+        self._remaining = 0
+        self._start_time = None
+        self._pool = None
+        # the AsyncResult of each build
+        self._results = {}
+        # the fte.dfa._pending event of each build we haven't released
+        self._events = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    def start(self):
+        """Start building each format that isn't built, and return at once."""
+
+        self._start_time = time.time()
+        keys = []
+        with fte.dfa._lock:
+            for key in self._formats:
+                if key in fte.dfa._instance:
+                    for language in self._formats[key]:
+                        self._build_times[language] = 0.0
+                elif key not in fte.dfa._pending:
+                    # we hold this build, see fte.dfa.single_flight
+                    fte.dfa._pending[key] = threading.Event()
+                    self._events[key] = fte.dfa._pending[key]
+                    keys.append(key)
+        self._remaining = len(keys)
+        if not keys:
+            self._ready.set()
+            return
+
+        # there's no use for more processes than formats
+        processes = fte.conf.getValue('runtime.fte.warmup.processes')
+        self._pool = multiprocessing.Pool(
+            min(processes or multiprocessing.cpu_count(), len(keys)))
+        for key in keys:
+            self._results[key] = self._pool.apply_async(
+                _build, key,
+                callback=lambda result, key=key: self._onBuilt(key, result))
+        self._pool.close()
+
+        watchdog = threading.Thread(target=self._watch, args=(self._pool,))
+        watchdog.daemon = True
+        watchdog.start()
+
+    def wait(self, timeout=None):
+        """Returns ``True`` once every format is built or given up on, or
+        ``False`` if ``timeout`` seconds pass first.
+        """
+
+        self._ready.wait(timeout)
+        if self._ready.is_set() and self._pool is not None:
+            self._pool.join()
+            self._pool = None
+        return self._ready.is_set()
+
+    def isReady(self):
+        return self._ready.is_set()
+
+    def getBuildTimes(self):
+        """Returns the number of seconds each language took to build in its
+        pool process, for those that have been built so far. Those that
+        were built before we started took no time.
+        """
+
+        with self._lock:
+            return dict(self._build_times)
+
+    def _onBuilt(self, key, result):
+        """Called in the pool's result thread once ``key`` is built."""
+
+        [regex, fixed_slice] = key
+        [att_fst, elapsed] = result
+        try:
+            if att_fst is None:
+                fte.logger.error("fte.warmup failed to build " +
+                                 ', '.join(self._formats[key]))
+                elapsed = None
+            elif key in self._events:
+                # fte.dfa only keeps the DFA while someone holds it, we hold
+                # it until the encoder does
+                pinned = fte.dfa.from_regex(regex, fixed_slice, att_fst)
+                fte.encoder.RegexEncoder(regex, fixed_slice)
+                del pinned
+        except Exception:
+            fte.logger.error(traceback.format_exc())
+            elapsed = None
+        finally:
+            self._release(key, elapsed)
+
+    def _watch(self, pool):
+        """Gives up on the builds that failed, or are still running once
+        ``runtime.fte.warmup.timeout`` seconds have passed.
+        """
+
+        timeout = fte.conf.getValue('runtime.fte.warmup.timeout')
+        while not self._ready.wait(_WATCH_INTERVAL):
+            for key, result in self._results.items():
+                if result.ready() and not result.successful():
+                    fte.logger.error("fte.warmup failed to build " +
+                                     ', '.join(self._formats[key]))
+                    self._release(key)
+            if timeout is not None and \
+                    time.time() - self._start_time >= timeout:
+                fte.logger.error("fte.warmup timed out after " +
+                                 str(timeout) + "s")
+                pool.terminate()
+                for key in self._events.keys():
+                    self._release(key)
+
+    def _release(self, key, elapsed=None):
+        """Hands ``key`` to whoever waits for it in ``fte.dfa.from_regex``,
+        built or not, the first time it's called for ``key``. ``elapsed`` is
+        ``None`` if we gave up on it.
+        """
+
+        with self._lock:
+            event = self._events.pop(key, None)
+        if event is None:
+            return
+        # if we failed, whoever needs this format builds it themselves
+        with fte.dfa._lock:
+            if fte.dfa._pending.get(key) is event:
+                del fte.dfa._pending[key]
+        event.set()
+
+        languages = self._formats[key]
+        if elapsed is not None:
+            fte.logger.info("fte.warmup built " + ', '.join(languages) +
+                            " in " + str(round(elapsed, 3)) + "s")
+        with self._lock:
+            if elapsed is not None:
+                for language in languages:
+                    self._build_times[language] = elapsed
+            self._remaining -= 1
+            done = (self._remaining == 0)
+        if done:
+            fte.logger.info("fte.warmup built every format in " +
+                            str(round(time.time() - self._start_time, 3)) +
+                            "s")
+            self._ready.set()
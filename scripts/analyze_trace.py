@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of fteproxy.
+#
+# fteproxy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fteproxy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fteproxy.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+"""Summarizes a trace written by fteproxy --trace-file: for each direction
+and format, the p50 and p99 of each stage of a cell, and the share of all
+time each stage took, as a bar. With --folded, prints folded stacks for
+flamegraph.pl instead.
+"""
+
+import os
+import sys
+import argparse
+
+sys.path.append(
+    os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')))
+
+import fte.trace
+
+
+BAR_WIDTH = 40
+
+
+def percentile(values, p):
+    """Returns the ``p``th percentile of the sorted list ``values``."""
+
+    index = int(round(p / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+def load(path):
+    """Returns the duration of each stage of each traced cell in ``path``,
+    grouped by ``(direction, format)`` then stage.
+    """
+
+    retval = {}
+    for trace in fte.trace.read(path):
+        stages = retval.setdefault((trace.direction, trace.format), {})
+        for [stage, start, end] in trace.stages:
+            stages.setdefault(stage, []).append(max(0.0, end - start))
+    return retval
+
+
+def summarize(durations):
+    for [direction, format_name] in sorted(durations.keys()):
+        stages = durations[(direction, format_name)]
+        total = sum(sum(values) for values in stages.values()) or 1.0
+        cells = max(len(values) for values in stages.values())
+        print ' + ' + direction + ' ' + format_name + ': ' + str(cells) + \
+            ' cells'
+        for stage in fte.trace.STAGES:
+            if stage not in stages:
+                continue
+            values = sorted(stages[stage])
+            share = sum(values) / total
+            print '    - %-8s p50 %9.3fms  p99 %9.3fms  %5.1f%% %s' % (
+                stage, percentile(values, 50) * 1000,
+                percentile(values, 99) * 1000, share * 100,
+                '#' * int(round(share * BAR_WIDTH)))
+
+
+def folded(durations):
+    for [direction, format_name] in sorted(durations.keys()):
+        stages = durations[(direction, format_name)]
+        for stage in fte.trace.STAGES:
+            if stage in stages:
+                print direction + ';' + format_name + ';' + stage + ' ' + \
+                    str(int(round(sum(stages[stage]) * 1e6)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Summarize an fteproxy cell trace.')
+    parser.add_argument('trace_file')
+    parser.add_argument('--folded', action='store_true', default=False,
+                        help='Print the microseconds in each stage as folded stacks, for flamegraph.pl')
+    args = parser.parse_args()
+
+    durations = load(args.trace_file)
+    if args.folded:
+        folded(durations)
+    else:
+        summarize(durations)
+
+
+if __name__ == '__main__':
+    main()
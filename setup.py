@@ -70,4 +70,7 @@ setup(name='Format-Transforming Encrypion (FTE)',
            "pycrypto",
            "twisted",
       ],
+      extras_require={
+           "aio": ["trollius"],
+      },
       )